@@ -0,0 +1,180 @@
+import asyncio
+import math
+import os
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+
+# --- Configuration ---
+# Seconds a request may wait for a slot before being shed
+QUEUE_DEADLINE = float(os.getenv("ADMISSION_QUEUE_DEADLINE", "5"))
+
+# Requests (running + queued) allowed per client address, 0 for no per-client limit
+PER_CLIENT = int(os.getenv("ADMISSION_PER_CLIENT", "16"))
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed; `retry_after` is a hint in whole seconds."""
+
+    def __init__(self, name, reason, retry_after):
+        super().__init__(f"{name}: overloaded ({reason})")
+        self.name = name
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounded concurrency for an expensive endpoint.
+
+    At most `limit` requests run at once; up to `queue_size` more wait in
+    FIFO order for at most `deadline` seconds. A request that finds the
+    queue full, waits past its deadline, or whose client already has
+    `per_client` requests running or queued is shed with Overloaded, so
+    latency stays bounded under overload instead of every request slowing
+    down together.
+    """
+
+    def __init__(self, name, limit, queue_size, per_client=PER_CLIENT, deadline=QUEUE_DEADLINE):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.per_client = per_client
+        self.deadline = deadline
+        self.active = 0
+        self._waiters = deque()   # futures of queued requests, oldest first
+        self._clients = Counter()  # client -> running + queued requests
+        self._service_time = 1.0  # moving average of the seconds a slot is held
+        self.admitted = 0
+        self.queued = 0
+        self.shed = Counter()     # reason -> requests shed
+
+    def retry_after(self):
+        """Seconds until the current backlog should have drained (at least 1)."""
+        backlog = len(self._waiters) + self.active
+        return max(1, math.ceil(self._service_time * backlog / max(self.limit, 1)))
+
+    def _reject(self, reason):
+        self.shed[reason] += 1
+        raise Overloaded(self.name, reason, self.retry_after())
+
+    async def acquire(self, client=None):
+        if client is not None:
+            if self.per_client and self._clients[client] >= self.per_client:
+                self._reject("client")
+            self._clients[client] += 1
+        try:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+            elif len(self._waiters) >= self.queue_size:
+                self._reject("queue")
+            else:
+                await self._wait()
+        except BaseException:
+            self._forget(client)
+            raise
+        self.admitted += 1
+
+    async def _wait(self):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._waiters.append(future)
+        self.queued += 1
+        expire = loop.call_later(self.deadline, self._expire, future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            # A slot handed over just before the cancellation must go to the next waiter
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self._release_slot()
+            raise
+        except Overloaded:
+            self._reject("deadline")
+        finally:
+            expire.cancel()
+            if future in self._waiters:
+                self._waiters.remove(future)
+
+    def _expire(self, future):
+        if not future.done():
+            future.set_exception(Overloaded(self.name, "deadline", 0))
+
+    def release(self, client=None):
+        self._forget(client)
+        self._release_slot()
+
+    def _forget(self, client):
+        if client is not None:
+            self._clients[client] -= 1
+            if self._clients[client] <= 0:
+                del self._clients[client]
+
+    def _release_slot(self):
+        # Hand the slot over to the oldest waiter still waiting
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, client=None):
+        """Holds a slot for the duration of the block (raises Overloaded if shed)."""
+        await self.acquire(client)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._service_time = 0.8 * self._service_time + 0.2 * (time.monotonic() - start)
+            self.release(client)
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "queue_size": self.queue_size,
+            "per_client": self.per_client,
+            "deadline_seconds": self.deadline,
+            "active": self.active,
+            "waiting": len(self._waiters),
+            "clients": len(self._clients),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "shed": dict(self.shed),
+            "mean_service_seconds": round(self._service_time, 3),
+        }
+
+
+class Coalescer:
+    """
+    Per-key request coalescing: concurrent calls with the same key share
+    the result (or exception) of a single in-flight computation. The
+    computation is shielded, so a caller going away does not cancel it
+    for the others.
+    """
+
+    def __init__(self):
+        self._inflight = {}  # key -> asyncio.Task
+        self.calls = 0
+        self.coalesced = 0
+
+    async def run(self, key, factory):
+        """Result of `factory()` (a coroutine function), shared with concurrent calls for `key`."""
+        self.calls += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._done(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # retrieved here so an unawaited failure is not logged
+
+    def stats(self):
+        return {"in_flight": len(self._inflight), "calls": self.calls, "coalesced": self.coalesced}
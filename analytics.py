@@ -0,0 +1,494 @@
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+import forecast_store
+from forecast_store import FORECAST_COLUMNS, TIME_FORMAT, location_key
+
+# --- Configuration ---
+# Forecast slots are kept this long after their time, to be compared with sensor readings
+SLOT_RETENTION_HOURS = float(os.getenv("ANALYTICS_SLOT_RETENTION_HOURS", "72"))
+
+# Location of each sensor, e.g. {"f1": [36.8, 10.18]}; other sensors are at the default location
+SENSOR_LOCATIONS = json.loads(os.getenv("SENSOR_LOCATIONS", "{}"))
+
+# Fetches per chunk when building the aggregates from an existing log
+CATCH_UP_FETCHES = 200
+
+# Drift is grouped by lead time in whole days (0 = the next 24 hours), the last group holding the rest
+LEAD_DAYS = 5
+
+# A slot counts as rainy above this rain probability (%)
+RAINY_PERCENT = 50
+
+# Sensor metric -> (forecast column, factor turning the reading into the column's unit)
+OBSERVED_METRICS = {
+    "temperature": ("temp_c", 1.0),
+    "humidity": ("humidity_percent", 1.0),
+    "rain": ("precipitation_prob_percent", 100.0),  # 0/1 rain detector against rain probability
+}
+
+# A reading is compared with the forecast slot closest to it, if within this many seconds
+MATCH_SECONDS = 90 * 60
+
+_MARK = "analytics:last_fetched_at"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS analytics_locations (
+    location_key TEXT PRIMARY KEY,
+    location_name TEXT,
+    latitude REAL,
+    longitude REAL,
+    fetches INTEGER NOT NULL,
+    first_fetched_at TEXT,
+    last_fetched_at TEXT
+);
+CREATE TABLE IF NOT EXISTS analytics_slots (
+    location_key TEXT NOT NULL,
+    forecast_time TEXT NOT NULL,
+    fetched_at TEXT NOT NULL,
+    temp_c REAL,
+    humidity_percent REAL,
+    precipitation_prob_percent REAL,
+    PRIMARY KEY (location_key, forecast_time)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS analytics_drift (
+    location_key TEXT NOT NULL,
+    day TEXT NOT NULL,
+    lead_day INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    temp_sum REAL NOT NULL,
+    temp_abs REAL NOT NULL,
+    humidity_abs REAL NOT NULL,
+    pop_sum REAL NOT NULL,
+    pop_abs REAL NOT NULL,
+    PRIMARY KEY (location_key, day, lead_day)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS analytics_rain (
+    location_key TEXT NOT NULL,
+    day TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    pop_sum REAL NOT NULL,
+    pop_max REAL NOT NULL,
+    rainy INTEGER NOT NULL,
+    PRIMARY KEY (location_key, day)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS analytics_observed (
+    location_key TEXT NOT NULL,
+    day TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    err_sum REAL NOT NULL,
+    err_abs REAL NOT NULL,
+    err_sq REAL NOT NULL,
+    PRIMARY KEY (location_key, day, metric)
+) WITHOUT ROWID;
+"""
+
+# Positions of the forecast columns in the rows given to store listeners (location_key first, fetched_at last)
+_COL = {name: i + 1 for i, name in enumerate(FORECAST_COLUMNS)}
+
+
+def _utc_epoch(forecast_time):
+    # OpenWeatherMap dt_txt values are UTC
+    return datetime.strptime(forecast_time, TIME_FORMAT).replace(tzinfo=timezone.utc).timestamp()
+
+
+def _ratio(total, count, digits=2):
+    return round(total / count, digits) if count else None
+
+
+class ForecastAnalytics:
+    """
+    Running aggregates over the forecast log, kept in the forecast store.
+
+    Every append to the store updates, in the same transaction:
+    - drift: change of temperature, humidity and rain probability of a slot
+      between two fetches, per location, fetch day and lead day;
+    - rain: rain probability forecast for each day, per location;
+    - the latest forecast of each slot, compared with sensor readings
+      (record_observations) into error sums per location, day and metric.
+
+    Queries read a few aggregate rows per day instead of the history, which
+    retention may already have deleted. Aggregates for fetches logged while
+    the analytics were not running are built by catch_up().
+
+    `locate(lat, lon)` gives the position a location's forecasts are fetched
+    and stored at (e.g. the forecast cache's grid cell); queries and sensor
+    readings are matched with the forecasts of that position.
+    """
+
+    def __init__(self, path=forecast_store.FORECAST_STORE_PATH, locate=None):
+        self.path = path
+        self.locate = locate
+        self.store = None
+        self.ready = False
+        self.error = None
+        self.fetches = 0
+        self.observations = 0
+        self._marks = {}  # (sensor, metric) -> last reading timestamp processed
+
+    @property
+    def enabled(self):
+        return forecast_store.is_store_path(self.path)
+
+    def start(self):
+        """Opens the store and listens to its appends (no-op for a CSV log)."""
+        if self.store is not None or not self.enabled:
+            return
+        store = forecast_store.open_store(self.path)
+        with store._lock:
+            store._conn.executescript(_SCHEMA)
+            store._conn.commit()
+            store.listeners.append(self._on_append)
+        self.store = store
+
+    def _key(self, lat, lon):
+        if self.locate is not None:
+            lat, lon = self.locate(lat, lon)
+        return location_key(lat, lon)
+
+    # --- Updates ---
+
+    def _on_append(self, conn, rows):
+        # Until catch_up() has finished, the new rows are left to it (they are after its mark)
+        if not self.ready:
+            return
+        fetches = {}
+        for row in rows:
+            fetches.setdefault((row[0], row[-1]), []).append(row)
+        for (key, fetched_at), fetch in fetches.items():
+            self._apply_fetch(conn, key, fetched_at, fetch)
+        self._set_mark(conn, max(fetched_at for _, fetched_at in fetches))
+
+    def catch_up(self):
+        """
+        Adds the fetches logged after the last one aggregated (the whole log
+        the first time), in chunks so appends are not blocked for long.
+        Returns the number of fetches added.
+
+        On failure the current chunk is rolled back and the error is kept in
+        `error` (see stats()); the analytics stay not ready, so the remaining
+        fetches are added by the next catch_up().
+        """
+        if self.store is None:
+            return 0
+        conn, lock = self.store._conn, self.store._lock
+        columns = f"location_key, {', '.join(FORECAST_COLUMNS)}, fetched_at"
+        added = 0
+        self.error = None
+        while True:
+            with lock:
+                try:
+                    mark = conn.execute("SELECT value FROM meta WHERE key = ?", (_MARK,)).fetchone()
+                    mark = mark[0] if mark else ""
+                    stamps = [row[0] for row in conn.execute(
+                        "SELECT DISTINCT fetched_at FROM forecasts WHERE fetched_at > ? ORDER BY fetched_at LIMIT ?",
+                        (mark, CATCH_UP_FETCHES),
+                    )]
+                    if not stamps:
+                        self.ready = True
+                        return added
+                    rows = conn.execute(
+                        f"SELECT {columns} FROM forecasts WHERE fetched_at > ? AND fetched_at <= ? "
+                        "ORDER BY fetched_at, location_key",
+                        (mark, stamps[-1]),
+                    ).fetchall()
+                    fetches = {}
+                    for row in rows:
+                        fetches.setdefault((row[0], row[-1]), []).append(row)
+                    for (key, fetched_at), fetch in fetches.items():
+                        self._apply_fetch(conn, key, fetched_at, fetch)
+                    self._set_mark(conn, stamps[-1])
+                    conn.commit()
+                except Exception as e:
+                    # Not committed by the next append either
+                    conn.rollback()
+                    self.error = f"catch-up stopped after {added} fetches: {e}"
+                    print(f"Warning: forecast analytics {self.error}")
+                    return added
+                added += len(fetches)
+
+    @staticmethod
+    def _set_mark(conn, fetched_at):
+        conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = MAX(value, excluded.value)",
+            (_MARK, fetched_at),
+        )
+
+    def _apply_fetch(self, conn, key, fetched_at, rows):
+        """Folds one fetch (all rows of one location with one fetched_at) into the aggregates."""
+        fetched = datetime.fromisoformat(fetched_at)
+        previous = {
+            row[0]: row[1:] for row in conn.execute(
+                "SELECT forecast_time, fetched_at, temp_c, humidity_percent, precipitation_prob_percent "
+                "FROM analytics_slots WHERE location_key = ?", (key,),
+            )
+        }
+        drift = {}  # lead_day -> [n, temp_sum, temp_abs, humidity_abs, pop_sum, pop_abs]
+        rain = {}  # forecast day -> [n, pop_sum, pop_max, rainy]
+        slots = []
+        for row in rows:
+            forecast_time = str(row[_COL['forecast_time']])
+            temp = row[_COL['temp_c']]
+            humidity = row[_COL['humidity_percent']]
+            pop = row[_COL['precipitation_prob_percent']]
+            slots.append((key, forecast_time, fetched_at, temp, humidity, pop))
+            if pop is not None:
+                day = rain.setdefault(forecast_time[:10], [0, 0.0, 0.0, 0])
+                day[0] += 1
+                day[1] += pop
+                day[2] = max(day[2], pop)
+                day[3] += pop >= RAINY_PERCENT
+            before = previous.get(forecast_time)
+            if before is None or before[0] >= fetched_at or None in (temp, humidity, pop) or None in before[1:]:
+                continue
+            lead = (datetime.strptime(forecast_time, TIME_FORMAT) - fetched).total_seconds() / 86400
+            if lead < 0:
+                continue
+            sums = drift.setdefault(min(int(lead), LEAD_DAYS - 1), [0, 0.0, 0.0, 0.0, 0.0, 0.0])
+            sums[0] += 1
+            sums[1] += temp - before[1]
+            sums[2] += abs(temp - before[1])
+            sums[3] += abs(humidity - before[2])
+            sums[4] += pop - before[3]
+            sums[5] += abs(pop - before[3])
+
+        day = fetched_at[:10]
+        conn.executemany(
+            "INSERT INTO analytics_drift VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT DO UPDATE SET n = n + excluded.n, temp_sum = temp_sum + excluded.temp_sum, "
+            "temp_abs = temp_abs + excluded.temp_abs, humidity_abs = humidity_abs + excluded.humidity_abs, "
+            "pop_sum = pop_sum + excluded.pop_sum, pop_abs = pop_abs + excluded.pop_abs",
+            [(key, day, lead_day, *sums) for lead_day, sums in drift.items()],
+        )
+        conn.executemany(
+            "INSERT INTO analytics_rain VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT DO UPDATE SET n = n + excluded.n, pop_sum = pop_sum + excluded.pop_sum, "
+            "pop_max = MAX(pop_max, excluded.pop_max), rainy = rainy + excluded.rainy",
+            [(key, forecast_day, *sums) for forecast_day, sums in rain.items()],
+        )
+        conn.executemany(
+            "INSERT INTO analytics_slots VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT DO UPDATE SET fetched_at = excluded.fetched_at, temp_c = excluded.temp_c, "
+            "humidity_percent = excluded.humidity_percent, "
+            "precipitation_prob_percent = excluded.precipitation_prob_percent "
+            "WHERE excluded.fetched_at >= analytics_slots.fetched_at",
+            slots,
+        )
+        conn.execute(
+            "DELETE FROM analytics_slots WHERE location_key = ? AND forecast_time < ?",
+            (key, (fetched - timedelta(hours=SLOT_RETENTION_HOURS)).strftime(TIME_FORMAT)),
+        )
+        first = rows[0]
+        conn.execute(
+            "INSERT INTO analytics_locations VALUES (?, ?, ?, ?, 1, ?, ?) "
+            "ON CONFLICT DO UPDATE SET fetches = fetches + 1, location_name = excluded.location_name, "
+            "first_fetched_at = MIN(first_fetched_at, excluded.first_fetched_at), "
+            "last_fetched_at = MAX(last_fetched_at, excluded.last_fetched_at)",
+            (key, first[_COL['location_name']], first[_COL['latitude']], first[_COL['longitude']],
+             fetched_at, fetched_at),
+        )
+        self.fetches += 1
+
+    def collect_observations(self, sensor_store, default_location):
+        """
+        New readings of the compared metrics since the previous call, as
+        [(location_key, metric, timestamps, values)]. Call it from the thread
+        that ingests readings; record_observations can then run in another.
+        """
+        batch = []
+        for series in sensor_store.list_series():
+            sensor, metric = series["sensor"], series["metric"]
+            if metric not in OBSERVED_METRICS:
+                continue
+            ts, values = sensor_store.since(sensor, metric, self._marks.get((sensor, metric), -np.inf))
+            if len(ts) == 0:
+                continue
+            self._marks[(sensor, metric)] = float(ts[-1])
+            lat, lon = SENSOR_LOCATIONS.get(sensor, default_location)
+            batch.append((self._key(lat, lon), metric, ts, values))
+        return batch
+
+    def record_observations(self, batch):
+        """Adds the error of the latest forecast of each reading's slot to the accuracy aggregates."""
+        if self.store is None or not batch:
+            return 0
+        recorded = 0
+        with self.store._lock:
+            conn = self.store._conn
+            for key, metric, ts, values in batch:
+                column, factor = OBSERVED_METRICS[metric]
+                slots = conn.execute(
+                    f"SELECT forecast_time, {column} FROM analytics_slots "
+                    f"WHERE location_key = ? AND {column} IS NOT NULL ORDER BY forecast_time",
+                    (key,),
+                ).fetchall()
+                if not slots:
+                    continue
+                slot_ts = np.array([_utc_epoch(forecast_time) for forecast_time, _ in slots])
+                slot_values = np.array([value for _, value in slots], dtype=np.float64)
+                # Closest slot of each reading
+                after = np.searchsorted(slot_ts, ts)
+                left = np.clip(after - 1, 0, len(slot_ts) - 1)
+                right = np.clip(after, 0, len(slot_ts) - 1)
+                nearest = np.where(np.abs(ts - slot_ts[left]) <= np.abs(slot_ts[right] - ts), left, right)
+                keep = np.abs(slot_ts[nearest] - ts) <= MATCH_SECONDS
+                if not keep.any():
+                    continue
+                errors = slot_values[nearest[keep]] - values[keep].astype(np.float64) * factor
+                days = ts[keep].astype(np.int64).astype("datetime64[s]").astype("datetime64[D]").astype(str)
+                rows = []
+                for day in np.unique(days):
+                    day_errors = errors[days == day]
+                    rows.append((key, str(day), metric, len(day_errors), float(day_errors.sum()),
+                                 float(np.abs(day_errors).sum()), float((day_errors ** 2).sum())))
+                conn.executemany(
+                    "INSERT INTO analytics_observed VALUES (?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT DO UPDATE SET n = n + excluded.n, err_sum = err_sum + excluded.err_sum, "
+                    "err_abs = err_abs + excluded.err_abs, err_sq = err_sq + excluded.err_sq",
+                    rows,
+                )
+                recorded += int(keep.sum())
+            conn.commit()
+        self.observations += recorded
+        return recorded
+
+    # --- Queries ---
+
+    def _query(self, sql, params=()):
+        if self.store is None:
+            return []
+        with self.store._lock:
+            return self.store._conn.execute(sql, params).fetchall()
+
+    def locations(self):
+        return [
+            {
+                "location": key,
+                "name": name,
+                "lat": lat,
+                "lon": lon,
+                "fetches": fetches,
+                "first_fetched_at": first,
+                "last_fetched_at": last,
+            }
+            for key, name, lat, lon, fetches, first, last in self._query(
+                "SELECT * FROM analytics_locations ORDER BY location_key"
+            )
+        ]
+
+    def drift(self, lat, lon, days=30, today=None):
+        """
+        How much successive fetches changed their forecast for the same slot
+        over the last `days` days, per lead day and per fetch day. `bias` is
+        the mean signed change (later fetch minus earlier one).
+        """
+        key = self._key(lat, lon)
+        since = ((today or datetime.now()) - timedelta(days=days)).strftime("%Y-%m-%d")
+        by_lead = {}
+        daily = []
+        for day, lead_day, n, temp_sum, temp_abs, humidity_abs, pop_sum, pop_abs in self._query(
+            "SELECT day, lead_day, n, temp_sum, temp_abs, humidity_abs, pop_sum, pop_abs FROM analytics_drift "
+            "WHERE location_key = ? AND day >= ? ORDER BY day, lead_day",
+            (key, since),
+        ):
+            sums = by_lead.setdefault(lead_day, [0, 0.0, 0.0, 0.0, 0.0, 0.0])
+            for i, value in enumerate((n, temp_sum, temp_abs, humidity_abs, pop_sum, pop_abs)):
+                sums[i] += value
+            if not daily or daily[-1][0] != day:
+                daily.append([day, 0, 0.0, 0.0])
+            daily[-1][1] += n
+            daily[-1][2] += temp_abs
+            daily[-1][3] += pop_abs
+        return {
+            "location": key,
+            "days": days,
+            "by_lead_day": [
+                {
+                    "lead_day": lead_day,
+                    "pairs": n,
+                    "temp_mean_abs_c": _ratio(temp_abs, n),
+                    "temp_bias_c": _ratio(temp_sum, n),
+                    "humidity_mean_abs_percent": _ratio(humidity_abs, n),
+                    "rain_prob_mean_abs_percent": _ratio(pop_abs, n),
+                    "rain_prob_bias_percent": _ratio(pop_sum, n),
+                }
+                for lead_day, (n, temp_sum, temp_abs, humidity_abs, pop_sum, pop_abs) in sorted(by_lead.items())
+            ],
+            "daily": [
+                {
+                    "day": day,
+                    "pairs": n,
+                    "temp_mean_abs_c": _ratio(temp_abs, n),
+                    "rain_prob_mean_abs_percent": _ratio(pop_abs, n),
+                }
+                for day, n, temp_abs, pop_abs in daily
+            ],
+        }
+
+    def rain_trend(self, lat, lon, days=30, today=None):
+        """
+        Rain probability forecast for each day from `days` days ago (all
+        fetches covering that day), and its linear trend in points per day.
+        """
+        key = self._key(lat, lon)
+        since = ((today or datetime.now()) - timedelta(days=days)).strftime("%Y-%m-%d")
+        rows = self._query(
+            "SELECT day, n, pop_sum, pop_max, rainy FROM analytics_rain "
+            "WHERE location_key = ? AND day >= ? ORDER BY day",
+            (key, since),
+        )
+        series = [
+            {
+                "day": day,
+                "slots": n,
+                "mean_percent": _ratio(pop_sum, n, 1),
+                "max_percent": round(pop_max, 1),
+                "rainy_slot_share": _ratio(rainy, n, 3),
+            }
+            for day, n, pop_sum, pop_max, rainy in rows
+        ]
+        slope = None
+        if len(series) >= 2:
+            x = np.array([np.datetime64(point["day"]).astype(int) for point in series], dtype=np.float64)
+            y = np.array([point["mean_percent"] for point in series], dtype=np.float64)
+            slope = round(float(np.polyfit(x - x[0], y, 1)[0]), 3)
+        return {"location": key, "days": days, "slope_percent_per_day": slope, "series": series}
+
+    def accuracy(self, lat, lon, days=30, today=None):
+        """
+        Latest forecast against sensor readings over the last `days` days, per
+        metric: bias (forecast minus reading), mean absolute and RMS error.
+        For rain, readings are 0/1 and errors are in probability points;
+        `brier` is the Brier score of the rain probability.
+        """
+        key = self._key(lat, lon)
+        since = ((today or datetime.now()) - timedelta(days=days)).strftime("%Y-%m-%d")
+        metrics = {}
+        for metric, n, err_sum, err_abs, err_sq in self._query(
+            "SELECT metric, SUM(n), SUM(err_sum), SUM(err_abs), SUM(err_sq) FROM analytics_observed "
+            "WHERE location_key = ? AND day >= ? GROUP BY metric",
+            (key, since),
+        ):
+            metrics[metric] = {
+                "readings": n,
+                "bias": _ratio(err_sum, n),
+                "mean_abs_error": _ratio(err_abs, n),
+                "rmse": round((err_sq / n) ** 0.5, 2) if n else None,
+            }
+            if metric == "rain":
+                metrics[metric]["brier"] = _ratio(err_sq / 10000, n, 4)
+        return {"location": key, "days": days, "metrics": metrics}
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "ready": self.ready,
+            "error": self.error,
+            "fetches_aggregated": self.fetches,
+            "observations_compared": self.observations,
+        }
@@ -1,12 +1,43 @@
-import pandas as pd
-import openai
 import os
+import re
+import json
+import asyncio
+import hashlib
+import threading
 from datetime import datetime, timedelta
 
+import forecast_store
+import llm
+import prompt_encoding
+from cache import TTLCache
+
 # --- Configuration ---
 # The CSV file to read data from
 CSV_FILE_PATH = "weather_forecast_log.csv"
 
+# The indexed SQLite store that replaces the CSV log (see forecast_store.py)
+FORECAST_STORE_PATH = forecast_store.FORECAST_STORE_PATH
+
+# Maximum time (seconds) to wait for the OpenAI API before giving up
+REQUEST_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+
+# Bump whenever a prompt changes so cached answers from the old prompt are not reused
+PROMPT_VERSION = "2"
+
+# Crops considered when the caller does not specify any
+DEFAULT_CROPS = ["oignons", "tomates", "menthe"]
+
+# System prompt to enforce tone and language
+SYSTEM_PROMPT = (
+    "Vous êtes un assistant agricole professionnel. Répondez en français formel, par une seule phrase concise."
+)
+
+# Memoized LLM answers, keyed by prompt version + quantized forecast fingerprint
+recommendation_cache = TTLCache(
+    maxsize=int(os.getenv("RECOMMENDATION_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("RECOMMENDATION_CACHE_TTL", "3600")),
+)
+
 # --- Main Functions ---
 
 def load_api_key():
@@ -23,10 +54,20 @@ def load_api_key():
         return None
     return api_key
 
-def read_latest_forecast(filepath):
+def read_latest_forecast(filepath, lat=None, lon=None):
     """
     Reads the CSV and returns a DataFrame of the most recent 48-hour forecast.
+    If `filepath` is a SQLite store, this is an indexed lookup of the latest
+    fetch for (lat, lon), or for any location when none is given.
     """
+    import pandas as pd
+
+    if forecast_store.is_store_path(filepath):
+        df = forecast_store.open_store(filepath).latest(lat, lon, hours=48)
+        if df is None:
+            print("No forecast data found for the next 48 hours.")
+        return df
+
     try:
         df = pd.read_csv(filepath)
     except FileNotFoundError:
@@ -39,7 +80,8 @@ def read_latest_forecast(filepath):
 
     # --- Find the most RECENTLY fetched data ---
     # Convert 'fetched_at' to datetime objects to find the latest
-    df['fetched_at'] = pd.to_datetime(df['fetched_at'])
+    # (stamps with and without microseconds, see forecast_store.FETCHED_AT_FORMAT)
+    df['fetched_at'] = pd.to_datetime(df['fetched_at'], format='ISO8601')
     latest_fetch_time = df['fetched_at'].max()
     latest_df = df[df['fetched_at'] == latest_fetch_time].copy()
     
@@ -63,58 +105,205 @@ def read_latest_forecast(filepath):
         
     return next_48h_df
 
-def format_data_for_prompt(df):
+def format_data_for_prompt(df, encoding=None, budget=None):
     """
-    Converts the DataFrame into a simple string for the AI prompt.
+    Converts the DataFrame into a compact string for the AI prompt.
+
+    The layout is chosen by prompt_encoding (PROMPT_ENCODING, PROMPT_TOKEN_BUDGET);
+    encoding="table" gives the previous df.to_string() table.
     """
-    # Select only the most important columns for the AI
-    columns_to_include = [
-        'forecast_time', 
-        'temp_c', 
-        'humidity_percent', 
-        'weather_condition', 
-        'precipitation_prob_percent'
-    ]
-    
-    # Use 'to_string' to create a nicely formatted, simple text table
-    data_string = df[columns_to_include].to_string(index=False)
+    data_string, _, _ = prompt_encoding.encode(df, encoding, budget)
     return data_string
 
-def get_ai_recommendation(api_key, data_string):
+def prompt_window(df, now=None):
+    """Next 48 hours of a forecast, as sent to the AI (the first slots if the forecast is stale)."""
+    return prompt_encoding.prompt_window(df, now=now)
+
+def forecast_fingerprint(df):
     """
-    Sends the data and the user's prompt to the OpenAI API.
+    Returns a short hash of the forecast after quantization, so that forecasts
+    differing only by insignificant amounts share the same fingerprint.
+
+    Temperatures are rounded to 1°C, humidity to 5% and rain probability to
+    10% buckets; the remaining prompt columns are used as-is. Missing values
+    (NaN from a NULL in the store, or infinite) are kept as missing.
     """
-    try:
-        client = openai.OpenAI(api_key=api_key)
-    except Exception as e:
-        print(f"Error initializing OpenAI client: {e}")
-        return None
+    import numpy as np
+    import pandas as pd
+
+    if df is None or df.empty:
+        return "none"
+
+    def quantize(values, step):
+        values = pd.to_numeric(values, errors='coerce').astype(float)
+        return ((values.where(np.isfinite(values)) / step).round() * step).astype('Int64')
 
-    # Prompt: ask for a single, formal sentence in French advising which crops to water.
-    user_prompt_instruction = (
+    quantized = pd.DataFrame({
+        'forecast_time': df['forecast_time'].astype(str),
+        'temp_c': quantize(df['temp_c'], 1),
+        'humidity_percent': quantize(df['humidity_percent'], 5),
+        'weather_condition': df['weather_condition'].astype(str),
+        'precipitation_prob_percent': quantize(df['precipitation_prob_percent'], 10),
+    })
+    payload = quantized.to_csv(index=False).encode("utf-8")
+    return hashlib.sha1(payload).hexdigest()[:16]
+
+def normalize_question(text):
+    """Lower-cases and strips punctuation/extra spaces so repeated questions match."""
+    text = re.sub(r"[^\w\s]", " ", (text or "").lower())
+    return " ".join(text.split())
+
+def recommendation_cache_key(kind, df, question="", fingerprint=None):
+    """Builds the memoization key for an LLM answer about the given forecast."""
+    if fingerprint is None:
+        fingerprint = forecast_fingerprint(df)
+    return (PROMPT_VERSION, kind, fingerprint, normalize_question(question))
+
+class ForecastSnapshot:
+    """
+    In-memory copy of the latest fetched forecast, with the 48-hour prompt
+    table precomputed.
+
+    The fetch path calls `update()` with each new forecast; `load()` fills the
+    snapshot from the store once at process start. The prompt table is only
+    rebuilt when a new fetch lands or when a 3-hour slot enters or leaves the
+    48-hour window, so reads never touch the disk.
+    """
+
+    def __init__(self, store_path, hours=48):
+        self.store_path = store_path
+        self.hours = hours
+        self._lock = threading.Lock()
+        self._df = None
+        self._window = None  # (df, data_string, fingerprint, valid_until)
+        self.loaded = False
+
+    def update(self, data):
+        """Replaces the snapshot with a freshly fetched forecast (list of dicts or DataFrame)."""
+        import pandas as pd
+
+        df = data if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
+        if df.empty:
+            return
+        # The parsed forecast (get_weather.parse_forecast) is already typed and sorted: keep it as is
+        times = df['forecast_time']
+        if not pd.api.types.is_datetime64_any_dtype(times) or not times.is_monotonic_increasing:
+            df = df.assign(forecast_time=pd.to_datetime(times))
+            df = df.sort_values('forecast_time', ignore_index=True)
+        with self._lock:
+            self._df = df
+            self._window = None
+            self.loaded = True
+
+    def load(self):
+        """Loads the latest fetch from the store; blocking, call once from a worker thread."""
+        if self.loaded:
+            return
+        df = None
+        if forecast_store.is_store_path(self.store_path):
+            # Whole fetch (5 days), not just 48h, so the window can slide without reloading
+            df = forecast_store.open_store(self.store_path).latest(hours=24 * 6)
+        with self._lock:
+            if self.loaded:
+                return
+            if df is not None:
+                self._df = df.sort_values('forecast_time', ignore_index=True)
+            self.loaded = True
+
+    def get(self, now=None):
+        """
+        Returns (df, data_string, fingerprint) for the next 48 hours, or
+        (None, None, "none") if no forecast is available.
+        """
+        now = now or datetime.now()
+        with self._lock:
+            window = self._window
+            if window is None or now >= window[3]:
+                window = self._window = self._build_window(now)
+        return window[:3]
+
+    def _build_window(self, now):
+        df = self._df
+        if df is None:
+            return (None, None, "none", datetime.max)
+        times = df['forecast_time']
+        cutoff = now + timedelta(hours=self.hours)
+        mask = (times > now) & (times <= cutoff)
+        window_df = df[mask]
+        # The window changes when its first slot becomes past or the next slot comes within range
+        upcoming = times[times > cutoff]
+        changes = []
+        if not window_df.empty:
+            changes.append(window_df['forecast_time'].iloc[0].to_pydatetime())
+        if not upcoming.empty:
+            changes.append(upcoming.iloc[0].to_pydatetime() - timedelta(hours=self.hours))
+        valid_until = min(changes) if changes else datetime.max
+        if window_df.empty:
+            return (None, None, "none", valid_until)
+        return (window_df, format_data_for_prompt(window_df), forecast_fingerprint(window_df), valid_until)
+
+def crops_text(crops=None):
+    """Comma-separated crop list used in prompts and cache keys."""
+    return ", ".join(crops or DEFAULT_CROPS)
+
+def build_instruction(crops=None):
+    """Prompt: ask for a single, formal sentence in French advising which crops to water."""
+    return (
         "À partir des données de prévision ci‑dessous, indiquez en une seule phrase "
-        "formelle en français quelles cultures (oignons, tomates, menthe) doivent être arrosées "
+        f"formelle en français quelles cultures ({crops_text(crops)}) doivent être arrosées "
         "aujourd'hui et si un arrosage est nécessaire. Prenez en compte les besoins différents "
         "en eau par culture, la probabilité de pluie et la date dans l'année. Répondez en une seule phrase." 
     )
 
-    # System prompt to enforce tone and language
-    system_prompt = (
-        "Vous êtes un assistant agricole professionnel. Répondez en français formel, par une seule phrase concise."
-    )
-    
+def build_recommendation_messages(data_string, crops=None):
+    """Chat messages asking for the watering recommendation for this forecast."""
     # Combine the data and the instruction
-    full_prompt = f"Forecast Data:\n{data_string}\n\nInstruction:\n{user_prompt_instruction}"
-    
+    full_prompt = f"Forecast Data:\n{data_string}\n\nInstruction:\n{build_instruction(crops)}"
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": full_prompt}
+    ]
+
+def build_wording_messages(decision_text):
+    """Chat messages asking the LLM only to phrase a decision already taken by decision_engine."""
+    full_prompt = (
+        "Reformulez la recommandation d'arrosage suivante en une seule phrase formelle en français, "
+        f"sans modifier la décision ni les chiffres :\n{decision_text}"
+    )
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": full_prompt}
+    ]
+
+_sync_clients = {}
+
+def _get_openai_client(api_key, timeout):
+    """Returns a reusable OpenAI client for this key, so its connection pool is kept."""
+    import openai
+
+    client = _sync_clients.get((api_key, timeout))
+    if client is None:
+        client = _sync_clients[(api_key, timeout)] = openai.OpenAI(api_key=api_key, timeout=timeout)
+    return client
+
+def get_ai_recommendation(api_key, data_string, timeout=REQUEST_TIMEOUT, crops=None):
+    """
+    Sends the data and the user's prompt to the OpenAI API.
+    """
+    import openai
+
+    try:
+        client = _get_openai_client(api_key, timeout)
+    except Exception as e:
+        print(f"Error initializing OpenAI client: {e}")
+        return None
+
     print("\nSending request to OpenAI API...")
     
     try:
         response = client.chat.completions.create(
             model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": full_prompt}
-            ],
+            messages=build_recommendation_messages(data_string, crops),
             max_tokens=150,
             temperature=0.3
         )
@@ -130,6 +319,96 @@ def get_ai_recommendation(api_key, data_string):
         print(f"Error during OpenAI API call: {e}")
         return None
 
+async def complete_async(messages, max_tokens=150, temperature=0.3):
+    """
+    Completion through the shared LLM client (see llm.py). Returns None on
+    failure; timeouts are re-raised.
+    """
+    client = llm.get_client()
+    if client is None:
+        return None
+    try:
+        return await client.complete(messages, max_tokens=max_tokens, temperature=temperature)
+    except asyncio.TimeoutError:
+        raise
+    except Exception as e:
+        print(f"Error during LLM call: {e}")
+        return None
+
+async def get_ai_recommendation_async(data_string, crops=None):
+    """Async variant of get_ai_recommendation (see complete_async)."""
+    return await complete_async(build_recommendation_messages(data_string, crops))
+
+async def stream_completion(messages, max_tokens=150, temperature=0.3):
+    """
+    Streams a chat completion through the shared LLM client, yielding text
+    deltas as they arrive. Closing the generator (e.g. when the client
+    disconnects) closes the upstream stream.
+    """
+    client = llm.get_client()
+    if client is None:
+        raise RuntimeError("no LLM provider configured")
+    stream = client.stream(messages, max_tokens=max_tokens, temperature=temperature)
+    try:
+        async for delta in stream:
+            yield delta
+    finally:
+        await stream.aclose()
+
+def build_batch_messages(entries):
+    """Chat messages asking for one recommendation per (entry_id, crops, data_string) entry, as JSON."""
+    sections = [
+        f"### id: {entry_id}\nCultures: {crops_text(crops)}\nForecast Data:\n{data_string}"
+        for entry_id, crops, data_string in entries
+    ]
+    full_prompt = (
+        "\n\n".join(sections)
+        + "\n\nInstruction:\nPour chaque id ci-dessus, "
+        + build_instruction(["cultures indiquées"])
+        + '\nRépondez uniquement en JSON: {"recommendations": [{"id": "...", "recommendation": "..."}]}'
+    )
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": full_prompt}
+    ]
+
+async def get_batch_recommendations(entries):
+    """
+    Asks for recommendations for several locations in a single LLM request.
+
+    Args:
+        entries (list): (entry_id, crops, data_string) tuples, one per location.
+
+    Returns:
+        dict: entry_id -> recommendation for every location the model answered.
+              Missing ids should be retried individually by the caller.
+    """
+    client = llm.get_client()
+    if client is None:
+        return {}
+
+    print(f"\nSending batch request for {len(entries)} locations to the LLM...")
+
+    try:
+        content = await client.complete(
+            build_batch_messages(entries),
+            max_tokens=120 * len(entries),
+            temperature=0.3,
+            response_format={"type": "json_object"},
+        )
+        payload = json.loads(content or "{}")
+        return {
+            str(item["id"]): item["recommendation"]
+            for item in payload.get("recommendations", [])
+            if item.get("id") is not None and item.get("recommendation")
+        }
+    except Exception as e:
+        print(f"Error during LLM batch call: {e}")
+        return {}
+
+# Latest forecast shared by the backend request handlers
+latest_forecast = ForecastSnapshot(FORECAST_STORE_PATH)
+
 # --- Main Execution ---
 if __name__ == "__main__":
     
@@ -138,7 +417,7 @@ if __name__ == "__main__":
     
     if api_key:
         # 2. Read the latest forecast data from the CSV
-        forecast_df = read_latest_forecast(CSV_FILE_PATH)
+        forecast_df = read_latest_forecast(FORECAST_STORE_PATH)
         
         if forecast_df is not None:
             # 3. Format the data for the prompt
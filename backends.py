@@ -0,0 +1,252 @@
+import asyncio
+import json
+import os
+from urllib.parse import urlsplit
+
+from resilience import backoff_delay
+from state_store import VersionedState
+
+# --- Configuration ---
+# "memory" (single process) or "redis" (state shared by every worker/node)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Prefix of the Redis keys and pub/sub channel, so several farms can share a server
+REDIS_PREFIX = os.getenv("STATE_REDIS_PREFIX", "mabrouka:state")
+
+# Seconds start() waits for the first subscription and snapshot before giving up
+REDIS_START_TIMEOUT = float(os.getenv("STATE_REDIS_START_TIMEOUT", "15"))
+
+
+class StateConflict(Exception):
+    """The state revision moved on since the caller read it (compare-and-set failed)."""
+
+    def __init__(self, rev):
+        super().__init__(f"state is at revision {rev}")
+        self.rev = rev
+
+
+class StateBackend:
+    """
+    Interface of the shared state store.
+
+    `update()` applies changes atomically and returns (rev, changed); with
+    `expected_rev` it raises StateConflict unless the state is still at that
+    revision. Every change is published to the `on_change(rev, changes,
+    full=False)` callback given to `start()`, in every process sharing the
+    backend; `full=True` carries the whole state (initial load or resync
+    after a lost subscription).
+    """
+
+    name = "base"
+
+    async def start(self, on_change):
+        raise NotImplementedError
+
+    async def snapshot(self):
+        raise NotImplementedError
+
+    async def update(self, changes, expected_rev=None):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    def stats(self):
+        return {"backend": self.name}
+
+
+class MemoryStateBackend(StateBackend):
+    """Single-process backend: the state lives in this worker only."""
+
+    name = "memory"
+
+    def __init__(self, initial):
+        self._state = VersionedState(initial)
+        self._on_change = None
+
+    async def start(self, on_change):
+        self._on_change = on_change
+        rev, data = self._state.snapshot()
+        on_change(rev, data, full=True)
+
+    async def snapshot(self):
+        return self._state.snapshot()
+
+    async def update(self, changes, expected_rev=None):
+        if expected_rev is not None and expected_rev != self._state.rev:
+            raise StateConflict(self._state.rev)
+        rev, changed = self._state.update(changes)
+        if changed and self._on_change is not None:
+            self._on_change(rev, changed)
+        return rev, changed
+
+
+# Atomic compare-and-set: KEYS = rev counter, data hash, pub/sub channel;
+# ARGV = expected rev (-1: any), then field/JSON value pairs. Only fields
+# whose encoded value differs are written, and the change is published in
+# the same step so subscribers see revisions in order.
+_UPDATE_SCRIPT = """
+local rev = tonumber(redis.call('GET', KEYS[1]) or '0')
+local expected = tonumber(ARGV[1])
+if expected >= 0 and expected ~= rev then
+    return {-1, rev}
+end
+local changed = {}
+local parts = {}
+for i = 2, #ARGV, 2 do
+    if redis.call('HGET', KEYS[2], ARGV[i]) ~= ARGV[i + 1] then
+        table.insert(changed, ARGV[i])
+        table.insert(changed, ARGV[i + 1])
+        table.insert(parts, cjson.encode(ARGV[i]) .. ':' .. ARGV[i + 1])
+    end
+end
+if #parts == 0 then
+    return {0, rev}
+end
+rev = rev + 1
+redis.call('SET', KEYS[1], rev)
+redis.call('HSET', KEYS[2], unpack(changed))
+redis.call('PUBLISH', KEYS[3], '{"rev":' .. rev .. ',"changes":{' .. table.concat(parts, ',') .. '}}')
+local result = {1, rev}
+for _, value in ipairs(changed) do
+    table.insert(result, value)
+end
+return result
+"""
+
+
+def _encode(value):
+    # Canonical form so equal values compare equal inside the Lua script
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+class RedisStateBackend(StateBackend):
+    """
+    State shared by all workers through Redis (or any server speaking its
+    protocol): a hash of JSON-encoded values plus a revision counter, updated
+    by one Lua script and fanned out over pub/sub.
+    """
+
+    name = "redis"
+
+    def __init__(self, initial, url=REDIS_URL, prefix=REDIS_PREFIX, start_timeout=REDIS_START_TIMEOUT):
+        import redis.asyncio as aioredis
+
+        self._redis = aioredis.from_url(url, decode_responses=True)
+        self._initial = dict(initial)
+        # Shown in stats: host and database only, never the password
+        parts = urlsplit(url)
+        self.url = f"{parts.scheme}://{parts.hostname}:{parts.port or 6379}{parts.path}"
+        self._rev_key = f"{prefix}:rev"
+        self._data_key = f"{prefix}:data"
+        self.channel = f"{prefix}:events"
+        self._update = self._redis.register_script(_UPDATE_SCRIPT)
+        self.start_timeout = start_timeout
+        self._listener = None
+        self.conflicts = 0
+        self.resubscribes = 0
+
+    async def start(self, on_change):
+        # Seed missing keys without overwriting what other workers already wrote
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.setnx(self._rev_key, 0)
+            for key, value in self._initial.items():
+                pipe.hsetnx(self._data_key, key, _encode(value))
+            await pipe.execute()
+        ready = asyncio.Event()
+        self._listener = asyncio.create_task(self._listen(on_change, ready))
+        try:
+            await asyncio.wait_for(ready.wait(), timeout=self.start_timeout)
+        except asyncio.TimeoutError:
+            await self._stop_listener()
+            raise ConnectionError(
+                f"state backend {self.url}: could not subscribe to {self.channel} "
+                f"within {self.start_timeout:g}s"
+            ) from None
+
+    async def _listen(self, on_change, ready):
+        attempt = 0
+        while True:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                # Snapshot after subscribing: nothing published in between is missed
+                rev, data = await self.snapshot()
+                on_change(rev, data, full=True)
+                ready.set()
+                attempt = 0
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    event = json.loads(message["data"])
+                    on_change(event["rev"], event["changes"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Warning: state subscription lost ({e}), reconnecting.")
+                self.resubscribes += 1
+                await asyncio.sleep(backoff_delay(attempt))
+                attempt += 1
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+    async def snapshot(self):
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.get(self._rev_key)
+            pipe.hgetall(self._data_key)
+            rev, raw = await pipe.execute()
+        data = {k: json.loads(v) for k, v in raw.items() if k in self._initial}
+        return int(rev or 0), data
+
+    async def update(self, changes, expected_rev=None):
+        args = [-1 if expected_rev is None else expected_rev]
+        for key, value in changes.items():
+            if key in self._initial:
+                args += [key, _encode(value)]
+        result = await self._update(
+            keys=[self._rev_key, self._data_key, self.channel], args=args
+        )
+        status, rev = int(result[0]), int(result[1])
+        if status < 0:
+            self.conflicts += 1
+            raise StateConflict(rev)
+        pairs = result[2:]
+        changed = {pairs[i]: json.loads(pairs[i + 1]) for i in range(0, len(pairs), 2)}
+        return rev, changed
+
+    async def _stop_listener(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    async def close(self):
+        await self._stop_listener()
+        await self._redis.aclose()
+
+    def stats(self):
+        return {
+            "backend": self.name,
+            "url": self.url,
+            "channel": self.channel,
+            "conflicts": self.conflicts,
+            "resubscribes": self.resubscribes,
+        }
+
+
+def create_backend(initial, name=None):
+    """Builds the backend selected by STATE_BACKEND; falls back to memory if Redis is unavailable."""
+    name = (name or STATE_BACKEND).lower()
+    if name == "redis":
+        try:
+            return RedisStateBackend(initial)
+        except ImportError:
+            print("Warning: the 'redis' package is not installed, using the in-memory state backend.")
+    return MemoryStateBackend(initial)
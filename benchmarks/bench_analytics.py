@@ -0,0 +1,142 @@
+"""
+Forecast analytics benchmark: cost added to each store append by the
+running aggregates (analytics.ForecastAnalytics), time to build them from an
+existing log, and query latency (drift, rain trend, accuracy) against the
+same questions answered by scanning the log.
+
+The log holds one fetch of 40 rows per location every `--interval` hours
+over `--days` days.
+
+    python benchmarks/bench_analytics.py [--locations 100] [--days 60] [--interval 6]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import results  # noqa: E402
+import analytics  # noqa: E402
+import forecast_store  # noqa: E402
+from forecast_store import TIME_FORMAT  # noqa: E402
+
+STEPS = 40  # rows per fetch (5 days x 3 hours)
+
+
+def make_fetch(rng, location, fetched_at):
+    start = fetched_at.replace(minute=0, second=0) - timedelta(hours=fetched_at.hour % 3)
+    times = [start + timedelta(hours=3 * (step + 1)) for step in range(STEPS)]
+    temp = rng.uniform(10, 35, STEPS).round(2)
+    return pd.DataFrame({
+        "location_name": f"Field {location}",
+        "latitude": 33.0 + (location % 20) * 0.1,
+        "longitude": 8.0 + (location // 20) * 0.1,
+        "forecast_time": [t.strftime(TIME_FORMAT) for t in times],
+        "temp_c": temp,
+        "feels_like_c": temp - 0.5,
+        "temp_min_c": temp - 1.5,
+        "temp_max_c": temp + 1.5,
+        "humidity_percent": rng.integers(20, 95, STEPS),
+        "weather_condition": "ciel dégagé",
+        "wind_speed_mps": rng.uniform(0, 9, STEPS).round(2),
+        "precipitation_prob_percent": (rng.random(STEPS) * 100).round(),
+        "cloudiness_percent": rng.integers(0, 100, STEPS),
+    })
+
+
+def fill(store, locations, days, interval, now):
+    """Appends every fetch in time order; returns the seconds of each append."""
+    rng = np.random.default_rng(0)
+    timings = []
+    first = now - timedelta(days=days)
+    for hour in range(0, days * 24, interval):
+        fetched_at = first + timedelta(hours=hour)
+        stamp = fetched_at.strftime(TIME_FORMAT)
+        for location in range(locations):
+            df = make_fetch(rng, location, fetched_at)
+            start = time.perf_counter()
+            store.append(df, fetched_at=stamp)
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def scan_drift(store, key):
+    """The drift question answered from the raw log (what the aggregates replace)."""
+    df = pd.read_sql_query(
+        "SELECT forecast_time, fetched_at, temp_c FROM forecasts WHERE location_key = ? ORDER BY fetched_at",
+        store._conn, params=(key,),
+    )
+    change = df.groupby("forecast_time")["temp_c"].diff().abs()
+    return change.mean()
+
+
+def measure(func, repeat=20):
+    func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return {"median_ms": round(statistics.median(timings) * 1000, 3), "max_ms": round(max(timings) * 1000, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--locations", type=int, default=100)
+    parser.add_argument("--days", type=int, default=60)
+    parser.add_argument("--interval", type=int, default=6, help="hours between fetches of a location")
+    results.add_arguments(parser)
+    args = parser.parse_args()
+
+    now = datetime.now().replace(microsecond=0)
+    report = {"config": {"locations": args.locations, "days": args.days, "interval_hours": args.interval}}
+    with tempfile.TemporaryDirectory(prefix="bench-analytics-") as workdir:
+        # Same log without, then with, the running aggregates
+        plain = forecast_store.ForecastStore(os.path.join(workdir, "plain.db"), retention_days=3650, compact_every=0)
+        plain_timings = fill(plain, args.locations, args.days, args.interval, now)
+        print(f"{len(plain_timings)} fetches without analytics", file=sys.stderr)
+
+        path = os.path.join(workdir, "analytics.db")
+        store = forecast_store.ForecastStore(path, retention_days=3650, compact_every=0)
+        forecast_store._stores[os.path.abspath(path)] = store
+        live = analytics.ForecastAnalytics(path)
+        live.start()
+        live.catch_up()
+        live_timings = fill(store, args.locations, args.days, args.interval, now)
+        print(f"{len(live_timings)} fetches with analytics", file=sys.stderr)
+
+        # Building the aggregates from scratch for the whole log
+        rebuilt = analytics.ForecastAnalytics(os.path.join(workdir, "plain.db"))
+        forecast_store._stores[os.path.abspath(rebuilt.path)] = plain
+        rebuilt.start()
+        start = time.perf_counter()
+        rebuilt.catch_up()
+        catch_up_seconds = time.perf_counter() - start
+
+        lat, lon = 33.0, 8.0
+        key = forecast_store.location_key(lat, lon)
+        report.update({
+            "rows": store.count(),
+            "append_plain": results.percentiles(plain_timings),
+            "append_analytics": results.percentiles(live_timings),
+            "catch_up_seconds": round(catch_up_seconds, 2),
+            "query_drift": measure(lambda: live.drift(lat, lon, days=args.days)),
+            "query_rain_trend": measure(lambda: live.rain_trend(lat, lon, days=args.days)),
+            "query_accuracy": measure(lambda: live.accuracy(lat, lon, days=args.days)),
+            "scan_drift": measure(lambda: scan_drift(store, key), repeat=5),
+        })
+        plain.close()
+        store.close()
+    results.finish("analytics", report, args)
+
+
+if __name__ == "__main__":
+    main()
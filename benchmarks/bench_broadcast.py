@@ -0,0 +1,151 @@
+"""
+WebSocket fan-out benchmark: 1000 simulated clients, a few of them slow.
+
+Compares the previous sequential broadcast (await each send in turn) with
+connections.ConnectionManager (per-client queues and sender tasks) and
+prints a JSON summary: time for a burst of state updates to reach every
+fast client, messages and bytes actually sent, and what happened to the
+slow ones. `--full-state` broadcasts the whole state instead of
+state_store deltas.
+
+    python benchmarks/bench_broadcast.py [--clients 1000] [--slow 10] [--updates 50]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from connections import ConnectionManager  # noqa: E402
+from state_store import VersionedState  # noqa: E402
+
+
+class FakeWebSocket:
+    """Records received messages; each send takes `latency` seconds."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.received = 0
+        self.bytes = 0
+        self.rev = None
+        self.last = None
+        self.last_at = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data):
+        await asyncio.sleep(self.latency)
+        self.received += 1
+        self.bytes += len(data.encode("utf-8"))
+        self.rev = json.loads(data).get("rev")
+        self.last = data
+        self.last_at = time.perf_counter()
+
+
+async def sequential_broadcast(clients, message):
+    """The broadcast loop used before connections.py: one await per client."""
+    data = json.dumps(message, ensure_ascii=False)
+    for ws in clients:
+        await ws.send_text(data)
+
+
+def make_clients(count, slow, fast_latency, slow_latency):
+    clients = [FakeWebSocket(random.uniform(0, fast_latency)) for _ in range(count - slow)]
+    clients += [FakeWebSocket(slow_latency) for _ in range(slow)]
+    return clients
+
+
+def summarize(clients, slow, started, is_final):
+    fast = clients[:len(clients) - slow]
+    delivered = [ws.last_at - started for ws in fast if is_final(ws)]
+    return {
+        "fast_clients_up_to_date": len(delivered),
+        "p50_ms": round(statistics.median(delivered) * 1000, 2) if delivered else None,
+        "max_ms": round(max(delivered) * 1000, 2) if delivered else None,
+        "messages_sent": sum(ws.received for ws in clients),
+        "bytes_sent": sum(ws.bytes for ws in clients),
+    }
+
+
+async def run_sequential(args, state):
+    clients = make_clients(args.clients, args.slow, args.fast_latency, args.slow_latency)
+    started = time.perf_counter()
+    for i in range(args.updates):
+        state["humidity"] = i
+        await sequential_broadcast(clients, {"type": "state", "state": state})
+    final = json.dumps({"type": "state", "state": state}, ensure_ascii=False)
+    result = summarize(clients, args.slow, started, lambda ws: ws.last == final)
+    result["wall_s"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+async def run_queued(args, state):
+    clients = make_clients(args.clients, args.slow, args.fast_latency, args.slow_latency)
+    manager = ConnectionManager(maxsize=args.queue_size, policy=args.policy, send_timeout=args.slow_latency * 2)
+    for ws in clients:
+        await manager.connect(ws)
+
+    versioned = VersionedState(state)
+    last = {"rev": 0}
+
+    def full_message():
+        rev, snapshot = versioned.snapshot()
+        return {"type": "state", "rev": rev, "state": snapshot}
+
+    def delta_message():
+        base = last["rev"]
+        rev, changes = versioned.since(base)
+        last["rev"] = rev
+        return {"type": "state_delta", "base": base, "rev": rev, "changes": changes}
+
+    source = full_message if args.full_state else delta_message
+    started = time.perf_counter()
+    for i in range(args.updates):
+        versioned.update({"humidity": i + 1})
+        manager.broadcast_state(source)
+        # Let the event loop run between updates, like separate HTTP requests would
+        await asyncio.sleep(args.interval)
+    fast = clients[:len(clients) - args.slow]
+    deadline = time.perf_counter() + 30
+    while any(ws.rev != versioned.rev for ws in fast) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.005)
+    result = summarize(clients, args.slow, started, lambda ws: ws.rev == versioned.rev)
+    result["wall_s"] = round(time.perf_counter() - started, 3)
+    result["manager"] = manager.stats()
+    await manager.close()
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--slow", type=int, default=10, help="clients whose sends take --slow-latency")
+    parser.add_argument("--updates", type=int, default=50, help="state updates in the burst")
+    parser.add_argument("--interval", type=float, default=0.001, help="seconds between updates")
+    parser.add_argument("--fast-latency", type=float, default=0.0005)
+    parser.add_argument("--slow-latency", type=float, default=0.05)
+    parser.add_argument("--queue-size", type=int, default=100)
+    parser.add_argument("--policy", choices=("drop_oldest", "disconnect"), default="drop_oldest")
+    parser.add_argument("--state-keys", type=int, default=50, help="extra keys in the state")
+    parser.add_argument("--full-state", action="store_true", help="broadcast the whole state, not deltas")
+    parser.add_argument("--skip-sequential", action="store_true", help="the baseline is slow with many updates")
+    args = parser.parse_args()
+
+    state = {"temperature": 24, "humidity": 0, "pumpAdvice": "اسقي إذا كانت التربة جافة."}
+    # Per-field sensors, as the state is expected to grow
+    state.update({f"field{i}_moisture": 50 for i in range(args.state_keys)})
+    results = {"config": vars(args)}
+    if not args.skip_sequential:
+        results["sequential"] = await run_sequential(args, dict(state))
+    results["queued"] = await run_queued(args, dict(state))
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
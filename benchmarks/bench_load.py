@@ -0,0 +1,273 @@
+"""
+End-to-end load test: boots `main:app` under uvicorn against the local
+OpenWeatherMap/OpenAI stubs (benchmarks/stubs.py) and drives a mixed
+workload for a fixed duration:
+
+- `--rec-workers` loops calling /get-recommendation over `--locations` fields
+- `--state-workers` loops posting to /state
+- `--ws-clients` WebSocket clients chatting (latency = until chat_done)
+
+Reports throughput, p50/p90/p99 latency, errors and requests shed by
+admission control (503 / busy chat replies) per workload, the server
+RSS (current and peak) and the per-stage means from /metrics, and saves
+everything as JSON (see benchmarks/results.py) for comparison between commits.
+
+    python benchmarks/bench_load.py [--duration 20] [--rec-workers 8] [--ws-clients 20]
+    python benchmarks/bench_load.py --compare benchmarks/results/load-<commit>.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import websockets
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import results  # noqa: E402
+from stubs import StubServer  # noqa: E402
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def process_memory(pid):
+    """Current and peak resident memory (MiB) of `pid`, from /proc (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return {"rss_mib": None, "peak_rss_mib": None}
+    return {
+        "rss_mib": round(int(fields["VmRSS"].split()[0]) / 1024, 1),
+        "peak_rss_mib": round(int(fields["VmHWM"].split()[0]) / 1024, 1),
+    }
+
+
+def stage_means(text):
+    """Mean seconds per series of the *_seconds histograms in a /metrics body."""
+    sums, counts = {}, {}
+    for line in text.splitlines():
+        if line.startswith("#") or " " not in line:
+            continue
+        name, value = line.rsplit(" ", 1)
+        metric, brace, labels = name.partition("{")
+        labels = brace + labels
+        if metric.endswith("_seconds_sum"):
+            sums[metric[:-len("_sum")] + labels] = float(value)
+        elif metric.endswith("_seconds_count"):
+            counts[metric[:-len("_count")] + labels] = float(value)
+    return {name: round(sums[name] / counts[name], 6) for name in sums if counts.get(name)}
+
+
+class Server:
+    """uvicorn main:app in a child process, working in a throwaway directory."""
+
+    def __init__(self, env, workdir, port):
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}"
+        self.log = open(os.path.join(workdir, "server.log"), "w")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", REPO,
+             "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+            cwd=workdir, env=env, stdout=self.log, stderr=subprocess.STDOUT,
+        )
+
+    async def wait_ready(self, timeout=30):
+        deadline = time.monotonic() + timeout
+        async with httpx.AsyncClient() as client:
+            while time.monotonic() < deadline:
+                if self.process.poll() is not None:
+                    raise RuntimeError(f"server exited with code {self.process.returncode}, see {self.log.name}")
+                try:
+                    if (await client.get(f"{self.url}/health")).status_code == 200:
+                        return
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.1)
+        raise RuntimeError("server did not start in time")
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.shed = {}  # requests refused by admission control (not counted as errors)
+        self.state_messages = 0  # state broadcasts received by the WebSocket clients
+
+    def add(self, workload, seconds, ok=True):
+        if ok:
+            self.latencies.setdefault(workload, []).append(seconds)
+        else:
+            self.errors[workload] = self.errors.get(workload, 0) + 1
+
+    def add_shed(self, workload):
+        self.shed[workload] = self.shed.get(workload, 0) + 1
+
+    def summary(self, duration):
+        out = {}
+        for workload in sorted(set(self.latencies) | set(self.errors) | set(self.shed)):
+            values = sorted(self.latencies.get(workload, []))
+            out[workload] = {
+                "requests": len(values),
+                "errors": self.errors.get(workload, 0),
+                "shed": self.shed.get(workload, 0),
+                "throughput_rps": round(len(values) / duration, 2),
+                **results.percentiles(values),
+            }
+        return out
+
+
+async def recommendation_worker(client, url, locations, recorder, stop):
+    while not stop.is_set():
+        lat, lon = random.choice(locations)
+        start = time.perf_counter()
+        try:
+            response = await client.get(f"{url}/get-recommendation", params={"lat": lat, "lon": lon})
+            if response.status_code == 503 and "Retry-After" in response.headers:
+                recorder.add_shed("recommendation")
+                await asyncio.sleep(float(response.headers["Retry-After"]))
+                continue
+            recorder.add("recommendation", time.perf_counter() - start, response.status_code == 200)
+        except httpx.HTTPError:
+            recorder.add("recommendation", 0, ok=False)
+
+
+async def state_worker(client, url, recorder, stop, interval):
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            response = await client.post(f"{url}/state", json={"humidity": random.randint(20, 90)})
+            recorder.add("state", time.perf_counter() - start, response.status_code == 200)
+        except httpx.HTTPError:
+            recorder.add("state", 0, ok=False)
+        await asyncio.sleep(interval)
+
+
+async def ws_client(url, recorder, stop, think_time):
+    """Chats in a loop; state broadcasts arriving in between are counted and skipped."""
+    chat_id = 0
+    try:
+        async with websockets.connect(url.replace("http", "ws", 1) + "/ws", max_size=None) as ws:
+            while not stop.is_set():
+                chat_id += 1
+                start = time.perf_counter()
+                await ws.send(json.dumps({"type": "chat", "id": chat_id, "text": "هل أسقي الطماطم اليوم؟"}))
+                while True:
+                    message = json.loads(await ws.recv())
+                    if message.get("type") == "chat_done" and message.get("id") == chat_id:
+                        break
+                    if message.get("type") in ("state", "state_delta"):
+                        recorder.state_messages += 1
+                if "retry_after" in message:
+                    recorder.add_shed("chat")
+                    await asyncio.sleep(message["retry_after"])
+                    continue
+                recorder.add("chat", time.perf_counter() - start)
+                await asyncio.sleep(random.uniform(0, 2 * think_time))
+    except (OSError, websockets.WebSocketException):
+        recorder.add("chat", 0, ok=False)
+
+
+async def run_load(args, server):
+    recorder = Recorder()
+    stop = asyncio.Event()
+    rng = random.Random(args.seed)
+    locations = [(round(rng.uniform(33, 37), 3), round(rng.uniform(8, 11), 3)) for _ in range(args.locations)]
+    limits = httpx.Limits(max_connections=args.rec_workers + args.state_workers + 4)
+    async with httpx.AsyncClient(timeout=60, limits=limits) as client:
+        tasks = [asyncio.create_task(recommendation_worker(client, server.url, locations, recorder, stop))
+                 for _ in range(args.rec_workers)]
+        tasks += [asyncio.create_task(state_worker(client, server.url, recorder, stop, args.state_interval))
+                  for _ in range(args.state_workers)]
+        tasks += [asyncio.create_task(ws_client(server.url, recorder, stop, args.think_time))
+                  for _ in range(args.ws_clients)]
+        start = time.perf_counter()
+        await asyncio.sleep(args.duration)
+        stop.set()
+        await asyncio.wait(tasks, timeout=30)
+        for task in tasks:
+            task.cancel()
+        elapsed = time.perf_counter() - start
+        metrics_text = (await client.get(f"{server.url}/metrics")).text
+        cache = (await client.get(f"{server.url}/cache/stats")).json()
+    return {
+        "duration_seconds": round(elapsed, 2),
+        "workloads": recorder.summary(elapsed),
+        "ws_state_messages": recorder.state_messages,
+        "memory": process_memory(server.process.pid),
+        "stage_means_seconds": stage_means(metrics_text),
+        "cache_hit_ratio": {name: stats.get("hit_ratio") for name, stats in cache.items() if "hit_ratio" in stats},
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=float, default=20, help="seconds of load")
+    parser.add_argument("--rec-workers", type=int, default=8, help="concurrent /get-recommendation loops")
+    parser.add_argument("--locations", type=int, default=50, help="distinct fields requested")
+    parser.add_argument("--state-workers", type=int, default=2)
+    parser.add_argument("--state-interval", type=float, default=0.05, help="seconds between /state posts")
+    parser.add_argument("--ws-clients", type=int, default=20)
+    parser.add_argument("--think-time", type=float, default=0.5, help="mean pause between chat messages")
+    parser.add_argument("--owm-latency", type=float, default=0.05)
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of upstream calls failing with 503")
+    parser.add_argument("--mode", default="llm", help="RECOMMENDER_MODE of the server")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE",
+                        help="extra environment for the server (repeatable)")
+    results.add_arguments(parser)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    stub = StubServer(owm_latency=args.owm_latency, llm_latency=args.llm_latency,
+                      error_rate=args.error_rate, seed=args.seed).start()
+    workdir = tempfile.mkdtemp(prefix="bench-load-")
+    env = {
+        **os.environ,
+        **stub.env(),
+        "RECOMMENDER_MODE": args.mode,
+        "FORECAST_STORE_PATH": os.path.join(workdir, "weather_forecast.db"),
+        "SCHEDULER_ENABLED": "0",
+        # the stub has no quota: measure the backend, not the free plan's 60 calls/minute
+        "OPENWEATHERMAP_CALLS_PER_MINUTE": "100000",
+        # every simulated client shares the same address
+        "ADMISSION_PER_CLIENT": "0",
+        "PYTHONPATH": REPO,
+    }
+    env.update(item.split("=", 1) for item in args.env)
+    server = Server(env, workdir, free_port())
+    try:
+        await server.wait_ready()
+        report = await run_load(args, server)
+    finally:
+        server.stop()
+        stub.stop()
+    report["upstream_requests"] = stub.requests
+    report["config"] = {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+    results.finish("load", report, args)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+"""
+Forecast parsing microbenchmark: the previous list-of-dicts parser, whose
+output was turned into a DataFrame again by save_to_csv and by every request
+served from the forecast cache, against get_weather.parse_forecast (one
+columnar DataFrame reused downstream, decoded with orjson when installed).
+
+    python benchmarks/bench_parse.py [--forecasts 500] [--reads 5]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import results  # noqa: E402
+from stubs import forecast_payload  # noqa: E402
+import get_weather  # noqa: E402
+
+
+def legacy_parse(body, lat, lon, reads):
+    """fetch_weather_api before the columnar parser, plus the DataFrame rebuilds downstream."""
+    api_data = json.loads(body)
+    processed_data = []
+    city_name = api_data.get('city', {}).get('name', 'Unknown')
+    for forecast in api_data['list']:
+        processed_data.append({
+            'location_name': city_name,
+            'latitude': lat,
+            'longitude': lon,
+            'forecast_time': forecast['dt_txt'],
+            'temp_c': forecast['main']['temp'],
+            'feels_like_c': forecast['main']['feels_like'],
+            'temp_min_c': forecast['main']['temp_min'],
+            'temp_max_c': forecast['main']['temp_max'],
+            'humidity_percent': forecast['main']['humidity'],
+            'weather_condition': forecast['weather'][0]['description'],
+            'wind_speed_mps': forecast['wind']['speed'],
+            'precipitation_prob_percent': forecast.get('pop', 0) * 100,
+            'cloudiness_percent': forecast['clouds']['all'],
+        })
+    save_df = pd.DataFrame(processed_data)
+    request_dfs = [pd.DataFrame(processed_data) for _ in range(reads)]
+    return save_df, request_dfs
+
+
+def columnar_parse(body, lat, lon, reads):
+    df = get_weather.parse_forecast(get_weather._json_loads(body), lat, lon)
+    return df.copy(), [df] * reads  # save_to_csv still copies before stamping fetched_at
+
+
+def run(func, bodies, reads):
+    start = time.perf_counter()
+    for lat, lon, body in bodies:
+        func(body, lat, lon, reads)
+    elapsed = time.perf_counter() - start
+    return {
+        "total_ms": round(elapsed * 1000, 2),
+        "per_forecast_us": round(elapsed / len(bodies) * 1e6, 1),
+        "forecasts_per_second": round(len(bodies) / elapsed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--forecasts", type=int, default=500)
+    parser.add_argument("--reads", type=int, default=5, help="requests served from the cache per fetch")
+    results.add_arguments(parser)
+    args = parser.parse_args()
+
+    bodies = []
+    for i in range(args.forecasts):
+        lat, lon = 33 + (i % 40) * 0.1, 8 + (i // 40) * 0.1
+        bodies.append((lat, lon, json.dumps(forecast_payload(lat, lon), ensure_ascii=False).encode("utf-8")))
+    run(legacy_parse, bodies[:20], args.reads)  # warm-up
+    run(columnar_parse, bodies[:20], args.reads)
+    report = {
+        "decoder": getattr(get_weather._json_loads, "__module__", "json"),
+        "reads_per_fetch": args.reads,
+        "legacy": run(legacy_parse, bodies, args.reads),
+        "columnar": run(columnar_parse, bodies, args.reads),
+    }
+    report["speedup"] = round(report["legacy"]["total_ms"] / report["columnar"]["total_ms"], 2)
+    results.finish("parse", report, args)
+
+
+if __name__ == "__main__":
+    main()
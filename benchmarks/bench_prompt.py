@@ -0,0 +1,68 @@
+"""
+Prompt size benchmark: estimated tokens, characters and encoding time of
+each prompt_encoding layout, for the 48-hour window sent to the AI and for
+the unfiltered 5-day forecast previously sent by /get-recommendation.
+
+Token counts are exact when tiktoken is installed, estimated otherwise.
+
+    python benchmarks/bench_prompt.py [--forecasts 200]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import results  # noqa: E402
+from stubs import forecast_payload  # noqa: E402
+import analyze_weather  # noqa: E402
+import get_weather  # noqa: E402
+import prompt_encoding  # noqa: E402
+
+
+def measure(frames, encoding):
+    tokens, chars = [], []
+    start = time.perf_counter()
+    for df in frames:
+        text, _, count = prompt_encoding.encode(df, encoding)
+        tokens.append(count)
+        chars.append(len(text))
+    elapsed = time.perf_counter() - start
+    return {
+        "tokens_mean": round(statistics.mean(tokens), 1),
+        "tokens_max": max(tokens),
+        "chars_mean": round(statistics.mean(chars), 1),
+        "encode_us": round(elapsed / len(frames) * 1e6, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--forecasts", type=int, default=200)
+    results.add_arguments(parser)
+    args = parser.parse_args()
+
+    full = []
+    for i in range(args.forecasts):
+        lat, lon = 33 + (i % 40) * 0.1, 8 + (i // 40) * 0.1
+        full.append(get_weather.parse_forecast(forecast_payload(lat, lon), lat, lon))
+    windows = [analyze_weather.prompt_window(df) for df in full]
+
+    report = {
+        "tokenizer": "tiktoken" if prompt_encoding._tokenizer is not None else "estimate",
+        "token_budget": prompt_encoding.PROMPT_TOKEN_BUDGET,
+        "full_table": measure(full, "table"),
+    }
+    for encoding in ("table", "compact", "daily", "auto"):
+        report[f"window_{encoding}"] = measure(windows, encoding)
+    report["reduction_vs_full_table"] = round(
+        1 - report["window_auto"]["tokens_mean"] / report["full_table"]["tokens_mean"], 3
+    )
+    results.finish("prompt", report, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Microbenchmark of analyze_weather.read_latest_forecast against forecast logs
+of growing size, for the legacy CSV log and the SQLite forecast store
+(latest fetch of any location, and of one given location).
+
+Each log holds `fetches` fetches of 40 rows spread over `--locations`
+locations, the latest ones forecasting the coming days.
+
+    python benchmarks/bench_read_forecast.py [--sizes 10,100,1000,5000] [--repeat 5]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import results  # noqa: E402
+import analyze_weather  # noqa: E402
+import forecast_store  # noqa: E402
+
+STEPS = 40  # rows per fetch (5 days x 3 hours)
+
+
+def make_log(fetches, locations, now):
+    """DataFrame of `fetches` fetches in log order, one every 30 minutes up to `now`."""
+    rng = np.random.default_rng(fetches)
+    fetch = np.repeat(np.arange(fetches), STEPS)
+    step = np.tile(np.arange(STEPS), fetches)
+    fetched_at = now - pd.to_timedelta((fetches - 1 - fetch) * 30, unit="min")
+    location = fetch % locations
+    rows = len(fetch)
+    temp = rng.uniform(10, 35, rows).round(2)
+    return pd.DataFrame({
+        "location_name": [f"Field {i}" for i in location],
+        "latitude": 36.0 + location * 0.1,
+        "longitude": 10.0 + location * 0.1,
+        "forecast_time": (fetched_at.floor("h") + pd.to_timedelta(3 * (step + 1), unit="h")).strftime("%Y-%m-%d %H:%M:%S"),
+        "temp_c": temp,
+        "feels_like_c": temp - 0.5,
+        "temp_min_c": temp - 1.5,
+        "temp_max_c": temp + 1.5,
+        "humidity_percent": rng.integers(20, 95, rows),
+        "weather_condition": rng.choice(["ciel dégagé", "peu nuageux", "pluie légère"], rows),
+        "wind_speed_mps": rng.uniform(0, 9, rows).round(2),
+        "precipitation_prob_percent": (rng.random(rows) * 100).round(),
+        "cloudiness_percent": rng.integers(0, 100, rows),
+        "fetched_at": fetched_at.strftime("%Y-%m-%d %H:%M:%S"),
+    })
+
+
+def measure(func, repeat):
+    """Median and min seconds of `repeat` calls (after one warm-up call)."""
+    result = func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return {
+        "median_ms": round(statistics.median(timings) * 1000, 3),
+        "min_ms": round(min(timings) * 1000, 3),
+        "rows_returned": 0 if result is None else len(result),
+    }
+
+
+def bench_size(fetches, locations, repeat, workdir):
+    now = pd.Timestamp(datetime.now().replace(microsecond=0))
+    log = make_log(fetches, locations, now)
+    csv_path = os.path.join(workdir, f"log-{fetches}.csv")
+    db_path = os.path.join(workdir, f"log-{fetches}.db")
+    log.to_csv(csv_path, index=False)
+    store = forecast_store.ForecastStore(db_path, retention_days=3650, compact_every=0)
+    store.append(log)
+    lat, lon = float(log["latitude"].iloc[-1]), float(log["longitude"].iloc[-1])
+    return {
+        "rows": len(log),
+        "csv_mib": round(os.path.getsize(csv_path) / 2 ** 20, 2),
+        "csv": measure(lambda: analyze_weather.read_latest_forecast(csv_path), repeat),
+        "store_any_location": measure(lambda: analyze_weather.read_latest_forecast(db_path), repeat),
+        "store_location": measure(lambda: analyze_weather.read_latest_forecast(db_path, lat, lon), repeat),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="10,100,1000,5000", help="fetches per log, comma-separated")
+    parser.add_argument("--locations", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    results.add_arguments(parser)
+    args = parser.parse_args()
+
+    report = {}
+    with tempfile.TemporaryDirectory(prefix="bench-read-") as workdir:
+        for fetches in (int(size) for size in args.sizes.split(",")):
+            report[f"fetches_{fetches}"] = bench_size(fetches, args.locations, args.repeat, workdir)
+            print(f"{fetches} fetches done", file=sys.stderr)
+    results.finish("read_forecast", report, args)
+
+
+if __name__ == "__main__":
+    main()
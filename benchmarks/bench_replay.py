@@ -0,0 +1,175 @@
+"""
+Offline replay benchmark: records a corpus of upstream responses by running
+the backend against the local stubs (UPSTREAM_MODE=record), then serves it
+back (UPSTREAM_MODE=replay, no network and no API keys) and drives
+/get-recommendation through the whole pipeline (forecast fetch and parse,
+store, prompt, LLM) with both caches disabled.
+
+Reports the corpus size, throughput and latency percentiles of the replay
+run and, with --profile N, the slowest functions over N cProfile dumps
+taken with the built-in per-request profiler.
+
+    python benchmarks/bench_replay.py [--record 20] [--duration 10] [--workers 64] [--profile 5]
+    python benchmarks/bench_replay.py --corpus replay_corpus.jsonl.gz   # replay an existing corpus
+"""
+import argparse
+import asyncio
+import glob
+import io
+import os
+import pstats
+import random
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import results  # noqa: E402
+from bench_load import REPO, Recorder, Server, free_port, recommendation_worker  # noqa: E402
+from stubs import StubServer  # noqa: E402
+
+# Upstream settings removed from the replay server's environment
+UPSTREAM_VARIABLES = ("OPENWEATHERMAP_API_URL", "OPENWEATHERMAP_API_KEY", "OPENAI_BASE_URL", "OPENAI_API_KEY")
+
+
+def random_locations(count, seed):
+    rng = random.Random(seed)
+    return [(round(rng.uniform(33, 37), 3), round(rng.uniform(8, 11), 3)) for _ in range(count)]
+
+
+async def record(corpus, workdir, locations):
+    """Runs the backend against the stubs in record mode and requests each location once."""
+    stub = StubServer(owm_latency=0.01, llm_latency=0.01).start()
+    env = {
+        **os.environ,
+        **stub.env(),
+        "UPSTREAM_MODE": "record",
+        "REPLAY_CORPUS": corpus,
+        "RECOMMENDER_MODE": "llm",
+        "FORECAST_STORE_PATH": os.path.join(workdir, "record.db"),
+        "SCHEDULER_ENABLED": "0",
+        "PYTHONPATH": REPO,
+    }
+    server = Server(env, workdir, free_port())
+    try:
+        await server.wait_ready()
+        async with httpx.AsyncClient(timeout=60) as client:
+            for lat, lon in locations:
+                params = {"lat": lat, "lon": lon}
+                (await client.get(f"{server.url}/get-recommendation", params=params)).raise_for_status()
+            # streamed answers are recorded too
+            lat, lon = locations[0]
+            async with client.stream("GET", f"{server.url}/get-recommendation/stream",
+                                     params={"lat": lat + 0.5, "lon": lon}) as response:
+                async for _ in response.aiter_bytes():
+                    pass
+            return (await client.get(f"{server.url}/replay/stats")).json()["corpus"]
+    finally:
+        server.stop()
+        stub.stop()
+
+
+def top_functions(directory, limit=15):
+    """Cumulative time of the slowest functions over every .prof file in `directory`."""
+    files = glob.glob(os.path.join(directory, "*.prof"))
+    if not files:
+        return {"profiles": 0}
+    stats = pstats.Stats(*files, stream=io.StringIO())
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+    top = {}
+    for (filename, line, function), (_, calls, _, cumulative, _) in rows:
+        if filename.startswith("~") or "site-packages" in filename or "asyncio" in filename:
+            continue
+        top[f"{os.path.relpath(filename, REPO)}:{line}({function})"] = {
+            "calls": calls, "cumulative_ms": round(cumulative * 1000 / len(files), 3),
+        }
+        if len(top) >= limit:
+            break
+    return {"profiles": len(files), "per_request": top}
+
+
+async def replay(args, corpus, workdir):
+    profile_dir = os.path.join(workdir, "profiles")
+    env = {key: value for key, value in os.environ.items() if key not in UPSTREAM_VARIABLES}
+    env.update({
+        "UPSTREAM_MODE": "replay",
+        "REPLAY_CORPUS": corpus,
+        "REPLAY_WEATHER_LATENCY": str(args.weather_latency),
+        "REPLAY_LLM_LATENCY": str(args.llm_latency),
+        "RECOMMENDER_MODE": args.mode,
+        "FORECAST_STORE_PATH": os.path.join(workdir, "replay.db"),
+        "SCHEDULER_ENABLED": "0",
+        # every request runs the full pipeline
+        "FORECAST_CACHE_TTL": "0",
+        "RECOMMENDATION_CACHE_TTL": "0",
+        # measure the pipeline, not the admission limits
+        "ADMISSION_RECOMMENDATION_LIMIT": str(args.workers),
+        "ADMISSION_PER_CLIENT": "0",
+        "PROFILER": "cprofile" if args.profile else "off",
+        "PROFILE_DIR": profile_dir,
+        "PYTHONPATH": REPO,
+    })
+    server = Server(env, workdir, free_port())
+    recorder = Recorder()
+    stop = asyncio.Event()
+    locations = random_locations(args.locations, args.seed + 1)
+    try:
+        await server.wait_ready()
+        limits = httpx.Limits(max_connections=args.workers + 4)
+        async with httpx.AsyncClient(timeout=60, limits=limits) as client:
+            tasks = [asyncio.create_task(recommendation_worker(client, server.url, locations, recorder, stop))
+                     for _ in range(args.workers)]
+            start = time.perf_counter()
+            await asyncio.sleep(args.duration)
+            stop.set()
+            await asyncio.wait(tasks, timeout=30)
+            elapsed = time.perf_counter() - start
+            # profiled requests run alone, after the load
+            for lat, lon in locations[:args.profile]:
+                await client.get(f"{server.url}/get-recommendation", params={"lat": lat, "lon": lon},
+                                 headers={"X-Profile": "1"})
+            stats = (await client.get(f"{server.url}/replay/stats")).json()
+    finally:
+        server.stop()
+    report = {
+        "duration_seconds": round(elapsed, 2),
+        "workloads": recorder.summary(elapsed),
+        "corpus_lookups": {key: stats["corpus"][key] for key in ("exact", "fallback")},
+    }
+    if args.profile:
+        report["profile"] = top_functions(profile_dir)
+    return report
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--corpus", help="existing corpus to replay (default: record a new one)")
+    parser.add_argument("--record", type=int, default=20, help="locations recorded into the new corpus")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of replayed load")
+    parser.add_argument("--workers", type=int, default=64, help="concurrent /get-recommendation loops")
+    parser.add_argument("--locations", type=int, default=200, help="distinct fields requested in replay")
+    parser.add_argument("--weather-latency", type=float, default=0.0)
+    parser.add_argument("--llm-latency", type=float, default=0.0)
+    parser.add_argument("--mode", default="llm", help="RECOMMENDER_MODE of the server")
+    parser.add_argument("--profile", type=int, default=0, metavar="N", help="profile N requests after the load")
+    parser.add_argument("--seed", type=int, default=1)
+    results.add_arguments(parser)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-replay-")
+    corpus = args.corpus or os.path.join(workdir, "corpus.jsonl.gz")
+    report = {}
+    if not args.corpus:
+        recorded = await record(corpus, workdir, random_locations(args.record, args.seed))
+        report["recorded"] = recorded["recorded"]
+    report["corpus_kib"] = round(os.path.getsize(corpus) / 1024, 1)
+    report["replay"] = await replay(args, os.path.abspath(corpus), workdir)
+    report["config"] = {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+    results.finish("replay", report, args)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,148 @@
+"""
+Cold start benchmark: import time of `main` (python -X importtime, total
+and slowest direct imports), heavy modules loaded by the import alone, and
+time until a freshly launched `python main.py` answers /health, /state and
+its first /get-recommendation (against benchmarks/stubs.py), with and
+without the background preload of pandas and the OpenAI SDK.
+
+    python benchmarks/bench_startup.py [--repeat 5] [--delay 1]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import results  # noqa: E402
+from bench_load import REPO, free_port  # noqa: E402
+from stubs import StubServer  # noqa: E402
+
+# Modules that are slow to import and not needed by /health, /state or /ws
+HEAVY_MODULES = ("pandas", "openai", "numpy", "requests", "uvicorn")
+
+
+def median_ms(values):
+    return round(statistics.median(values) * 1000, 1)
+
+
+def import_profile(env, workdir):
+    """Cumulative microseconds of `main` and of each of its direct imports, from -X importtime."""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=workdir, env=env, capture_output=True, text=True, check=True,
+    ).stderr
+    total, direct = None, {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        if depth == 0 and name.strip() == "main":
+            total = int(cumulative)
+        elif depth == 1:
+            direct[name.strip()] = int(cumulative)
+    return total, direct
+
+
+def imports(env, workdir, repeat):
+    totals, direct = [], {}
+    for _ in range(repeat):
+        total, modules = import_profile(env, workdir)
+        totals.append(total / 1e6)
+        for name, cumulative in modules.items():
+            direct.setdefault(name, []).append(cumulative / 1e6)
+    loaded = subprocess.run(
+        [sys.executable, "-c", f"import json, sys, main; print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"],
+        cwd=workdir, env=env, capture_output=True, text=True, check=True,
+    ).stdout.strip().splitlines()[-1]
+    slowest = sorted(direct.items(), key=lambda item: statistics.median(item[1]), reverse=True)[:8]
+    return {
+        "main_ms": median_ms(totals),
+        "slowest_direct_imports_ms": {name: median_ms(values) for name, values in slowest},
+        "heavy_modules_loaded": json.loads(loaded),
+    }
+
+
+def cold_start(env, workdir, delay):
+    """
+    Seconds from launching `python main.py` until each endpoint first answers;
+    the first recommendation is requested `delay` seconds after /state.
+    """
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    with open(os.path.join(workdir, "server.log"), "w") as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(REPO, "main.py"), "--port", str(port), "--log-level", "warning"],
+            cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT,
+        )
+        try:
+            timings = {}
+            with httpx.Client(timeout=30) as client:
+                while "health" not in timings:
+                    if process.poll() is not None:
+                        raise RuntimeError(f"server exited with code {process.returncode}, see {log.name}")
+                    try:
+                        if client.get(f"{url}/health").status_code == 200:
+                            timings["health"] = time.perf_counter() - start
+                    except httpx.TransportError:
+                        time.sleep(0.01)
+                client.get(f"{url}/state").raise_for_status()
+                timings["state"] = time.perf_counter() - start
+                time.sleep(delay)
+                request_start = time.perf_counter()
+                client.get(f"{url}/get-recommendation").raise_for_status()
+                timings["first_recommendation"] = time.perf_counter() - start
+                timings["first_recommendation_request"] = time.perf_counter() - request_start
+            return timings
+        finally:
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def cold_starts(env, workdir, repeat, delay):
+    runs = [cold_start(env, workdir, delay) for _ in range(repeat)]
+    return {f"{name}_ms": median_ms([run[name] for run in runs]) for name in runs[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--delay", type=float, default=1.0,
+                        help="seconds between /state and the first recommendation")
+    results.add_arguments(parser)
+    args = parser.parse_args()
+
+    stub = StubServer(owm_latency=0.01, llm_latency=0.01).start()
+    workdir = tempfile.mkdtemp(prefix="bench-startup-")
+    env = {
+        **os.environ,
+        **stub.env(),
+        "RECOMMENDER_MODE": "llm",
+        "FORECAST_STORE_PATH": os.path.join(workdir, "weather_forecast.db"),
+        "SCHEDULER_ENABLED": "0",
+        "PYTHONPATH": REPO,
+    }
+    try:
+        report = {
+            "imports": imports(env, workdir, args.repeat),
+            "cold_start": cold_starts(env, workdir, args.repeat, args.delay),
+            "cold_start_no_preload": cold_starts({**env, "PRELOAD_MODULES": ""}, workdir, args.repeat, args.delay),
+        }
+    finally:
+        stub.stop()
+    results.finish("startup", report, args)
+
+
+if __name__ == "__main__":
+    main()
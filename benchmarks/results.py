@@ -0,0 +1,124 @@
+"""
+Shared helpers for the benchmark scripts: latency percentiles, JSON result
+files tagged with the git commit, and comparison against an earlier run.
+
+    python benchmarks/results.py benchmarks/results/load-aaaa.json benchmarks/results/load-bbbb.json
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# Changes smaller than this (relative) are not flagged by compare()
+THRESHOLD = 0.10
+
+
+def percentiles(values):
+    """p50/p90/p99/max (milliseconds) of a list of durations in seconds."""
+    if not values:
+        return {"p50_ms": None, "p90_ms": None, "p99_ms": None, "max_ms": None}
+    values = sorted(values)
+
+    def pick(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 3)
+
+    return {"p50_ms": pick(0.50), "p90_ms": pick(0.90), "p99_ms": pick(0.99), "max_ms": pick(1.0)}
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(RESULTS_DIR),
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True,
+            cwd=os.path.dirname(RESULTS_DIR),
+        ).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def add_arguments(parser):
+    parser.add_argument("--output", help="result file (default: benchmarks/results/<name>-<commit>-<time>.json)")
+    parser.add_argument("--compare", metavar="BASELINE", help="earlier result file to compare against")
+
+
+def _flatten(value, prefix=""):
+    if isinstance(value, dict):
+        out = {}
+        for key, item in value.items():
+            out.update(_flatten(item, f"{prefix}.{key}" if prefix else str(key)))
+        return out
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: value}
+    return {}
+
+
+def compare(baseline, current, threshold=THRESHOLD):
+    """Numbers present in both runs, with their relative change; changes above `threshold` are flagged."""
+    old, new = (
+        {key: value for key, value in _flatten(run.get("results", {})).items() if not key.startswith("config.")}
+        for run in (baseline, current)
+    )
+    rows = []
+    for key in sorted(old.keys() & new.keys()):
+        before, after = old[key], new[key]
+        change = (after - before) / before if before else None
+        rows.append({
+            "metric": key,
+            "baseline": before,
+            "current": after,
+            "change": round(change, 4) if change is not None else None,
+            "flag": change is not None and abs(change) > threshold,
+        })
+    return rows
+
+
+def print_comparison(rows, baseline_commit, current_commit):
+    print(f"\n{baseline_commit} -> {current_commit} (changes above {THRESHOLD:.0%} marked with *)")
+    for row in rows:
+        change = f"{row['change']:+.1%}" if row["change"] is not None else "n/a"
+        mark = "*" if row["flag"] else " "
+        print(f"{mark} {row['metric']:<72} {row['baseline']:>12} {row['current']:>12} {change:>9}")
+
+
+def finish(name, results, args):
+    """Prints `results`, writes them as JSON with run metadata, and compares with --compare if given."""
+    document = {
+        "benchmark": name,
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "results": results,
+    }
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"{name}-{document['commit']}-{stamp}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(document, f, indent=2, ensure_ascii=False)
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    print(f"\nResults saved to {output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print_comparison(compare(baseline, document), baseline.get("commit"), document["commit"])
+    return output
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit(__doc__.strip())
+    with open(sys.argv[1], encoding="utf-8") as f:
+        first = json.load(f)
+    with open(sys.argv[2], encoding="utf-8") as f:
+        second = json.load(f)
+    print_comparison(compare(first, second), first.get("commit"), second.get("commit"))
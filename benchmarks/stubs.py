@@ -0,0 +1,211 @@
+"""
+Local stand-ins for OpenWeatherMap and the OpenAI chat completions API,
+with configurable latency and error rate, so the backend can be load-tested
+offline and reproducibly.
+
+Point the backend at them with
+    OPENWEATHERMAP_API_URL=http://127.0.0.1:<port>/data/2.5/forecast
+    OPENAI_BASE_URL=http://127.0.0.1:<port>/v1
+
+    python benchmarks/stubs.py [--owm-latency 0.05] [--llm-latency 0.3] [--error-rate 0]
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ANSWER = (
+    "Il est recommandé d'arroser les tomates et la menthe en fin de journée, "
+    "tandis que les oignons ne nécessitent pas d'arrosage aujourd'hui."
+)
+
+
+def forecast_payload(lat, lon, steps=40, now=None):
+    """A 5-day/3-hour forecast shaped like the OpenWeatherMap response, varying with the location."""
+    now = (now or datetime.now()).replace(minute=0, second=0, microsecond=0)
+    rng = random.Random(f"{lat:.2f},{lon:.2f}")
+    base = rng.uniform(12, 30)
+    entries = []
+    for i in range(steps):
+        temp = base + 5 * math.sin(2 * math.pi * i / 8) + rng.uniform(-1, 1)  # daily cycle
+        entries.append({
+            "dt_txt": (now + timedelta(hours=3 * (i + 1))).strftime("%Y-%m-%d %H:%M:%S"),
+            "main": {
+                "temp": round(temp, 2),
+                "feels_like": round(temp - 0.5, 2),
+                "temp_min": round(temp - 1.5, 2),
+                "temp_max": round(temp + 1.5, 2),
+                "humidity": rng.randint(25, 90),
+            },
+            "weather": [{"description": rng.choice(("ciel dégagé", "peu nuageux", "pluie légère"))}],
+            "wind": {"speed": round(rng.uniform(0, 9), 2)},
+            "pop": round(rng.random(), 2),
+            "clouds": {"all": rng.randint(0, 100)},
+        })
+    return {"city": {"name": f"Stub {lat:.2f},{lon:.2f}"}, "list": entries}
+
+
+def _completion(content):
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": "stub",
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+def _chunk(content=None, finish_reason=None):
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": "stub",
+        "choices": [{
+            "index": 0,
+            "delta": {"content": content} if content is not None else {},
+            "finish_reason": finish_reason,
+        }],
+    }
+
+
+class StubServer:
+    """
+    One threaded HTTP server answering both upstreams. `owm_latency` and
+    `llm_latency` are seconds per request (a whole completion, spread over the
+    chunks when streaming); a fraction `error_rate` of requests gets a 503.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, owm_latency=0.05, llm_latency=0.3, error_rate=0.0, seed=1):
+        self.owm_latency = owm_latency
+        self.llm_latency = llm_latency
+        self.error_rate = error_rate
+        self.requests = {"owm": 0, "llm": 0, "errors": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self):
+        """Environment variables pointing the backend at this server."""
+        return {
+            "OPENWEATHERMAP_API_URL": f"{self.url}/data/2.5/forecast",
+            "OPENWEATHERMAP_API_KEY": "stub",
+            "OPENAI_BASE_URL": f"{self.url}/v1",
+            "OPENAI_API_KEY": "stub",
+            "LLM_PROVIDER": "openai",
+        }
+
+    def _fail(self, kind):
+        with self._lock:
+            self.requests[kind] += 1
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.requests["errors"] += 1
+        return failed
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status, payload):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if not url.path.endswith("/forecast"):
+                    return self._send_json(404, {"message": "not found"})
+                time.sleep(stub.owm_latency)
+                if stub._fail("owm"):
+                    return self._send_json(503, {"message": "stub error"})
+                query = parse_qs(url.query)
+                lat, lon = float(query["lat"][0]), float(query["lon"][0])
+                self._send_json(200, forecast_payload(lat, lon))
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if not self.path.endswith("/chat/completions"):
+                    return self._send_json(404, {"error": {"message": "not found"}})
+                request = json.loads(body or b"{}")
+                if stub._fail("llm"):
+                    time.sleep(stub.llm_latency / 10)
+                    return self._send_json(503, {"error": {"message": "stub error", "type": "server_error"}})
+                if request.get("stream"):
+                    return self._stream()
+                time.sleep(stub.llm_latency)
+                content = ANSWER
+                if (request.get("response_format") or {}).get("type") == "json_object":
+                    ids = [line[len("### id: "):].strip()
+                           for line in request["messages"][-1]["content"].splitlines()
+                           if line.startswith("### id: ")]
+                    content = json.dumps({"recommendations": [{"id": i, "recommendation": ANSWER} for i in ids]})
+                self._send_json(200, _completion(content))
+
+            def _stream(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                words = ANSWER.split(" ")
+                for i, word in enumerate(words):
+                    time.sleep(stub.llm_latency / len(words))
+                    chunk = _chunk(word if i == 0 else " " + word)
+                    self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                self.wfile.write(f"data: {json.dumps(_chunk(finish_reason='stop'))}\n\n".encode("utf-8"))
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.close_connection = True
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--owm-latency", type=float, default=0.05)
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server = StubServer(port=args.port, owm_latency=args.owm_latency,
+                        llm_latency=args.llm_latency, error_rate=args.error_rate).start()
+    for name, value in server.env().items():
+        print(f"{name}={value}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,207 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Bounded LRU mapping whose entries expire `ttl` seconds after being stored.
+
+    Expired entries are kept (until evicted) so callers can still decide to
+    serve them as stale data; `lookup` reports whether the value is fresh.
+    """
+
+    def __init__(self, maxsize=256, ttl=600.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data = OrderedDict()  # key -> (value, stored_at)
+        self.evictions = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def lookup(self, key):
+        """
+        Returns (value, age_seconds) for `key`, or (None, None) if absent.
+        A hit moves the entry to the most-recently-used position.
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            return None, None
+        self._data.move_to_end(key)
+        value, stored_at = entry
+        return value, self._clock() - stored_at
+
+    def get(self, key):
+        """Returns the value for `key` only if it has not expired."""
+        value, age = self.lookup(key)
+        if age is None or age > self.ttl:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (value, self._clock())
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key):
+        entry = self._data.pop(key, None)
+        return entry[0] if entry else None
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+        }
+
+
+class ForecastCache:
+    """
+    In-process forecast cache keyed by (lat, lon) snapped to a grid cell.
+
+    `fetch` is an async callable `fetch(lat, lon)` returning the forecast for
+    the cell centre (or None on failure). Concurrent misses for the same cell
+    share a single upstream call. With `stale_while_revalidate`, an expired
+    entry younger than `ttl + max_stale` is served immediately while a
+    background refresh runs. If the upstream fails (or its circuit breaker is
+    open), an expired entry younger than `max_fallback_age` is served instead
+    of an error.
+    """
+
+    def __init__(self, fetch, ttl=1800.0, grid=0.05, maxsize=256,
+                 stale_while_revalidate=False, max_stale=None, max_fallback_age=43200.0,
+                 clock=time.monotonic):
+        self._fetch = fetch
+        self.grid = grid
+        self.stale_while_revalidate = stale_while_revalidate
+        self.max_stale = ttl if max_stale is None else max_stale
+        self.max_fallback_age = max_fallback_age
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl, clock=clock)
+        self._inflight = {}  # cell -> asyncio.Task
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.coalesced = 0
+        self.fallbacks = 0
+        self.upstream_calls = 0
+        self.upstream_errors = 0
+
+    @property
+    def ttl(self):
+        return self._entries.ttl
+
+    def cell(self, lat, lon):
+        """Snaps a coordinate to the centre of its grid cell."""
+        if not self.grid:
+            return (round(float(lat), 4), round(float(lon), 4))
+        return (
+            round(round(float(lat) / self.grid) * self.grid, 4),
+            round(round(float(lon) / self.grid) * self.grid, 4),
+        )
+
+    def put(self, lat, lon, value):
+        """Stores a forecast fetched outside the cache (e.g. by a background job)."""
+        if value is not None:
+            self._entries.set(self.cell(lat, lon), value)
+
+    def peek(self, lat, lon):
+        """Returns the cached forecast for the cell, fresh or not, without fetching."""
+        value, _ = self._entries.lookup(self.cell(lat, lon))
+        return value
+
+    async def refresh(self, lat, lon):
+        """Forces an upstream fetch for the cell (joining one already in flight)."""
+        return await asyncio.shield(self._refresh(self.cell(lat, lon)))
+
+    async def get(self, lat, lon):
+        cell = self.cell(lat, lon)
+        value, age = self._entries.lookup(cell)
+
+        if age is not None and age <= self.ttl:
+            self.hits += 1
+            return value
+
+        if (age is not None and self.stale_while_revalidate
+                and age <= self.ttl + self.max_stale):
+            self.stale += 1
+            self._refresh(cell)
+            return value
+
+        self.misses += 1
+        if cell in self._inflight:
+            self.coalesced += 1
+        fallback = value if age is not None and age <= self.max_fallback_age else None
+        try:
+            fresh = await asyncio.shield(self._refresh(cell))
+        except Exception:
+            if fallback is None:
+                raise
+            fresh = None
+        if fresh is None and fallback is not None:
+            self.fallbacks += 1
+            return fallback
+        return fresh
+
+    def _refresh(self, cell):
+        """Starts (or joins) the single upstream fetch for `cell`."""
+        task = self._inflight.get(cell)
+        if task is None:
+            task = asyncio.ensure_future(self._load(cell))
+            self._inflight[cell] = task
+            task.add_done_callback(lambda t, c=cell: self._done(c, t))
+        return task
+
+    def _done(self, cell, task):
+        self._inflight.pop(cell, None)
+        # Background refreshes may have no awaiter; retrieve the error so it is not logged as lost
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Warning: forecast refresh failed for cell {cell}: {task.exception()}")
+
+    async def _load(self, cell):
+        self.upstream_calls += 1
+        try:
+            value = await self._fetch(*cell)
+        except Exception:
+            self.upstream_errors += 1
+            raise
+        if value is None:
+            self.upstream_errors += 1
+        else:
+            self._entries.set(cell, value)
+        return value
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.stale
+        return {
+            "size": len(self._entries),
+            "maxsize": self._entries.maxsize,
+            "ttl_seconds": self.ttl,
+            "grid_degrees": self.grid,
+            "stale_while_revalidate": self.stale_while_revalidate,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "coalesced": self.coalesced,
+            "fallbacks": self.fallbacks,
+            "hit_ratio": round((self.hits + self.stale) / lookups, 4) if lookups else None,
+            "evictions": self._entries.evictions,
+            "inflight": len(self._inflight),
+            "upstream_calls": self.upstream_calls,
+            "upstream_errors": self.upstream_errors,
+        }
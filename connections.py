@@ -0,0 +1,239 @@
+import asyncio
+import json
+import os
+from collections import deque
+
+import metrics
+
+# --- Configuration ---
+# Messages buffered per client before the slow-consumer policy applies
+SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "100"))
+
+# "drop_oldest": discard the oldest queued message; "disconnect": close the client
+SLOW_CLIENT_POLICY = os.getenv("WS_SLOW_CLIENT_POLICY", "drop_oldest")
+
+# A single send taking longer than this (seconds) disconnects the client
+SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+
+# Delay (seconds) used to merge bursts of state changes into one broadcast
+STATE_COALESCE_DELAY = float(os.getenv("WS_STATE_COALESCE_DELAY", "0"))
+
+
+class ClientConnection:
+    """
+    Outbound side of one WebSocket: a bounded message queue drained by its
+    own sender task, plus a single state slot that is merged rather than
+    queued, so a slow client only ever receives the newest state.
+    """
+
+    def __init__(self, websocket, on_close, maxsize=SEND_QUEUE_SIZE, policy=SLOW_CLIENT_POLICY,
+                 send_timeout=SEND_TIMEOUT):
+        self.websocket = websocket
+        self.maxsize = maxsize
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.queue = deque()
+        self.pending_state = None
+        self.dropped = 0
+        self.sent = 0
+        self.closed = False
+        self._on_close = on_close
+        self._ready = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._sender())
+
+    def enqueue(self, data):
+        """Queues a serialized message. Returns False if the client should be dropped."""
+        if self.closed:
+            return False
+        if len(self.queue) >= self.maxsize:
+            if self.policy == "disconnect":
+                return False
+            self.queue.popleft()
+            self.dropped += 1
+        self.queue.append(data)
+        self._ready.set()
+        return True
+
+    def set_state(self, message, data=None):
+        """
+        Sets the state message to send next (`data` is its serialized form, if
+        already known). A pending `state_delta` is merged with a newer one, or
+        folded into a pending full `state`, so a slow client gets one
+        up-to-date message instead of a backlog.
+        """
+        if self.pending_state is not None:
+            self.dropped += 1
+            pending = self.pending_state[0]
+            if message.get("type") == "state_delta":
+                if pending.get("type") == "state_delta":
+                    message = {**message, "base": pending["base"],
+                               "changes": {**pending["changes"], **message["changes"]}}
+                    data = None
+                elif pending.get("type") == "state":
+                    message = {"type": "state", "rev": message["rev"],
+                               "state": {**pending["state"], **message["changes"]}}
+                    data = None
+        self.pending_state = (message, data)
+        self._ready.set()
+
+    async def _sender(self):
+        try:
+            while not self.closed:
+                await self._ready.wait()
+                self._ready.clear()
+                while not self.closed and (self.queue or self.pending_state is not None):
+                    # Queued messages first: they may include an initial snapshot the
+                    # pending state delta applies on top of
+                    if self.queue:
+                        data = self.queue.popleft()
+                    else:
+                        (message, data), self.pending_state = self.pending_state, None
+                        if data is None:
+                            data = json.dumps(message, ensure_ascii=False)
+                    await asyncio.wait_for(self.websocket.send_text(data), timeout=self.send_timeout)
+                    self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Broken or too slow: stop sending and let the manager forget this client
+            self._on_close(self)
+
+    async def close(self):
+        self.closed = True
+        # Also wakes the sender in case wait_for() swallowed the cancellation
+        self._ready.set()
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+
+class ConnectionManager:
+    """
+    Tracks WebSocket clients and fans messages out to them concurrently.
+
+    Each broadcast is serialized once and pushed to every client's queue
+    without awaiting, so one slow client cannot delay the others. State
+    broadcasts requested in a burst are merged into a single message built
+    from the latest state.
+    """
+
+    def __init__(self, maxsize=SEND_QUEUE_SIZE, policy=SLOW_CLIENT_POLICY, send_timeout=SEND_TIMEOUT,
+                 coalesce_delay=STATE_COALESCE_DELAY):
+        self.maxsize = maxsize
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.coalesce_delay = coalesce_delay
+        self.clients = {}  # WebSocket -> ClientConnection
+        self._state_source = None
+        self._state_flush = None
+        self.broadcasts = 0
+        self.state_requests = 0
+        self.disconnected_slow = 0
+        self._dropped_closed = 0  # messages dropped for clients that have since left
+
+    @property
+    def active_connections(self):
+        return list(self.clients)
+
+    def register(self, websocket):
+        """Starts the sender task for an already-accepted WebSocket."""
+        client = ClientConnection(websocket, self._drop, self.maxsize, self.policy, self.send_timeout)
+        self.clients[websocket] = client
+        client.start()
+        return client
+
+    async def connect(self, websocket):
+        await websocket.accept()
+        return self.register(websocket)
+
+    def disconnect(self, websocket):
+        client = self.clients.pop(websocket, None)
+        if client is not None:
+            self._dropped_closed += client.dropped
+            asyncio.ensure_future(client.close())
+
+    def _drop(self, client):
+        self.disconnect(client.websocket)
+
+    def send_state(self, websocket, message):
+        """Sends a `state` or `state_delta` message to one client through its state slot."""
+        client = self.clients.get(websocket)
+        if client is not None:
+            client.set_state(message)
+
+    def send_personal(self, websocket, message):
+        """Queues a message for one client (same ordering guarantees as broadcasts)."""
+        client = self.clients.get(websocket)
+        if client is not None and not client.enqueue(json.dumps(message, ensure_ascii=False)):
+            self.disconnected_slow += 1
+            self.disconnect(websocket)
+
+    async def broadcast(self, message):
+        self.broadcast_nowait(message)
+
+    def broadcast_nowait(self, message):
+        """Serializes `message` once and queues it for every client."""
+        with metrics.websocket_broadcast_seconds.time(kind="message"):
+            data = json.dumps(message, ensure_ascii=False)
+            self.broadcasts += 1
+            for websocket, client in list(self.clients.items()):
+                if not client.enqueue(data):
+                    self.disconnected_slow += 1
+                    self.disconnect(websocket)
+
+    def broadcast_state(self, source):
+        """
+        Requests a state broadcast. Requests made before the flush runs (same
+        event-loop tick, or within `coalesce_delay`) are merged: `source()`
+        is called once, at flush time, and returns the message to send (or
+        None if there is nothing new).
+        """
+        self.state_requests += 1
+        self._state_source = source
+        if self._state_flush is None:
+            loop = asyncio.get_running_loop()
+            if self.coalesce_delay > 0:
+                self._state_flush = loop.call_later(self.coalesce_delay, self._flush_state)
+            else:
+                self._state_flush = loop.call_soon(self._flush_state)
+
+    def _flush_state(self):
+        self._state_flush = None
+        source, self._state_source = self._state_source, None
+        if source is None:
+            return
+        with metrics.websocket_broadcast_seconds.time(kind="state"):
+            message = source()
+            if message is None:
+                return
+            data = json.dumps(message, ensure_ascii=False)
+            self.broadcasts += 1
+            for client in list(self.clients.values()):
+                client.set_state(message, data)
+
+    async def close(self):
+        """Stops every sender task (application shutdown)."""
+        if self._state_flush is not None:
+            self._state_flush.cancel()
+            self._state_flush = None
+        clients = list(self.clients.values())
+        self.clients.clear()
+        await asyncio.gather(*(client.close() for client in clients), return_exceptions=True)
+
+    def stats(self):
+        clients = list(self.clients.values())
+        return {
+            "connections": len(clients),
+            "queued": sum(len(c.queue) for c in clients),
+            "dropped": self._dropped_closed + sum(c.dropped for c in clients),
+            "broadcasts": self.broadcasts,
+            "state_requests": self.state_requests,
+            "disconnected_slow": self.disconnected_slow,
+            "policy": self.policy,
+        }
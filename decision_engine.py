@@ -0,0 +1,183 @@
+import json
+import os
+
+import numpy as np
+
+from analyze_weather import DEFAULT_CROPS
+
+# --- Configuration ---
+# "llm": always ask the LLM (previous behaviour)
+# "hybrid": engine wording when confident, LLM otherwise (default)
+# "wording": engine decides, the LLM only phrases the decision
+# "engine": never call the LLM
+RECOMMENDER_MODE = os.getenv("RECOMMENDER_MODE", "hybrid").lower()
+
+# Below this confidence (0-1) the hybrid mode hands the question to the LLM
+MIN_CONFIDENCE = float(os.getenv("DECISION_MIN_CONFIDENCE", "0.35"))
+
+# Forecast steps considered (8 x 3h = the next 24 hours)
+WINDOW_STEPS = 8
+
+# Rain expected (mm) when precipitation is certain over the window
+RAIN_EVENT_MM = float(os.getenv("DECISION_RAIN_EVENT_MM", "5"))
+
+# Crop coefficient Kc per season (winter, spring, summer, autumn) and the daily
+# water need (mm) above which the crop should be watered. FAO-56 style values,
+# overridable with CROP_COEFFICIENTS (same JSON shape).
+CROP_COEFFICIENTS = {
+    "oignons": {"kc": [0.70, 1.05, 1.05, 0.75], "threshold_mm": 2.0},
+    "tomates": {"kc": [0.60, 1.15, 1.15, 0.80], "threshold_mm": 3.0},
+    "menthe": {"kc": [0.60, 1.15, 1.15, 1.10], "threshold_mm": 2.5},
+}
+CROP_COEFFICIENTS.update(json.loads(os.getenv("CROP_COEFFICIENTS", "{}")))
+
+SEASONS = ("hiver", "printemps", "été", "automne")
+
+# Articles used when naming crops in the French wording
+_ARTICLES = {"oignons": "les", "tomates": "les", "menthe": "la"}
+
+_COLUMNS = ("temp_c", "temp_min_c", "temp_max_c", "humidity_percent", "wind_speed_mps",
+            "precipitation_prob_percent")
+
+
+def extraterrestrial_radiation(lat, day_of_year):
+    """Daily extraterrestrial radiation Ra (MJ/m²/day), FAO-56 eq. 21, vectorized."""
+    phi = np.radians(lat)
+    angle = 2 * np.pi * day_of_year / 365
+    dr = 1 + 0.033 * np.cos(angle)
+    delta = 0.409 * np.sin(angle - 1.39)
+    ws = np.arccos(np.clip(-np.tan(phi) * np.tan(delta), -1, 1))
+    return (24 * 60 / np.pi) * 0.0820 * dr * (
+        ws * np.sin(phi) * np.sin(delta) + np.cos(phi) * np.cos(delta) * np.sin(ws)
+    )
+
+
+def decide_arrays(temp, tmin, tmax, humidity, wind, pop, lat, day_of_year, kc, thresholds):
+    """
+    Core engine over F fields at once.
+
+    `temp` .. `pop` are (F, T) forecast arrays (NaN-padded, pop in %), `lat`
+    and `day_of_year` are (F,), `kc` and `thresholds` are (F, C)
+    (NaN for crops without coefficients). Returns a dict of arrays:
+    et0 (F,), rain_prob (F,), need (F, C), water (F, C) and confidence (F,).
+    """
+    t_mean = np.nanmean(temp, axis=1)
+    t_max = np.nanmax(tmax, axis=1)
+    t_min = np.nanmin(tmin, axis=1)
+    ra = extraterrestrial_radiation(lat, day_of_year)
+    # Hargreaves ET0 (mm/day), nudged up by wind and down by humid air
+    et0 = 0.0023 * 0.408 * ra * (t_mean + 17.8) * np.sqrt(np.clip(t_max - t_min, 0, None))
+    climate = 1 + 0.05 * (np.nanmean(wind, axis=1) - 2) - 0.004 * (np.nanmean(humidity, axis=1) - 50)
+    et0 = np.clip(et0 * np.clip(climate, 0.7, 1.3), 0, None)
+
+    rain_prob = np.nanmax(pop, axis=1) / 100
+    need = np.clip(kc * et0[:, None] - rain_prob[:, None] * RAIN_EVENT_MM, 0, None)
+    water = need >= thresholds
+
+    # Confidence: how far the closest crop is from its threshold, lowered when
+    # rain is a toss-up, when data is missing or when a crop is unknown
+    margin = np.abs(need - thresholds) / thresholds
+    confidence = np.clip(np.nanmin(np.where(np.isnan(margin), np.inf, margin), axis=1), 0, 1)
+    confidence = confidence * np.clip(0.5 + np.abs(2 * rain_prob - 1), 0, 1)
+    coverage = np.sum(~np.isnan(temp), axis=1) / temp.shape[1]
+    confidence = confidence * np.where(coverage < 0.5, 0.5, 1.0)
+    confidence = np.where(np.isnan(kc).any(axis=1) | ~np.isfinite(et0), 0.0, confidence)
+    return {"et0": et0, "rain_prob": rain_prob, "need": need, "water": water, "confidence": confidence}
+
+
+def _field_arrays(df):
+    """First WINDOW_STEPS rows of a forecast as a (T, len(_COLUMNS)) array, plus latitude and date."""
+    import pandas as pd
+
+    if not df["forecast_time"].is_monotonic_increasing:
+        df = df.sort_values("forecast_time")
+    count = min(len(df), WINDOW_STEPS)
+    # Column by column: much cheaper than slicing the DataFrame first
+    values = np.column_stack([
+        pd.to_numeric(df[c].to_numpy()[:count], errors="coerce").astype(float) if c in df
+        else np.full(count, np.nan)
+        for c in _COLUMNS
+    ])
+    first = pd.Timestamp(df["forecast_time"].array[0])
+    lat = float(df["latitude"].array[0]) if "latitude" in df else 0.0
+    return values, lat, first
+
+
+def decide(frames, crops_list=None, coefficients=None):
+    """
+    Decisions for many fields at once.
+
+    `frames` is a list of forecast DataFrames (columns of fetch_weather_api),
+    `crops_list` the crops of each field (default crops if None). Returns one
+    decision dict per field.
+    """
+    coefficients = coefficients or CROP_COEFFICIENTS
+    count = len(frames)
+    crops_list = [list(c or DEFAULT_CROPS) for c in (crops_list or [None] * count)]
+    width = max(len(c) for c in crops_list)
+    arrays = np.full((len(_COLUMNS), count, WINDOW_STEPS), np.nan)
+    lat = np.zeros(count)
+    day_of_year = np.zeros(count)
+    season = np.zeros(count, dtype=int)
+    kc = np.full((count, width), np.nan)
+    thresholds = np.full((count, width), np.nan)
+    extracted = {}  # fields of the same grid cell share one DataFrame
+    for i, df in enumerate(frames):
+        if id(df) not in extracted:
+            extracted[id(df)] = _field_arrays(df)
+        values, lat[i], first = extracted[id(df)]
+        arrays[:, i, :len(values)] = values.T
+        day_of_year[i] = first.dayofyear
+        month = first.month if lat[i] >= 0 else (first.month + 5) % 12 + 1
+        season[i] = (month % 12) // 3
+        for j, crop in enumerate(crops_list[i]):
+            entry = coefficients.get(crop.lower())
+            if entry:
+                kc[i, j] = entry["kc"][season[i]]
+                thresholds[i, j] = entry["threshold_mm"]
+
+    result = decide_arrays(*arrays, lat, day_of_year, kc, thresholds)
+    decisions = []
+    for i, crops in enumerate(crops_list):
+        decisions.append({
+            "crops": crops,
+            "water": [c for j, c in enumerate(crops) if result["water"][i, j]],
+            "skip": [c for j, c in enumerate(crops) if not result["water"][i, j]],
+            "needs_mm": {c: round(float(result["need"][i, j]), 2) for j, c in enumerate(crops)
+                         if not np.isnan(result["need"][i, j])},
+            "et0_mm": round(float(result["et0"][i]), 2),
+            "rain_prob": round(float(result["rain_prob"][i]) * 100),
+            "season": SEASONS[season[i]],
+            "confidence": round(float(result["confidence"][i]), 2),
+        })
+    return decisions
+
+
+def is_confident(decision, min_confidence=MIN_CONFIDENCE):
+    return decision["confidence"] >= min_confidence
+
+
+def _name_crops(crops):
+    names = [f"{_ARTICLES[c]} {c}" if c in _ARTICLES else c for c in crops]
+    if len(names) == 1:
+        return names[0]
+    return ", ".join(names[:-1]) + " et " + names[-1]
+
+
+def _number(value):
+    return f"{value:.1f}".replace(".", ",")
+
+
+def describe(decision):
+    """One formal French sentence stating the decision (no LLM involved)."""
+    water, skip = decision["water"], decision["skip"]
+    details = (f"évapotranspiration estimée à {_number(decision['et0_mm'])} mm, "
+               f"probabilité de pluie de {decision['rain_prob']} %")
+    if water and not skip:
+        return f"Il est recommandé d'arroser {_name_crops(water)} aujourd'hui ({details})."
+    if water:
+        verb = "nécessitent" if len(skip) > 1 or _ARTICLES.get(skip[0], "les") == "les" else "nécessite"
+        return (f"Il est recommandé d'arroser {_name_crops(water)} aujourd'hui, tandis que "
+                f"{_name_crops(skip)} ne {verb} pas d'arrosage ({details}).")
+    reason = "la pluie étant probable" if decision["rain_prob"] >= 50 else "les besoins en eau restant faibles"
+    return f"Aucun arrosage n'est nécessaire aujourd'hui pour {_name_crops(skip)}, {reason} ({details})."
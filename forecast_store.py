@@ -0,0 +1,288 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+# --- Configuration ---
+# SQLite database replacing the append-only CSV log
+FORECAST_STORE_PATH = os.getenv("FORECAST_STORE_PATH", "weather_forecast.db")
+
+# Legacy CSV log, imported once into the store the first time it is opened
+LEGACY_CSV_PATH = "weather_forecast_log.csv"
+
+# Fetches older than this are deleted (the latest fetch per location is always kept)
+RETENTION_DAYS = float(os.getenv("FORECAST_RETENTION_DAYS", "90"))
+
+# Run the retention policy after this many appends
+COMPACT_EVERY = int(os.getenv("FORECAST_COMPACT_EVERY", "200"))
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Stamp of a fetch queued by the persistence writer: microseconds keep two fetches of a
+# location in the same second apart, and the stamps still sort with TIME_FORMAT ones
+FETCHED_AT_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+# Columns written by get_weather.fetch_weather_api, in log order
+FORECAST_COLUMNS = [
+    'location_name',
+    'latitude',
+    'longitude',
+    'forecast_time',
+    'temp_c',
+    'feels_like_c',
+    'temp_min_c',
+    'temp_max_c',
+    'humidity_percent',
+    'weather_condition',
+    'wind_speed_mps',
+    'precipitation_prob_percent',
+    'cloudiness_percent',
+]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS forecasts (
+    location_key TEXT NOT NULL,
+    location_name TEXT,
+    latitude REAL,
+    longitude REAL,
+    forecast_time TEXT NOT NULL,
+    temp_c REAL,
+    feels_like_c REAL,
+    temp_min_c REAL,
+    temp_max_c REAL,
+    humidity_percent REAL,
+    weather_condition TEXT,
+    wind_speed_mps REAL,
+    precipitation_prob_percent REAL,
+    cloudiness_percent REAL,
+    fetched_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_forecasts_location_fetched ON forecasts (location_key, fetched_at);
+CREATE INDEX IF NOT EXISTS idx_forecasts_fetched ON forecasts (fetched_at);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+_INSERT = (
+    f"INSERT INTO forecasts (location_key, {', '.join(FORECAST_COLUMNS)}, fetched_at) "
+    f"VALUES ({', '.join(['?'] * (len(FORECAST_COLUMNS) + 2))})"
+)
+
+
+def location_key(lat, lon):
+    """Stable text key for a location (~1 km precision)."""
+    return f"{float(lat):.2f},{float(lon):.2f}"
+
+
+def is_store_path(filepath):
+    """True if `filepath` points to a SQLite store rather than a CSV log."""
+    return str(filepath).lower().endswith((".db", ".sqlite", ".sqlite3"))
+
+
+class ForecastStore:
+    """
+    SQLite-backed forecast log indexed on (location, fetched_at).
+
+    Appends are batched in a single transaction and "latest fetch for a
+    location" is an index lookup instead of a full scan of the history.
+    A single connection is shared between threads behind a lock.
+    """
+
+    def __init__(self, path, retention_days=RETENTION_DAYS, compact_every=COMPACT_EVERY):
+        self.path = path
+        self.retention_days = retention_days
+        self.compact_every = compact_every
+        self._lock = threading.Lock()
+        self._appends_since_compact = 0
+        # Called as listener(connection, rows) inside each append transaction (see analytics.py)
+        self.listeners = []
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # --- Writes ---
+
+    def append(self, data, fetched_at=None):
+        """
+        Appends forecast rows (list of dicts or DataFrame) stamped with `fetched_at`.
+
+        Rows that already carry a 'fetched_at' value keep it. Returns the
+        number of rows written.
+        """
+        import pandas as pd
+
+        if data is None:
+            return 0
+        df = data if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
+        if df.empty:
+            return 0
+        stamp = fetched_at or datetime.now().strftime(TIME_FORMAT)
+        rows = self._rows(df, stamp)
+        with self._lock:
+            self._conn.executemany(_INSERT, rows)
+            for listener in self.listeners:
+                try:
+                    listener(self._conn, rows)
+                except Exception as e:
+                    print(f"Warning: forecast store listener failed: {e}")
+            self._conn.commit()
+            self._appends_since_compact += 1
+            due = self.compact_every and self._appends_since_compact >= self.compact_every
+        if due:
+            self.apply_retention()
+        return len(rows)
+
+    @staticmethod
+    def _rows(df, stamp):
+        df = df.reindex(columns=FORECAST_COLUMNS + ['fetched_at'])
+        df['fetched_at'] = df['fetched_at'].fillna(stamp).astype(str)
+        df['forecast_time'] = df['forecast_time'].astype(str)
+        keys = [location_key(lat, lon) for lat, lon in zip(df['latitude'], df['longitude'])]
+        df = df.astype(object).where(df.notna(), None)
+        return [(key, *values) for key, values in zip(keys, df.itertuples(index=False, name=None))]
+
+    # --- Reads ---
+
+    def latest(self, lat=None, lon=None, hours=48, now=None):
+        """
+        Returns the most recent fetch (for the given location, or any location
+        if none is given) restricted to forecasts in the next `hours` hours, as
+        a DataFrame with the same columns as the CSV log. Returns None if empty.
+        """
+        import pandas as pd
+
+        now = now or datetime.now()
+        with self._lock:
+            if lat is not None and lon is not None:
+                key = location_key(lat, lon)
+                row = self._conn.execute(
+                    "SELECT MAX(fetched_at) FROM forecasts WHERE location_key = ?", (key,)
+                ).fetchone()
+            else:
+                row = self._conn.execute(
+                    "SELECT location_key, MAX(fetched_at) FROM forecasts"
+                ).fetchone()
+                key, row = row[0], (row[1],)
+            if row is None or row[0] is None:
+                return None
+            cursor = self._conn.execute(
+                f"SELECT {', '.join(FORECAST_COLUMNS)}, fetched_at FROM forecasts "
+                "WHERE location_key = ? AND fetched_at = ? AND forecast_time > ? AND forecast_time <= ? "
+                "ORDER BY forecast_time",
+                (
+                    key,
+                    row[0],
+                    now.strftime(TIME_FORMAT),
+                    (now + timedelta(hours=hours)).strftime(TIME_FORMAT),
+                ),
+            )
+            records = cursor.fetchall()
+        if not records:
+            return None
+        df = pd.DataFrame.from_records(records, columns=FORECAST_COLUMNS + ['fetched_at'])
+        df['fetched_at'] = pd.to_datetime(df['fetched_at'], format='ISO8601')
+        df['forecast_time'] = pd.to_datetime(df['forecast_time'])
+        return df
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM forecasts").fetchone()[0]
+
+    # --- Migration and retention ---
+
+    def migrate_csv(self, csv_path, chunksize=50000):
+        """
+        One-shot import of a legacy CSV log. Recorded in the meta table so
+        running it again for the same file is a no-op. Returns rows imported.
+        """
+        marker = f"migrated:{os.path.abspath(csv_path)}"
+        with self._lock:
+            done = self._conn.execute("SELECT value FROM meta WHERE key = ?", (marker,)).fetchone()
+        if done or not os.path.isfile(csv_path):
+            return 0
+        import pandas as pd
+
+        imported = 0
+        try:
+            for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+                rows = self._rows(chunk, datetime.now().strftime(TIME_FORMAT))
+                with self._lock:
+                    self._conn.executemany(_INSERT, rows)
+                imported += len(rows)
+        except pd.errors.EmptyDataError:
+            pass
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                (marker, datetime.now().strftime(TIME_FORMAT)),
+            )
+            self._conn.commit()
+        print(f"Migrated {imported} rows from {csv_path} to {self.path}")
+        return imported
+
+    def apply_retention(self, retention_days=None):
+        """
+        Deletes fetches older than the retention window, always keeping the
+        latest fetch of each location. Returns the number of rows deleted.
+        """
+        days = self.retention_days if retention_days is None else retention_days
+        cutoff = (datetime.now() - timedelta(days=days)).strftime(TIME_FORMAT)
+        with self._lock:
+            deleted = self._conn.execute(
+                "DELETE FROM forecasts WHERE fetched_at < ? AND fetched_at < "
+                "(SELECT MAX(f2.fetched_at) FROM forecasts f2 WHERE f2.location_key = forecasts.location_key)",
+                (cutoff,),
+            ).rowcount
+            self._conn.commit()
+            self._appends_since_compact = 0
+        return deleted
+
+    def compact(self):
+        """Applies retention then rebuilds the database file to reclaim space."""
+        deleted = self.apply_retention()
+        with self._lock:
+            self._conn.execute("VACUUM")
+            self._conn.execute("PRAGMA optimize")
+        return deleted
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def open_store(path=FORECAST_STORE_PATH):
+    """
+    Returns the shared ForecastStore for `path`, creating it on first use and
+    importing the legacy CSV log into it once.
+    """
+    key = os.path.abspath(path)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = ForecastStore(path)
+            store.migrate_csv(LEGACY_CSV_PATH)
+            _stores[key] = store
+        return store
+
+
+# --- Main Execution ---
+# python forecast_store.py migrate [csv_path]   -> import a CSV log into the store
+# python forecast_store.py compact              -> apply retention and VACUUM
+if __name__ == "__main__":
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "compact"
+    store = ForecastStore(FORECAST_STORE_PATH)
+    if command == "migrate":
+        store.migrate_csv(sys.argv[2] if len(sys.argv) > 2 else LEGACY_CSV_PATH)
+    elif command == "compact":
+        print(f"Deleted {store.compact()} expired rows from {FORECAST_STORE_PATH}")
+    else:
+        print(f"Unknown command: {command} (expected 'migrate' or 'compact')")
+    print(f"{store.count()} rows in {FORECAST_STORE_PATH}")
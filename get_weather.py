@@ -1,13 +1,33 @@
 import requests
-import pandas as pd
+import numpy as np
+import json
 import os
+import time
+import threading
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+
+import forecast_store
+import metrics
+import replay
+from resilience import TokenBucket, CircuitBreaker, backoff_delay
+
+try:
+    # Faster JSON decoder when installed (pip install orjson)
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
 
 # --- Configuration ---
 # IMPORTANT: The API key must be provided via the environment variable
 # OPENWEATHERMAP_API_KEY to avoid committing secrets to the repository.
 API_KEY = os.getenv("OPENWEATHERMAP_API_KEY")
 
+# Replaying recorded responses (UPSTREAM_MODE=replay, see replay.py) needs no key
+if not API_KEY and replay.MODE == "replay":
+    API_KEY = "replay"
+
 if not API_KEY:
     print("Error: OPENWEATHERMAP_API_KEY environment variable not set.")
     print("Please set it before running this script. Example (PowerShell):")
@@ -25,12 +45,191 @@ LONGITUDE = 10.1815 # Exemple: Tunis
 # ==========================================
 
 # OpenWeatherMap 5-day/3-hour Forecast API endpoint
-API_URL = "https://api.openweathermap.org/data/2.5/forecast"
+# (overridable so the backend can be pointed at a local stub server)
+API_URL = os.getenv("OPENWEATHERMAP_API_URL", "https://api.openweathermap.org/data/2.5/forecast")
 
 # The name of the CSV file where data will be saved
 CSV_FILE_PATH = "weather_forecast_log.csv"
 
-def fetch_weather_api(lat, lon, api_key):
+# The indexed SQLite store that replaces the CSV log (see forecast_store.py)
+FORECAST_STORE_PATH = forecast_store.FORECAST_STORE_PATH
+
+# Maximum time (seconds) to wait for the OpenWeatherMap API before giving up
+REQUEST_TIMEOUT = float(os.getenv("WEATHER_TIMEOUT", "10"))
+
+# Maximum time (seconds) to establish the TCP/TLS connection
+CONNECT_TIMEOUT = float(os.getenv("WEATHER_CONNECT_TIMEOUT", "3.05"))
+
+# Retries on 429/5xx and network errors, with exponential backoff + jitter
+MAX_RETRIES = int(os.getenv("WEATHER_MAX_RETRIES", "3"))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Calls allowed per minute by our OpenWeatherMap plan (free plan: 60)
+rate_limiter = TokenBucket.per_minute(int(os.getenv("OPENWEATHERMAP_CALLS_PER_MINUTE", "60")))
+
+# Stops calling the API for a while after repeated failures (callers fall back to cached data)
+circuit_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv("WEATHER_BREAKER_THRESHOLD", "5")),
+    reset_timeout=float(os.getenv("WEATHER_BREAKER_RESET", "30")),
+)
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """
+    Returns the shared keep-alive HTTP session (created on first use), so
+    repeated calls reuse pooled connections instead of a new TLS handshake.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            pool_size = int(os.getenv("WEATHER_POOL_SIZE", "10"))
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+def _retry_after(response):
+    """Seconds requested by a Retry-After header, or None."""
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+def request_forecast(params, timeout=REQUEST_TIMEOUT):
+    """
+    GETs the forecast endpoint through the shared session, the rate limiter
+    and the circuit breaker, retrying 429/5xx and network errors until
+    `timeout` seconds have elapsed in total.
+
+    Returns:
+        requests.Response: The final response (may still be an error status).
+
+    Raises:
+        requests.exceptions.RequestException: On network failure, if the
+        circuit is open or if the rate limit cannot be met in time.
+    """
+    if replay.MODE == "replay":
+        return _replayed_response(params)
+
+    if not circuit_breaker.allow():
+        raise requests.exceptions.ConnectionError("circuit open: OpenWeatherMap temporarily disabled")
+
+    deadline = time.monotonic() + timeout
+    attempt = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        if not rate_limiter.acquire(timeout=remaining):
+            circuit_breaker.release()
+            raise requests.exceptions.ConnectionError("rate limit: no OpenWeatherMap call available in time")
+        remaining = max(0.1, deadline - time.monotonic())
+        delay = None
+        try:
+            response = get_session().get(
+                API_URL, params=params, timeout=(min(CONNECT_TIMEOUT, remaining), remaining)
+            )
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt >= MAX_RETRIES:
+                circuit_breaker.record_failure()
+                raise
+            delay = backoff_delay(attempt)
+        except requests.exceptions.RequestException:
+            # Not retried (broken body, redirect loop, bad URL...) but still a failed call
+            circuit_breaker.record_failure()
+            raise
+        except BaseException:
+            # Ended without an outcome: give back a half-open trial
+            circuit_breaker.release()
+            raise
+        else:
+            if response.status_code not in RETRY_STATUSES:
+                circuit_breaker.record_success()
+                if replay.MODE == "record" and response.status_code == 200:
+                    replay.get_corpus().record_weather(params['lat'], params['lon'], response.content)
+                return response
+            if attempt >= MAX_RETRIES:
+                circuit_breaker.record_failure()
+                return response
+            delay = _retry_after(response) or backoff_delay(attempt)
+
+        if time.monotonic() + delay >= deadline:
+            circuit_breaker.record_failure()
+            raise requests.exceptions.Timeout(f"OpenWeatherMap still failing after {attempt + 1} attempts")
+        print(f"Warning: OpenWeatherMap call failed, retrying in {delay:.1f}s (attempt {attempt + 1}/{MAX_RETRIES})")
+        time.sleep(delay)
+        attempt += 1
+
+def _replayed_response(params):
+    """Recorded forecast response for the requested location (no rate limit or circuit breaker)."""
+    try:
+        content = replay.replay_weather(params['lat'], params['lon'])
+    except LookupError as e:
+        raise requests.exceptions.ConnectionError(f"replay: {e}")
+    response = requests.Response()
+    response.status_code = 200
+    response.url = API_URL
+    response._content = content
+    return response
+
+def _error_reason(error):
+    """Short label for a failed request, used by the upstream error counter."""
+    message = str(error)
+    if message.startswith("circuit open"):
+        return "circuit_open"
+    if message.startswith("rate limit"):
+        return "rate_limited"
+    if isinstance(error, requests.exceptions.Timeout):
+        return "timeout"
+    return "connection"
+
+def parse_forecast(api_data, lat, lon):
+    """
+    Turns a decoded OpenWeatherMap forecast response into a DataFrame with
+    the forecast log columns, built once directly from typed columns.
+
+    `forecast_time` is parsed to datetime64. The result is shared by saving,
+    prompt formatting and the decision engine, so treat it as read-only.
+    Returns None if the response holds no entries; raises KeyError/TypeError
+    if an entry is malformed.
+    """
+    import pandas as pd
+
+    entries = api_data['list']
+    if not entries:
+        return None
+    # 'city' info is useful for logging, so we'll grab it
+    city_name = (api_data.get('city') or {}).get('name', 'Unknown')
+    count = len(entries)
+    mains = [entry['main'] for entry in entries]
+
+    def floats(values):
+        return np.fromiter(values, dtype=np.float64, count=count)
+
+    def ints(values):
+        return np.fromiter(values, dtype=np.int64, count=count)
+
+    return pd.DataFrame({
+        'location_name': np.full(count, city_name, dtype=object),
+        'latitude': np.full(count, float(lat)),
+        'longitude': np.full(count, float(lon)),
+        # "YYYY-MM-DD HH:MM:SS" is parsed natively by NumPy, much faster than pd.to_datetime
+        'forecast_time': np.array([entry['dt_txt'] for entry in entries], dtype='datetime64[s]'),
+        'temp_c': floats(m['temp'] for m in mains),
+        'feels_like_c': floats(m['feels_like'] for m in mains),
+        'temp_min_c': floats(m['temp_min'] for m in mains),
+        'temp_max_c': floats(m['temp_max'] for m in mains),
+        'humidity_percent': ints(m['humidity'] for m in mains),
+        'weather_condition': [entry['weather'][0]['description'] for entry in entries],
+        'wind_speed_mps': floats(entry['wind']['speed'] for entry in entries),
+        # 'pop' is probability of precipitation (from 0.0 to 1.0)
+        'precipitation_prob_percent': floats(entry.get('pop', 0) for entry in entries) * 100,
+        'cloudiness_percent': ints(entry['clouds']['all'] for entry in entries),
+    }, copy=False)
+
+def fetch_weather_api(lat, lon, api_key, timeout=REQUEST_TIMEOUT):
     """
     Fetches 5-day/3-hour forecast data from OpenWeatherMap for a given location.
     
@@ -38,9 +237,10 @@ def fetch_weather_api(lat, lon, api_key):
         lat (float): Latitude of the location.
         lon (float): Longitude of the location.
         api_key (str): Your OpenWeatherMap API key.
+        timeout (float): Seconds to wait for the API before aborting the request.
 
     Returns:
-        list: A list of dictionaries, each representing a 3-hour forecast.
+        pd.DataFrame: One row per 3-hour forecast (see parse_forecast).
               Returns None if the API request fails or data is invalid.
     """
     print(f"Fetching weather data for (Lat: {lat}, Lon: {lon}) at {datetime.now()}...")
@@ -54,43 +254,26 @@ def fetch_weather_api(lat, lon, api_key):
     }
     
     try:
-        # Make the API request
-        response = requests.get(API_URL, params=params)
+        # Make the API request (pooled session, rate limited, retried on 429/5xx)
+        response = request_forecast(params, timeout=timeout)
         
         # This will raise an HTTPError if the response was unsuccessful (e.g., 401, 404, 500)
         response.raise_for_status()  
         
-        api_data = response.json()
+        api_data = _json_loads(response.content)
         
         # --- Process the API Data ---
-        processed_data = []
+        with metrics.pipeline_stage_seconds.time(stage="dataframe"):
+            forecast_df = parse_forecast(api_data, lat, lon)
+        if forecast_df is None:
+            print("Error: API response contains no forecast entries.")
+            return None
         
-        # 'city' info is useful for logging, so we'll grab it
-        city_name = api_data.get('city', {}).get('name', 'Unknown')
-        
-        # The 'list' key contains all the 3-hour forecast entries
-        for forecast in api_data['list']:
-            processed_data.append({
-                'location_name': city_name,
-                'latitude': lat,
-                'longitude': lon,
-                'forecast_time': forecast['dt_txt'],
-                'temp_c': forecast['main']['temp'],
-                'feels_like_c': forecast['main']['feels_like'],
-                'temp_min_c': forecast['main']['temp_min'],
-                'temp_max_c': forecast['main']['temp_max'],
-                'humidity_percent': forecast['main']['humidity'],
-                'weather_condition': forecast['weather'][0]['description'],
-                'wind_speed_mps': forecast['wind']['speed'],
-                # 'pop' is probability of precipitation (from 0.0 to 1.0)
-                'precipitation_prob_percent': forecast.get('pop', 0) * 100, 
-                'cloudiness_percent': forecast['clouds']['all'],
-            })
-        
-        print(f"Successfully fetched {len(processed_data)} forecast entries for {city_name}.")
-        return processed_data
+        print(f"Successfully fetched {len(forecast_df)} forecast entries for {forecast_df['location_name'].iat[0]}.")
+        return forecast_df
 
     except requests.exceptions.HTTPError as e:
+        metrics.upstream_errors.inc(upstream="openweathermap", reason=f"http_{e.response.status_code}")
         # Handle specific HTTP errors (like 401 Unauthorized - bad API key)
         if e.response.status_code == 401:
             print("Error: API request failed. Check your API_KEY. (401 Unauthorized)")
@@ -98,10 +281,12 @@ def fetch_weather_api(lat, lon, api_key):
             print(f"Error: HTTP request failed: {e}")
         return None
     except requests.exceptions.RequestException as e:
+        metrics.upstream_errors.inc(upstream="openweathermap", reason=_error_reason(e))
         # Handle other network-related errors (DNS failure, connection timeout, etc.)
         print(f"Error: API request failed. Check network connection. {e}")
         return None
-    except KeyError as e:
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+        metrics.upstream_errors.inc(upstream="openweathermap", reason="bad_response")
         # This error happens if the API response is not what we expect
         print(f"Error: Failed to parse API data. Key not found: {e}. Response may have changed.")
         return None
@@ -110,21 +295,33 @@ def save_to_csv(data_list, filepath):
     """
     Appends a list of forecast data to a CSV file.
     If the file doesn't exist, it creates it and adds a header.
+    If `filepath` is a SQLite store (.db/.sqlite), the rows are appended to
+    the indexed forecast store instead.
 
     Args:
-        data_list (list): The list of processed forecast dictionaries.
-        filepath (str): The path to the CSV file.
+        data_list (pd.DataFrame or list): The forecast from fetch_weather_api
+            (a list of processed forecast dictionaries is also accepted).
+        filepath (str): The path to the CSV file or forecast store.
     """
-    if not data_list:
+    import pandas as pd
+
+    if data_list is None or len(data_list) == 0:
         print("No data to save.")
         return
 
-    # Convert our list of dictionaries to a pandas DataFrame
-    df = pd.DataFrame(data_list)
+    if forecast_store.is_store_path(filepath):
+        forecast_store.open_store(filepath).append(data_list)
+        print(f"Successfully saved data to {filepath}")
+        return
+
+    # Copy (the fetched DataFrame is shared) or convert the list of dictionaries
+    df = data_list.copy() if isinstance(data_list, pd.DataFrame) else pd.DataFrame(data_list)
     
     # Add a 'fetched_at' timestamp to every row
     # This is crucial for knowing *when* this forecast was retrieved
-    df['fetched_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    # (rows stamped when they were queued for writing keep their time)
+    if 'fetched_at' not in df.columns:
+        df['fetched_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     
     # Check if the CSV file already exists
     file_exists = os.path.isfile(filepath)
@@ -146,5 +343,5 @@ if __name__ == "__main__":
     weather_data = fetch_weather_api(LATITUDE, LONGITUDE, API_KEY)
     
     # 2. Save the data (only if fetching was successful)
-    if weather_data:
-        save_to_csv(weather_data, CSV_FILE_PATH)
+    if weather_data is not None:
+        save_to_csv(weather_data, FORECAST_STORE_PATH)
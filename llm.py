@@ -0,0 +1,334 @@
+import asyncio
+import json
+import os
+import re
+
+import metrics
+import replay
+from resilience import backoff_delay
+
+# --- Configuration ---
+# "openai" (default) or "fake" for offline load tests
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai")
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+
+# Maximum time (seconds) to wait for a completion
+REQUEST_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+
+# Completions allowed in flight at once; extra callers wait their turn
+MAX_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "16"))
+
+# Retries on rate limits, 5xx and connection errors (with backoff + jitter)
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+
+# Simulated latency of the fake provider (seconds for a whole completion)
+FAKE_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "0.2"))
+
+
+class LLMProvider:
+    """
+    Interface implemented by LLM backends.
+
+    `complete` returns the whole answer, `stream` yields text deltas. Both
+    take OpenAI-style chat `messages`. `is_retryable` tells the client which
+    errors are worth another attempt.
+    """
+
+    name = "base"
+
+    async def complete(self, messages, max_tokens, temperature, response_format=None):
+        raise NotImplementedError
+
+    async def stream(self, messages, max_tokens, temperature):
+        raise NotImplementedError
+        yield  # pragma: no cover - makes this an async generator
+
+    def is_retryable(self, error):
+        return isinstance(error, asyncio.TimeoutError)
+
+    async def close(self):
+        pass
+
+
+class OpenAIProvider(LLMProvider):
+    """OpenAI chat completions through one pooled AsyncOpenAI client."""
+
+    name = "openai"
+
+    def __init__(self, api_key, model=LLM_MODEL, timeout=REQUEST_TIMEOUT):
+        import openai
+
+        self._openai = openai
+        self.model = model
+        # Retries are handled by LLMClient so they share its backoff and accounting
+        self._client = openai.AsyncOpenAI(api_key=api_key, timeout=timeout, max_retries=0)
+
+    async def complete(self, messages, max_tokens, temperature, response_format=None):
+        options = {"response_format": response_format} if response_format else {}
+        response = await self._client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            **options,
+        )
+        return response.choices[0].message.content
+
+    async def stream(self, messages, max_tokens, temperature):
+        stream = await self._client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True,
+        )
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await stream.close()
+
+    def is_retryable(self, error):
+        return super().is_retryable(error) or isinstance(error, (
+            self._openai.APIConnectionError,
+            self._openai.RateLimitError,
+            self._openai.InternalServerError,
+        ))
+
+    async def close(self):
+        await self._client.close()
+
+
+class FakeProvider(LLMProvider):
+    """
+    Offline provider returning canned French advice after a configurable
+    delay, so the whole pipeline can be load-tested without an API key.
+    """
+
+    name = "fake"
+    ANSWER = (
+        "Il est recommandé d'arroser les tomates et la menthe en fin de journée, "
+        "tandis que les oignons ne nécessitent pas d'arrosage aujourd'hui."
+    )
+
+    def __init__(self, latency=FAKE_LATENCY):
+        self.latency = latency
+
+    async def complete(self, messages, max_tokens, temperature, response_format=None):
+        await asyncio.sleep(self.latency)
+        if response_format and response_format.get("type") == "json_object":
+            ids = re.findall(r"^### id: (\S+)", messages[-1]["content"], flags=re.MULTILINE)
+            return json.dumps({"recommendations": [{"id": i, "recommendation": self.ANSWER} for i in ids]})
+        return self.ANSWER
+
+    async def stream(self, messages, max_tokens, temperature):
+        words = self.ANSWER.split(" ")
+        for i, word in enumerate(words):
+            await asyncio.sleep(self.latency / len(words))
+            yield word if i == 0 else " " + word
+
+
+class ReplayProvider(LLMProvider):
+    """
+    Serves answers recorded in the replay corpus (UPSTREAM_MODE=replay, see
+    replay.py) after REPLAY_LLM_LATENCY, streamed word by word like a real
+    completion.
+    """
+
+    name = "replay"
+
+    def __init__(self, corpus, latency=replay.LLM_LATENCY):
+        self.corpus = corpus
+        self.latency = latency
+
+    async def complete(self, messages, max_tokens, temperature, response_format=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.corpus.completion(messages, response_format)
+
+    async def stream(self, messages, max_tokens, temperature):
+        words = self.corpus.completion(messages).split(" ")
+        for i, word in enumerate(words):
+            if self.latency:
+                await asyncio.sleep(self.latency / len(words))
+            yield word if i == 0 else " " + word
+
+
+class RecordingProvider(LLMProvider):
+    """Wraps a provider and appends each complete answer to the replay corpus (UPSTREAM_MODE=record)."""
+
+    def __init__(self, provider, corpus):
+        self.provider = provider
+        self.corpus = corpus
+        self.name = provider.name
+
+    async def complete(self, messages, max_tokens, temperature, response_format=None):
+        text = await self.provider.complete(messages, max_tokens, temperature, response_format)
+        if text:
+            await asyncio.to_thread(self.corpus.record_completion, messages, response_format, text)
+        return text
+
+    async def stream(self, messages, max_tokens, temperature):
+        parts = []
+        stream = self.provider.stream(messages, max_tokens, temperature)
+        try:
+            async for delta in stream:
+                parts.append(delta)
+                yield delta
+        finally:
+            await stream.aclose()
+        if parts:
+            await asyncio.to_thread(self.corpus.record_completion, messages, None, "".join(parts))
+
+    def is_retryable(self, error):
+        return self.provider.is_retryable(error)
+
+    async def close(self):
+        await self.provider.close()
+
+
+class LLMClient:
+    """
+    Shared entry point for LLM calls: bounds concurrency, applies a per-call
+    timeout and retries transient errors with exponential backoff.
+    """
+
+    def __init__(self, provider, max_concurrency=MAX_CONCURRENCY, timeout=REQUEST_TIMEOUT,
+                 max_retries=MAX_RETRIES):
+        self.provider = provider
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.calls = 0
+        self.retries = 0
+        self.errors = 0
+
+    async def complete(self, messages, max_tokens=150, temperature=0.3, response_format=None, timeout=None):
+        """Returns the completion text. Raises the last error once retries are exhausted."""
+        timeout = timeout or self.timeout
+        attempt = 0
+        async with self._semaphore:
+            self.in_flight += 1
+            try:
+                while True:
+                    self.calls += 1
+                    try:
+                        return await asyncio.wait_for(
+                            self.provider.complete(messages, max_tokens, temperature, response_format),
+                            timeout=timeout,
+                        )
+                    except Exception as e:
+                        if attempt >= self.max_retries or not self.provider.is_retryable(e):
+                            self._record_error(e)
+                            raise
+                    self.retries += 1
+                    await asyncio.sleep(backoff_delay(attempt))
+                    attempt += 1
+            finally:
+                self.in_flight -= 1
+
+    async def stream(self, messages, max_tokens=150, temperature=0.3):
+        """
+        Yields text deltas. Transient errors are retried only until the first
+        delta has been produced; the provider's read timeout bounds each chunk.
+        """
+        attempt = 0
+        async with self._semaphore:
+            self.in_flight += 1
+            try:
+                while True:
+                    self.calls += 1
+                    started = False
+                    stream = self.provider.stream(messages, max_tokens, temperature)
+                    try:
+                        async for delta in stream:
+                            started = True
+                            yield delta
+                        return
+                    except Exception as e:
+                        if started or attempt >= self.max_retries or not self.provider.is_retryable(e):
+                            self._record_error(e)
+                            raise
+                    finally:
+                        await stream.aclose()
+                    self.retries += 1
+                    await asyncio.sleep(backoff_delay(attempt))
+                    attempt += 1
+            finally:
+                self.in_flight -= 1
+
+    def _record_error(self, error):
+        self.errors += 1
+        reason = "timeout" if isinstance(error, asyncio.TimeoutError) else type(error).__name__
+        metrics.upstream_errors.inc(upstream=f"llm_{self.provider.name}", reason=reason)
+
+    def stats(self):
+        return {
+            "provider": self.provider.name,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "retries": self.retries,
+            "errors": self.errors,
+        }
+
+    async def aclose(self):
+        await self.provider.close()
+
+
+def create_provider(name=None):
+    """Builds the provider selected by LLM_PROVIDER, or None if it cannot be configured."""
+    if replay.MODE == "replay":
+        return ReplayProvider(replay.get_corpus())
+    name = (name or LLM_PROVIDER).lower()
+    if name == "fake":
+        provider = FakeProvider()
+    else:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            return None
+        try:
+            provider = OpenAIProvider(api_key)
+        except ImportError:
+            print("Error: the 'openai' package is not installed.")
+            return None
+    if replay.MODE == "record":
+        provider = RecordingProvider(provider, replay.get_corpus())
+    return provider
+
+
+_client = None
+
+
+def get_client(create=True):
+    """Returns the shared LLMClient (created on first use), or None if no provider is configured."""
+    global _client
+    if _client is None and create:
+        provider = create_provider()
+        if provider is not None:
+            _client = LLMClient(provider)
+    return _client
+
+
+def is_configured():
+    return get_client() is not None
+
+
+async def startup():
+    """
+    Checks the configuration at application start. The client, and with it
+    the OpenAI SDK (slow to import), is only created on first use.
+    """
+    if LLM_PROVIDER.lower() != "fake" and replay.MODE != "replay" and not os.getenv("OPENAI_API_KEY"):
+        print("Warning: no LLM provider configured (OPENAI_API_KEY not set).")
+
+
+async def shutdown():
+    """Closes the shared client and its connection pool."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -1,28 +1,84 @@
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Optional, List, Dict, Any
-import pandas as pd
+from typing import TYPE_CHECKING, Optional, List, Dict, Any
 import os
 from dotenv import load_dotenv
 import json
+import time
 import asyncio
+import importlib
 import traceback
+from contextlib import asynccontextmanager
+from datetime import datetime
+from pydantic import BaseModel
 
 # Charger les variables d'environnement depuis .env
 load_dotenv()
 
 import get_weather
 import analyze_weather
-try:
-    import openai
-except Exception:
-    openai = None
+from cache import ForecastCache
+from resilience import TokenBucket
+from scheduler import ForecastScheduler
+from connections import ConnectionManager
+from state_store import VersionedState
+import backends
+import sensors
+import decision_engine
+import metrics
+import llm
+import persistence
+import analytics
+import replay
+from forecast_store import location_key
+from materialized import MaterializedRecommendations
+from admission import AdmissionController, Coalescer, Overloaded
+from profiler import RequestProfiler
+
+if TYPE_CHECKING:
+    # pandas et le SDK OpenAI sont importés au premier besoin (voir _preload)
+    import pandas as pd
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Démarre les tâches de fond (rafraîchissement des prévisions) et les arrête proprement."""
+    for loc in json.loads(os.getenv("FARM_LOCATIONS", "[]")):
+        scheduler.register(loc["lat"], loc["lon"], loc.get("name"))
+    # La parcelle par défaut (tableau de bord) a aussi sa recommandation tenue à jour
+    scheduler.register(*_resolve_location(None, None))
+    await asyncio.to_thread(_restore_materialized)
+    if replay.MODE == "replay" and not await asyncio.to_thread(replay.get_corpus().load):
+        print(f"Warning: corpus de rejeu {replay.CORPUS_PATH} vide, aucune réponse à rejouer.")
+    await llm.startup()
+    await state_backend.start(_on_state_change)
+    writer.start()
+    await asyncio.to_thread(forecast_analytics.start)
+    # Modules lourds importés en arrière-plan : le serveur répond tout de suite (/health, /state, /ws)
+    # et la première recommandation ne paie pas leur import
+    preload = asyncio.create_task(asyncio.to_thread(_preload, PRELOAD_MODULES))
+    # Agrégats des prévisions enregistrées pendant l'arrêt (tout l'historique la première fois)
+    catch_up = asyncio.create_task(asyncio.to_thread(forecast_analytics.catch_up))
+    if SCHEDULER_ENABLED and get_weather.API_KEY:
+        scheduler.start()
+    elif SCHEDULER_ENABLED:
+        print("Warning: planificateur désactivé, OPENWEATHERMAP_API_KEY non défini.")
+    yield
+    await scheduler.stop()
+    await preload
+    if not catch_up.done():
+        print("Warning: agrégats analytiques incomplets, ils seront terminés au prochain démarrage.")
+    await writer.close()
+    await manager.close()
+    await state_backend.close()
+    await llm.shutdown()
+
 
 app = FastAPI(
     title="Assistant Agricole Backend",
     description="Backend pour l'assistant agricole intelligent - Recommandations basées sur la météo",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Configuration CORS depuis .env ou valeurs par défaut
@@ -35,14 +91,105 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Profil d'une requête sur demande (PROFILER=cprofile|pyinstrument, en-tête X-Profile: 1 ou
+# échantillon PROFILE_SAMPLE) ; le middleware n'est ajouté que si le profileur est activé
+request_profiler = RequestProfiler()
+
+
+async def _profile_request(request: Request, call_next):
+    """Profile jusqu'au début de la réponse ; chemin du fichier dans l'en-tête X-Profile-Path."""
+    if not request_profiler.wants(request.headers):
+        return await call_next(request)
+    with request_profiler.profile(f"{request.method} {request.url.path}") as result:
+        response = await call_next(request)
+    if result["path"]:
+        response.headers["X-Profile-Path"] = result["path"]
+    return response
+
+
+if request_profiler.enabled:
+    app.middleware("http")(_profile_request)
+
+# Délais maximum (secondes) pour chaque étape bloquante du pipeline
+WEATHER_TIMEOUT = float(os.getenv("WEATHER_TIMEOUT", "10"))
+STORAGE_TIMEOUT = float(os.getenv("STORAGE_TIMEOUT", "10"))
+
+
+# Modules importés en arrière-plan après le démarrage (PRELOAD_MODULES="" pour tout importer au premier besoin)
+PRELOAD_MODULES = [m for m in os.getenv("PRELOAD_MODULES", "pandas,openai").split(",") if m.strip()]
+
+
+def _preload(modules):
+    for module in modules:
+        try:
+            importlib.import_module(module.strip())
+        except ImportError as e:
+            print(f"Warning: préchargement de {module} impossible: {e}")
+
+
+async def _run_blocking(func, *args, timeout: float):
+    """Exécute une fonction bloquante dans un thread pour ne pas bloquer la boucle d'événements.
+
+    Lève asyncio.TimeoutError si l'appel dépasse `timeout` secondes.
+    """
+    return await asyncio.wait_for(asyncio.to_thread(func, *args), timeout=timeout)
+
+
+# --- Contrôle d'admission des endpoints coûteux (météo + IA) ---
+# Au-delà de la limite les requêtes attendent en file ; file pleine ou délai dépassé : 503 + Retry-After
+recommendation_admission = AdmissionController(
+    "recommendation",
+    limit=int(os.getenv("ADMISSION_RECOMMENDATION_LIMIT", "8")),
+    queue_size=int(os.getenv("ADMISSION_RECOMMENDATION_QUEUE", "32")),
+)
+chat_admission = AdmissionController(
+    "chat",
+    limit=int(os.getenv("ADMISSION_CHAT_LIMIT", "16")),
+    queue_size=int(os.getenv("ADMISSION_CHAT_QUEUE", "64")),
+)
+# Requêtes /get-recommendation simultanées pour la même parcelle : un seul calcul partagé
+recommendation_requests = Coalescer()
+
+# Réponse de chat envoyée quand la file est pleine
+CHAT_BUSY_REPLY = "المساعد مشغول حالياً، الرجاء إعادة المحاولة بعد قليل."
+
+
+def _client_id(connection) -> Optional[str]:
+    """Adresse du client (requête HTTP ou WebSocket), pour la limite par client."""
+    return connection.client.host if connection.client else None
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": {
+            "message": "Serveur surchargé, requête refusée.",
+            "help": f"Réessayez dans {exc.retry_after} s"
+        }},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
 @app.get("/health")
 async def health_check():
-    """Endpoint de vérification de santé - utilisé pour confirmer que le serveur fonctionne."""
-    return {"status": "ok", "version": "1.0.0"}
+    """Endpoint de vérification de santé - utilisé pour confirmer que le serveur fonctionne.
+
+    `analytics` indique si les agrégats de l'historique sont à jour (et l'erreur du rattrapage au démarrage).
+    """
+    return {
+        "status": "ok",
+        "version": "1.0.0",
+        "analytics": {
+            "enabled": forecast_analytics.enabled,
+            "ready": forecast_analytics.ready,
+            "error": forecast_analytics.error,
+        },
+    }
 
 
 # --- Shared runtime state exposed to frontend ---
-state: Dict[str, Any] = {
+INITIAL_STATE: Dict[str, Any] = {
     "temperature": 24,
     "rain": False,
     "soil": "جيدة",
@@ -57,75 +204,200 @@ state: Dict[str, Any] = {
     "protectionAdvice": "",
 }
 
+# Copie locale de l'état partagé : les révisions viennent du backend (mémoire ou Redis),
+# les lectures restent synchrones et chaque worker diffuse à ses propres clients
+state = VersionedState(INITIAL_STATE)
+state_backend = backends.create_backend(INITIAL_STATE)
+
+# Tentatives de compare-and-set avant d'écrire sans condition de révision
+STATE_CAS_RETRIES = int(os.getenv("STATE_CAS_RETRIES", "3"))
+
 
 # --- WebSocket connection manager ---
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+manager = ConnectionManager()
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
 
-    def disconnect(self, websocket: WebSocket):
-        try:
-            self.active_connections.remove(websocket)
-        except ValueError:
-            pass
-
-    async def broadcast(self, message: Dict[str, Any]):
-        data = json.dumps(message, ensure_ascii=False)
-        to_remove = []
-        for connection in list(self.active_connections):
-            try:
-                await connection.send_text(data)
-            except Exception:
-                to_remove.append(connection)
-        for c in to_remove:
-            self.disconnect(c)
+def _safe_state_copy():
+    return state.snapshot()[1]
 
 
-manager = ConnectionManager()
+def _state_message():
+    rev, snapshot = state.snapshot()
+    return {"type": "state", "rev": rev, "state": snapshot}
 
 
-def _safe_state_copy():
-    return {k: v for k, v in state.items()}
+def _state_sync_message(since):
+    """Message amenant un client de la révision `since` à l'état courant (delta, sinon état complet)."""
+    rev, changes = state.since(since)
+    if changes is None:
+        return _state_message()
+    return {"type": "state_delta", "base": since, "rev": rev, "changes": changes}
 
 
-async def _generate_chat_response(user_text: str) -> str:
-    """Generate a chat reply. Prefer OpenAI if configured, otherwise use a simple heuristic reply."""
-    # Try to use OpenAI via analyze_weather helper functions when available
-    api_key = analyze_weather.load_api_key()
-    data_string = None
+# Dernière révision diffusée à tous les clients
+_broadcast_rev = 0
+
+
+def _state_delta_message():
+    """Delta depuis la dernière diffusion, construit au moment de l'envoi (rafales fusionnées)."""
+    global _broadcast_rev
+    base = _broadcast_rev
+    if state.rev == base:
+        return None
+    _broadcast_rev = state.rev
+    return _state_sync_message(base)
+
+
+def _pump_advice(current: Dict[str, Any], updated: Dict[str, Any]) -> Dict[str, Any]:
+    """Conseil d'arrosage recalculé quand une mesure qui l'influence change."""
+    if not {'humidity', 'realtime', 'wind', 'temperature'} & updated.keys():
+        return {}
+    if current.get('realtime'):
+        return {'pumpAdvice': 'المطر يهطل. توقف.'}
+    return {'pumpAdvice': 'اسقي إذا كانت التربة جافة.' if current.get('humidity', 0) < 40 else 'رطوبة كافية.'}
+
+
+_resync_task: Optional[asyncio.Task] = None
+
+
+async def _resync_state():
+    global _resync_task
     try:
-        df = analyze_weather.read_latest_forecast(analyze_weather.CSV_FILE_PATH)
-        if df is not None:
-            data_string = analyze_weather.format_data_for_prompt(df)
-    except Exception:
-        data_string = None
+        rev, data = await state_backend.snapshot()
+        _on_state_change(rev, data, full=True)
+    except Exception as e:
+        print(f"Warning: resynchronisation de l'état impossible: {e}")
+    finally:
+        _resync_task = None
+
+
+def _on_state_change(rev: int, changes: Dict[str, Any], full: bool = False):
+    """Reçoit les changements publiés par le backend (ce worker ou un autre) et les diffuse."""
+    global _resync_task
+    if full:
+        if rev == state.rev and changes == _safe_state_copy():
+            return
+        state.reset(rev, changes)
+    elif rev <= state.rev:
+        return
+    elif rev == state.rev + 1:
+        state.apply(rev, changes)
+    else:
+        # Révisions manquées : recharger l'état complet
+        if _resync_task is None:
+            _resync_task = asyncio.create_task(_resync_state())
+        return
+    # Coalescé : une rafale de mises à jour donne un seul delta par client
+    manager.broadcast_state(_state_delta_message)
 
-    if api_key and openai is not None:
+
+async def _apply_state_update(payload: Dict[str, Any]):
+    """
+    Applique les clés connues de `payload` (et le conseil dérivé) en une seule
+    révision, par compare-and-set sur la révision lue. Retourne (clés acceptées, révision).
+    """
+    updated = {k: v for k, v in payload.items() if k in state}
+    rev, current = state.snapshot()
+    if not updated:
+        return updated, rev
+    for attempt in range(STATE_CAS_RETRIES + 1):
         try:
-            client = openai.OpenAI(api_key=api_key)
-            prompt = (
-                f"User: {user_text}\n\nForecast data (if available):\n{data_string or 'no data'}\n\n"
-                "Réponds en arabe tunisien ou arabe simple en donnant un conseil agricole concis."
-            )
-            resp = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "Vous êtes un assistant agricole professionnel."},
-                    {"role": "user", "content": prompt},
-                ],
-                max_tokens=150,
-                temperature=0.5,
-            )
-            return resp.choices[0].message.content
+            changes = {**updated, **_pump_advice({**current, **updated}, updated)}
+        except Exception:
+            changes = updated
+        try:
+            rev, _ = await state_backend.update(changes, expected_rev=rev if attempt < STATE_CAS_RETRIES else None)
+            return updated, rev
+        except backends.StateConflict:
+            # Un autre worker a écrit entre-temps : recalculer le conseil sur l'état à jour
+            rev, current = await state_backend.snapshot()
+
+
+async def _timed_stream(stream, endpoint: str):
+    """Relaie un flux de jetons en mesurant le délai jusqu'au premier jeton (TTFT)."""
+    start = time.perf_counter()
+    first = True
+    try:
+        async for delta in stream:
+            if first:
+                metrics.llm_time_to_first_token.observe(time.perf_counter() - start, endpoint=endpoint)
+                first = False
+            yield delta
+    finally:
+        await stream.aclose()
+
+
+async def _stage_timed(stream, stage: str):
+    """Relaie un flux en mesurant pour l'étape `stage` le seul temps d'attente du flux
+    (le temps mis par le client à consommer chaque élément n'est pas compté)."""
+    waited = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = await stream.__anext__()
+            except StopAsyncIteration:
+                return
+            finally:
+                waited += time.perf_counter() - start
+            yield item
+    finally:
+        await stream.aclose()
+        metrics.pipeline_stage_seconds.observe(waited, stage=stage)
+
+
+async def _stream_chat_response(user_text: str):
+    """Stream a chat reply as text deltas. Prefer the LLM if configured, otherwise use a simple heuristic reply."""
+    # Try to use the shared LLM client (see llm.py) when a provider is configured
+    if llm.is_configured():
+        # Dernière prévision en mémoire (chargée depuis le stockage une seule fois au démarrage)
+        snapshot = analyze_weather.latest_forecast
+        try:
+            if not snapshot.loaded:
+                await _run_blocking(snapshot.load, timeout=STORAGE_TIMEOUT)
+        except Exception as e:
+            print(f"Warning: échec chargement de la dernière prévision: {e}")
+        _, data_string, fingerprint = snapshot.get()
+        cache_key = analyze_weather.recommendation_cache_key("chat", None, user_text, fingerprint=fingerprint)
+        cached = analyze_weather.recommendation_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+        prompt = (
+            f"User: {user_text}\n\nForecast data (if available):\n{data_string or 'no data'}\n\n"
+            "Réponds en arabe tunisien ou arabe simple en donnant un conseil agricole concis."
+        )
+        messages = [
+            {"role": "system", "content": "Vous êtes un assistant agricole professionnel."},
+            {"role": "user", "content": prompt},
+        ]
+        parts: List[str] = []
+        completed = False
+        try:
+            stream = analyze_weather.stream_completion(messages, max_tokens=150, temperature=0.5)
+            async for delta in _timed_stream(stream, "chat"):
+                parts.append(delta)
+                yield delta
+            completed = True
         except Exception as e:
             print("OpenAI chat error:", e)
             traceback.print_exc()
+        if completed and parts:
+            analyze_weather.recommendation_cache.set(cache_key, "".join(parts))
+        if parts:
+            # Réponse (même partielle) déjà envoyée : pas de réponse de secours par-dessus
+            return
 
     # Fallback simple rule-based reply in Arabic
+    yield _fallback_chat_reply(user_text)
+
+
+async def _generate_chat_response(user_text: str) -> str:
+    """Generate a complete chat reply (non-streaming)."""
+    return "".join([delta async for delta in _stream_chat_response(user_text)])
+
+
+def _fallback_chat_reply(user_text: str) -> str:
     text = user_text.lower()
     if "مطر" in text or "أمطار" in text or "pluie" in text:
         return "إذا كان هناك احتمال أمطار عالي، لا تحتاج للنقاس فورا. احمي النباتات فقط إذا كانت الأمطار قوية."
@@ -139,70 +411,376 @@ async def _generate_chat_response(user_text: str) -> str:
 
 
 
+async def _fetch_and_store(lat: float, lon: float):
+    """Récupère la prévision depuis l'API météo et la confie à l'écriture en arrière-plan.
+
+    Le DataFrame renvoyé est partagé (cache, sauvegarde, prompt, moteur) : il ne doit pas être modifié.
+
+    Appelé uniquement par le cache de prévisions lors d'un échec de cache (miss).
+    """
+    with metrics.pipeline_stage_seconds.time(stage="fetch"):
+        forecast_df = await _run_blocking(
+            get_weather.fetch_weather_api, lat, lon, get_weather.API_KEY, WEATHER_TIMEOUT,
+            timeout=WEATHER_TIMEOUT,
+        )
+    if forecast_df is not None:
+        analyze_weather.latest_forecast.update(forecast_df)
+        # Écriture groupée avec les autres prévisions récentes, hors du temps de réponse
+        await writer.submit_forecast(forecast_df)
+    return forecast_df
+
+
+# --- Cache des prévisions (clé = cellule de grille lat/lon) ---
+forecast_cache = ForecastCache(
+    _fetch_and_store,
+    ttl=float(os.getenv("FORECAST_CACHE_TTL", "1800")),
+    grid=float(os.getenv("FORECAST_CACHE_GRID", "0.05")),
+    maxsize=int(os.getenv("FORECAST_CACHE_SIZE", "256")),
+    stale_while_revalidate=os.getenv("FORECAST_CACHE_SWR", "0").lower() in ("1", "true", "yes"),
+)
+
+
+def _cache_counts(field: str) -> Dict[tuple, Any]:
+    """Compteur `field` de chaque cache, lu au moment de la collecte des métriques."""
+    return {
+        ("forecast",): forecast_cache.stats()[field],
+        ("recommendation",): analyze_weather.recommendation_cache.stats()[field],
+    }
+
+
+def _cache_hit_ratios() -> Dict[tuple, float]:
+    ratios = _cache_counts("hit_ratio")
+    return {key: ratio for key, ratio in ratios.items() if ratio is not None}
+
+
+def _llm_counts() -> Dict[tuple, int]:
+    client = llm.get_client(create=False)
+    if client is None:
+        return {}
+    stats = client.stats()
+    return {(outcome,): stats[outcome] for outcome in ("calls", "retries", "errors")}
+
+
+# Métriques lues à la collecte (aucun coût sur le chemin des requêtes)
+metrics.registry.register(metrics.Counter(
+    "cache_hits_total", "Cache hits per cache.", labelnames=("cache",),
+    callback=lambda: _cache_counts("hits"),
+))
+metrics.registry.register(metrics.Counter(
+    "cache_misses_total", "Cache misses per cache.", labelnames=("cache",),
+    callback=lambda: _cache_counts("misses"),
+))
+metrics.registry.register(metrics.Gauge(
+    "cache_hit_ratio", "Share of lookups served from the cache.", labelnames=("cache",),
+    callback=_cache_hit_ratios,
+))
+metrics.registry.register(metrics.Gauge(
+    "websocket_connections", "Connected WebSocket clients.",
+    callback=lambda: len(manager.clients),
+))
+metrics.registry.register(metrics.Counter(
+    "websocket_dropped_messages_total", "Messages dropped for slow WebSocket clients.",
+    callback=lambda: manager.stats()["dropped"],
+))
+metrics.registry.register(metrics.Counter(
+    "admission_shed_total", "Requests refused by admission control, per endpoint and reason.",
+    labelnames=("endpoint", "reason"),
+    callback=lambda: {
+        (admission.name, reason): count
+        for admission in (recommendation_admission, chat_admission)
+        for reason, count in admission.shed.items()
+    },
+))
+metrics.registry.register(metrics.Gauge(
+    "admission_queue_depth", "Requests waiting for an admission slot.", labelnames=("endpoint",),
+    callback=lambda: {(admission.name,): admission.stats()["waiting"]
+                      for admission in (recommendation_admission, chat_admission)},
+))
+metrics.registry.register(metrics.Counter(
+    "llm_calls_total", "LLM calls, retries and final errors.", labelnames=("outcome",),
+    callback=_llm_counts,
+))
+
+
+# --- Écritures disque en arrière-plan (prévisions et recommandations par parcelle) ---
+writer = persistence.PersistenceWriter(
+    lambda df: get_weather.save_to_csv(df, get_weather.FORECAST_STORE_PATH)
+)
+
+
+# --- Agrégats incrémentaux sur l'historique des prévisions (dérive, pluie, écart aux mesures) ---
+# Les prévisions sont récupérées et enregistrées au centre de la cellule de grille du cache
+forecast_analytics = analytics.ForecastAnalytics(get_weather.FORECAST_STORE_PATH, locate=forecast_cache.cell)
+
+# --- Recommandations matérialisées des parcelles enregistrées ---
+# Recalculées par le planificateur quand la prévision change, lues sans calcul par /get-recommendation
+def _materialized_fingerprint(forecast_df: "pd.DataFrame") -> str:
+    """Empreinte de ce qui détermine la recommandation : fenêtre de prévision, prompt et mode."""
+    window = analyze_weather.prompt_window(forecast_df)
+    return (f"{analyze_weather.PROMPT_VERSION}:{decision_engine.RECOMMENDER_MODE}:"
+            f"{analyze_weather.crops_text()}:{analyze_weather.forecast_fingerprint(window)}")
+
+
+async def _materialize(lat: float, lon: float, forecast_df: "pd.DataFrame"):
+    decision, messages, cache_key = _recommendation_inputs(forecast_df)
+    recommendation, source = await _answer(decision, messages, cache_key)
+    if not recommendation:
+        return None
+    return {"recommendation": recommendation, "source": source, "decision": decision}
+
+
+async def _publish_recommendation(entry: Dict[str, Any]):
+    """Pousse la nouvelle recommandation aux clients WebSocket et l'enregistre sur disque."""
+    manager.broadcast_nowait({
+        "type": "recommendation",
+        "location": entry["location"],
+        "lat": entry["lat"],
+        "lon": entry["lon"],
+        "recommendation": entry["recommendation"],
+        "source": entry["source"],
+        "timestamp": entry["timestamp"],
+    })
+    await writer.submit_recommendation(
+        entry["lat"], entry["lon"], entry["recommendation"],
+        source=entry["source"], decision=entry["decision"], fingerprint=entry["fingerprint"],
+    )
+
+
+materialized = MaterializedRecommendations(_materialize, _materialized_fingerprint, _publish_recommendation)
+
+
+async def _refresh_location(lat: float, lon: float):
+    """Rafraîchit la prévision d'une parcelle puis sa recommandation si la prévision a changé."""
+    forecast_df = await forecast_cache.refresh(lat, lon)
+    if forecast_df is not None and not forecast_df.empty:
+        await materialized.update(lat, lon, forecast_df)
+    return forecast_df
+
+
+def _restore_materialized():
+    """Recharge les recommandations matérialisées enregistrées avant le redémarrage."""
+    for entry in scheduler.locations():
+        materialized.load(persistence.read_recommendation(entry["lat"], entry["lon"], writer.directory))
+
+
+# --- Rafraîchissement en arrière-plan des parcelles enregistrées ---
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1").lower() in ("1", "true", "yes")
+scheduler = ForecastScheduler(
+    _refresh_location,
+    interval=float(os.getenv("SCHEDULER_INTERVAL", "1500")),
+    jitter=float(os.getenv("SCHEDULER_JITTER", "0.1")),
+    concurrency=int(os.getenv("SCHEDULER_CONCURRENCY", "4")),
+    budget=TokenBucket.per_minute(int(os.getenv("SCHEDULER_CALLS_PER_MINUTE", "30"))),
+)
+
+
+class LocationIn(BaseModel):
+    lat: float
+    lon: float
+    name: Optional[str] = None
+
+
+class BatchLocationIn(BaseModel):
+    lat: float
+    lon: float
+    crops: Optional[List[str]] = None
+    id: Optional[str] = None
+
+
+# --- Recommandations par lot ---
+BATCH_MAX_LOCATIONS = int(os.getenv("BATCH_MAX_LOCATIONS", "100"))
+# Nombre de parcelles regroupées dans une même requête IA
+BATCH_LLM_GROUP_SIZE = int(os.getenv("BATCH_LLM_GROUP_SIZE", "5"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+
+
+def _require_api_keys():
+    """Vérifie la présence de la clé météo et, en mode "llm", d'un fournisseur LLM configuré."""
+    if not get_weather.API_KEY:
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "message": "OPENWEATHERMAP_API_KEY non défini sur le serveur.",
+                "help": "Créez un fichier .env avec OPENWEATHERMAP_API_KEY=votre_cle"
+            }
+        )
+
+    if decision_engine.RECOMMENDER_MODE == "llm" and not llm.is_configured():
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "message": "OPENAI_API_KEY non défini sur le serveur.",
+                "help": "Créez un fichier .env avec OPENAI_API_KEY=votre_cle (ou LLM_PROVIDER=fake hors ligne)"
+            }
+        )
+
+
+def _resolve_location(lat: Optional[float], lon: Optional[float]):
+    """Position demandée, ou position par défaut si elle n'est pas fournie."""
+    return (get_weather.LATITUDE if lat is None else lat, get_weather.LONGITUDE if lon is None else lon)
+
+
+def _engine_decisions(frames: List["pd.DataFrame"], crops_list=None) -> List[Optional[Dict[str, Any]]]:
+    """Décisions du moteur local pour plusieurs parcelles (None en mode "llm" ou en cas d'échec)."""
+    if decision_engine.RECOMMENDER_MODE == "llm":
+        return [None] * len(frames)
+    try:
+        return decision_engine.decide(frames, crops_list)
+    except Exception as e:
+        print(f"Warning: moteur de décision indisponible: {e}")
+        return [None] * len(frames)
+
+
+def _engine_answer(decision: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Recommandation du moteur local quand l'IA n'est pas nécessaire, sinon None."""
+    if decision is None:
+        return None
+    mode = decision_engine.RECOMMENDER_MODE
+    if mode == "engine" or not llm.is_configured() or (mode == "hybrid" and decision_engine.is_confident(decision)):
+        return decision_engine.describe(decision)
+    return None
+
+
+def _llm_request(df: "pd.DataFrame", data_string: str, decision: Optional[Dict[str, Any]], crops=None):
+    """(messages, cache_key) de l'appel à l'IA : simple reformulation de la décision en mode "wording"."""
+    if decision is not None and decision_engine.RECOMMENDER_MODE == "wording":
+        text = decision_engine.describe(decision)
+        return (analyze_weather.build_wording_messages(text),
+                analyze_weather.recommendation_cache_key("wording", df, text))
+    return (analyze_weather.build_recommendation_messages(data_string, crops),
+            analyze_weather.recommendation_cache_key("recommendation", df, analyze_weather.crops_text(crops)))
+
+
+def _recommendation_inputs(forecast_df: "pd.DataFrame"):
+    """(decision, messages, cache_key) pour une prévision : décision du moteur local et requête à l'IA."""
+    stage = metrics.pipeline_stage_seconds
+    # Le moteur décide sur toute la prévision ; l'IA ne reçoit que les 48 prochaines heures
+    with stage.time(stage="prompt"):
+        window = analyze_weather.prompt_window(forecast_df)
+        data_string = analyze_weather.format_data_for_prompt(window)
+    with stage.time(stage="decision"):
+        decision = _engine_decisions([forecast_df])[0]
+    messages, cache_key = _llm_request(window, data_string, decision)
+    return decision, messages, cache_key
+
+
+async def _answer(decision: Optional[Dict[str, Any]], messages, cache_key):
+    """(recommandation, source) : moteur local s'il suffit, sinon cache puis IA.
+
+    Lève asyncio.TimeoutError si l'IA ne répond pas à temps.
+    """
+    recommendation = _engine_answer(decision)
+    source = "engine" if recommendation else "llm"
+    if recommendation is None:
+        recommendation = analyze_weather.recommendation_cache.get(cache_key)
+    if recommendation is None:
+        with metrics.pipeline_stage_seconds.time(stage="llm"):
+            recommendation = await analyze_weather.complete_async(messages)
+        if recommendation:
+            analyze_weather.recommendation_cache.set(cache_key, recommendation)
+    return recommendation, source
+
+
+async def _prepare_recommendation(lat: Optional[float], lon: Optional[float]):
+    """Étapes communes avant l'appel à l'IA : clés, prévision (cache), décision locale et prompt.
+
+    Renvoie (decision, messages, cache_key) ou lève une HTTPException.
+    """
+    # Validation des clés d'API
+    _require_api_keys()
+
+    # Position : si non fournie, utiliser les valeurs par défaut
+    lat, lon = _resolve_location(lat, lon)
+
+    # 1) Récupérer les données météo (cache, sinon API + sauvegarde)
+    try:
+        forecast_df = await forecast_cache.get(lat, lon)
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=504,
+            detail={
+                "message": "Délai dépassé lors de la récupération des données météo.",
+                "help": "Le service météo est lent ou indisponible, réessayez plus tard"
+            }
+        )
+    if forecast_df is None:
+        raise HTTPException(
+            status_code=502,
+            detail={
+                "message": "Impossible de récupérer les données météo.",
+                "help": "Vérifiez votre connexion et la validité de OPENWEATHERMAP_API_KEY"
+            }
+        )
+
+    # 2) Préparer la décision du moteur local et le prompt à partir du DataFrame de la prévision
+    try:
+        decision, messages, cache_key = _recommendation_inputs(forecast_df)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "message": f"Erreur préparation des données: {e}",
+                "help": "Problème de format des données météo"
+            }
+        )
+
+    return decision, messages, cache_key
+
+
 @app.get("/get-recommendation")
-async def get_recommendation(lat: Optional[float] = None, lon: Optional[float] = None):
+async def get_recommendation(request: Request, lat: Optional[float] = None, lon: Optional[float] = None):
     """Endpoint principal qui récupère la météo pour la position fournie,
     sauvegarde les données, puis appelle l'IA pour obtenir une recommandation.
     """
-    try:
-        # Validation des clés d'API
-        if not get_weather.API_KEY:
-            raise HTTPException(
-                status_code=500,
-                detail={
-                    "message": "OPENWEATHERMAP_API_KEY non défini sur le serveur.",
-                    "help": "Créez un fichier .env avec OPENWEATHERMAP_API_KEY=votre_cle"
-                }
-            )
+    with metrics.request_seconds.time(endpoint="get_recommendation"):
+        lat, lon = _resolve_location(lat, lon)
 
-        openai_key = analyze_weather.load_api_key()
-        if not openai_key:
-            raise HTTPException(
-                status_code=500,
-                detail={
-                    "message": "OPENAI_API_KEY non défini sur le serveur.",
-                    "help": "Créez un fichier .env avec OPENAI_API_KEY=votre_cle"
-                }
-            )
+        # 0) Parcelle enregistrée : recommandation matérialisée, tenue à jour par le planificateur
+        entry = materialized.get(lat, lon)
+        if entry is not None:
+            return JSONResponse(content={
+                "recommendation": entry["recommendation"],
+                "timestamp": entry["timestamp"],
+                "source": entry["source"],
+                "decision": entry.get("decision"),
+                "location": entry["location"],
+                "materialized": True,
+            })
 
-        # Position : si non fournie, utiliser les valeurs par défaut
-        if lat is None:
-            lat = get_weather.LATITUDE
-        if lon is None:
-            lon = get_weather.LONGITUDE
+        # Calcul partagé entre les requêtes simultanées pour la parcelle, puis admission
+        client = _client_id(request)
+        content = await recommendation_requests.run(
+            location_key(lat, lon), lambda: _admitted(recommendation_admission, client, _get_recommendation(lat, lon))
+        )
+        return JSONResponse(content=content)
 
-        # 1) Récupérer les données depuis l'API météo
-        weather_list = get_weather.fetch_weather_api(lat, lon, get_weather.API_KEY)
-        if not weather_list:
-            raise HTTPException(
-                status_code=502,
-                detail={
-                    "message": "Impossible de récupérer les données météo.",
-                    "help": "Vérifiez votre connexion et la validité de OPENWEATHERMAP_API_KEY"
-                }
-            )
 
-        # 2) Sauvegarder dans le CSV (append)
-        try:
-            get_weather.save_to_csv(weather_list, get_weather.CSV_FILE_PATH)
-        except Exception as e:
-            print(f"Warning: échec enregistrement CSV: {e}")
+async def _admitted(admission: AdmissionController, client: Optional[str], work):
+    """Exécute la coroutine `work` dans un créneau de `admission` (lève Overloaded si refusée)."""
+    try:
+        async with admission.slot(client):
+            return await work
+    finally:
+        work.close()  # jamais démarrée si la requête a été refusée
 
-        # 3) Préparer un DataFrame et formatter le prompt
+
+async def _get_recommendation(lat: float, lon: float) -> Dict[str, Any]:
+    try:
+        # 1-2) Récupérer la prévision, décider localement et préparer le prompt
+        decision, messages, cache_key = await _prepare_recommendation(lat, lon)
+
+        # 3) Réponse du moteur local si elle suffit, sinon interroger l'IA
+        #    (sauf si la même prévision a déjà été analysée)
         try:
-            df = pd.DataFrame(weather_list)
-            data_string = analyze_weather.format_data_for_prompt(df)
-        except Exception as e:
+            recommendation, source = await _answer(decision, messages, cache_key)
+        except asyncio.TimeoutError:
             raise HTTPException(
-                status_code=500,
+                status_code=504,
                 detail={
-                    "message": f"Erreur préparation des données: {e}",
-                    "help": "Problème de format des données météo"
+                    "message": "Délai dépassé lors de l'appel à l'IA.",
+                    "help": "Le service OpenAI est lent ou indisponible, réessayez plus tard"
                 }
             )
-
-        # 4) Interroger l'IA
-        recommendation = analyze_weather.get_ai_recommendation(openai_key, data_string)
         if not recommendation:
             raise HTTPException(
                 status_code=502,
@@ -212,18 +790,18 @@ async def get_recommendation(lat: Optional[float] = None, lon: Optional[float] =
                 }
             )
 
-        # 5) Sauvegarder la dernière recommandation
-        try:
-            with open("recommendation.txt", "w", encoding="utf-8") as f:
-                f.write(recommendation)
-        except Exception as e:
-            print(f"Warning: échec sauvegarde recommendation.txt: {e}")
+        # 4) Sauvegarder la dernière recommandation de la parcelle (écriture en arrière-plan)
+        await writer.submit_recommendation(lat, lon, recommendation, source=source)
 
-        # 6) Répondre au front
-        return JSONResponse(content={
+        # 5) Répondre au front
+        return {
             "recommendation": recommendation,
-            "timestamp": pd.Timestamp.now().isoformat()
-        })
+            "timestamp": datetime.now().isoformat(),
+            "source": source,
+            "decision": decision,
+            "location": location_key(lat, lon),
+            "materialized": False,
+        }
 
     except HTTPException:
         raise  # Remonter les erreurs HTTP déjà formatées
@@ -238,35 +816,517 @@ async def get_recommendation(lat: Optional[float] = None, lon: Optional[float] =
         )
 
 
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _recommendation_events(messages, cache_key, decision=None, location=None):
+    """Flux SSE : événements `delta` au fil de la génération puis `done` (ou `error`)."""
+    started = time.perf_counter()
+    recommendation = _engine_answer(decision)
+    source = "engine" if recommendation else "llm"
+    if recommendation is None:
+        recommendation = analyze_weather.recommendation_cache.get(cache_key)
+    if recommendation is None:
+        parts: List[str] = []
+        try:
+            stream = analyze_weather.stream_completion(messages, max_tokens=150, temperature=0.3)
+            async for delta in _stage_timed(_timed_stream(stream, "recommendation"), "llm"):
+                parts.append(delta)
+                yield _sse("delta", {"text": delta})
+        except Exception as e:
+            print(f"Error during OpenAI streaming call: {e}")
+            yield _sse("error", {
+                "message": "L'IA n'a pas renvoyé de recommandation.",
+                "help": "Vérifiez la validité de OPENAI_API_KEY et réessayez"
+            })
+            return
+        recommendation = "".join(parts)
+        if not recommendation:
+            yield _sse("error", {"message": "L'IA n'a pas renvoyé de recommandation."})
+            return
+        analyze_weather.recommendation_cache.set(cache_key, recommendation)
+    else:
+        yield _sse("delta", {"text": recommendation})
+
+    if location is not None:
+        await writer.submit_recommendation(*location, recommendation, source=source)
+    metrics.request_seconds.observe(time.perf_counter() - started, endpoint="stream")
+    yield _sse("done", {"recommendation": recommendation, "timestamp": datetime.now().isoformat()})
+
+
+@app.get("/get-recommendation/stream")
+async def get_recommendation_stream(request: Request, lat: Optional[float] = None, lon: Optional[float] = None):
+    """Variante Server-Sent Events de /get-recommendation : la recommandation est
+    envoyée au fil de la génération. La déconnexion du client interrompt l'appel à l'IA.
+    """
+    lat, lon = _resolve_location(lat, lon)
+    events = _admitted_events(_client_id(request), lat, lon)
+    # Le premier événement est produit ici : refus d'admission (503) et erreurs de
+    # préparation sont renvoyés avant le début du flux
+    try:
+        first = await events.__anext__()
+    except StopAsyncIteration:
+        first = None
+    return StreamingResponse(
+        _prepend(first, events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _admitted_events(client: Optional[str], lat: float, lon: float):
+    """Flux SSE d'une recommandation, créneau d'admission tenu jusqu'à la fin du flux."""
+    async with recommendation_admission.slot(client):
+        decision, messages, cache_key = await _prepare_recommendation(lat, lon)
+        events = _recommendation_events(messages, cache_key, decision, (lat, lon))
+        try:
+            async for event in events:
+                yield event
+        finally:
+            await events.aclose()
+
+
+async def _prepend(first: Optional[str], events):
+    try:
+        if first is not None:
+            yield first
+        async for event in events:
+            yield event
+    finally:
+        await events.aclose()
+
+
+def _ndjson(record: Dict[str, Any]) -> str:
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+async def _batch_llm_group(group: List[tuple]) -> List[tuple]:
+    """Interroge l'IA pour un groupe de parcelles en une requête ; les parcelles
+    absentes de la réponse sont redemandées individuellement.
+
+    `group` contient des tuples (entry_id, crops, data_string, cache_key).
+    """
+    answers = await analyze_weather.get_batch_recommendations(
+        [(entry_id, crops, data_string) for entry_id, crops, data_string, _ in group]
+    )
+    missing = [entry for entry in group if not answers.get(entry[0])]
+    if missing:
+        singles = await asyncio.gather(*(
+            analyze_weather.get_ai_recommendation_async(data_string, crops)
+            for _, crops, data_string, _ in missing
+        ), return_exceptions=True)
+        for (entry_id, _, _, _), answer in zip(missing, singles):
+            if isinstance(answer, str) and answer:
+                answers[entry_id] = answer
+    results = []
+    for entry_id, _, _, cache_key in group:
+        recommendation = answers.get(entry_id)
+        if recommendation:
+            analyze_weather.recommendation_cache.set(cache_key, recommendation)
+        results.append((entry_id, recommendation))
+    return results
+
+
+async def _batch_stream(items: List[BatchLocationIn]):
+    """Produit une ligne NDJSON par parcelle, dans l'ordre où les résultats sont prêts."""
+    def record(index, **fields):
+        item = items[index]
+        return _ndjson({
+            "index": index,
+            "id": item.id,
+            "lat": item.lat,
+            "lon": item.lon,
+            "crops": item.crops or analyze_weather.DEFAULT_CROPS,
+            **fields,
+        })
+
+    async def answer(index, recommendation, **fields):
+        """Ligne d'une parcelle recommandée, dont la recommandation est aussi sauvegardée."""
+        item = items[index]
+        await writer.submit_recommendation(
+            item.lat, item.lon, recommendation,
+            source=fields["source"], crops=item.crops or analyze_weather.DEFAULT_CROPS,
+        )
+        return record(index, recommendation=recommendation, **fields)
+
+    # 1) Une seule récupération par cellule de grille, toutes en parallèle
+    cells: Dict[tuple, List[int]] = {}
+    for index, item in enumerate(items):
+        cells.setdefault(forecast_cache.cell(item.lat, item.lon), []).append(index)
+
+    #    (les prévisions nouvellement récupérées sont regroupées par l'écriture en arrière-plan)
+    forecasts = await asyncio.gather(
+        *(forecast_cache.get(*cell) for cell in cells), return_exceptions=True
+    )
+
+    # 2) Décisions du moteur local pour toutes les parcelles en un seul calcul vectorisé
+    frames: Dict[int, "pd.DataFrame"] = {}
+    for indexes, forecast in zip(cells.values(), forecasts):
+        if isinstance(forecast, Exception) or forecast is None:
+            for index in indexes:
+                yield record(index, error={"message": "Impossible de récupérer les données météo."})
+            continue
+        for index in indexes:
+            frames[index] = forecast
+    decisions = dict(zip(frames, _engine_decisions(
+        list(frames.values()), [items[index].crops for index in frames]
+    )))
+
+    # 3) Réponses du moteur et du cache envoyées tout de suite, le reste regroupé pour l'IA
+    #    (les parcelles d'une même cellule avec les mêmes cultures partagent une réponse).
+    #    En mode "wording", la phrase du moteur est utilisée telle quelle pour les lots.
+    todo: Dict[tuple, tuple] = {}  # cache_key -> (entry_id, crops, data_string, [index, ...])
+    prompts: Dict[int, tuple] = {}  # id(df) -> (data_string, fingerprint)
+    for index, df in frames.items():
+        decision = decisions[index]
+        engine_answer = _engine_answer(decision)
+        if engine_answer is None and decision is not None and decision_engine.RECOMMENDER_MODE == "wording":
+            engine_answer = decision_engine.describe(decision)
+        if engine_answer is not None:
+            yield await answer(index, engine_answer, cached=False, source="engine", decision=decision)
+            continue
+        if id(df) not in prompts:
+            window = analyze_weather.prompt_window(df)
+            prompts[id(df)] = (analyze_weather.format_data_for_prompt(window), analyze_weather.forecast_fingerprint(window))
+        data_string, fingerprint = prompts[id(df)]
+        crops = items[index].crops
+        cache_key = analyze_weather.recommendation_cache_key(
+            "recommendation", None, analyze_weather.crops_text(crops), fingerprint=fingerprint
+        )
+        cached = analyze_weather.recommendation_cache.get(cache_key)
+        if cached is not None:
+            yield await answer(index, cached, cached=True, source="llm")
+        elif cache_key in todo:
+            todo[cache_key][3].append(index)
+        else:
+            todo[cache_key] = (str(len(todo)), crops, data_string, [index])
+
+    semaphore = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+
+    async def run_group(group):
+        async with semaphore:
+            try:
+                return await _batch_llm_group(group)
+            except Exception as e:
+                print(f"Warning: échec recommandation par lot: {e}")
+                return [(entry_id, None) for entry_id, _, _, _ in group]
+
+    entries = [(entry_id, crops, data_string, key) for key, (entry_id, crops, data_string, _) in todo.items()]
+    indexes_by_id = {entry_id: indexes for entry_id, _, _, indexes in todo.values()}
+    groups = [entries[i:i + BATCH_LLM_GROUP_SIZE] for i in range(0, len(entries), BATCH_LLM_GROUP_SIZE)]
+    tasks = [asyncio.create_task(run_group(group)) for group in groups]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            for entry_id, recommendation in await next_done:
+                for index in indexes_by_id[entry_id]:
+                    if recommendation:
+                        yield await answer(index, recommendation, cached=False, source="llm")
+                    else:
+                        yield record(index, error={"message": "L'IA n'a pas renvoyé de recommandation."})
+    finally:
+        # Client déconnecté : inutile de poursuivre les appels à l'IA
+        for task in tasks:
+            task.cancel()
+
+
+async def _admitted_batch(client: Optional[str], items: List[BatchLocationIn]):
+    """Flux NDJSON d'un lot, créneau d'admission tenu jusqu'à la fin du flux."""
+    async with recommendation_admission.slot(client):
+        lines = _batch_stream(items)
+        try:
+            async for line in lines:
+                yield line
+        finally:
+            await lines.aclose()
+
+
+@app.post("/recommendations/batch")
+async def batch_recommendations(request: Request, items: List[BatchLocationIn]):
+    """Recommandations pour plusieurs parcelles à la fois.
+
+    Les prévisions sont récupérées en parallèle (une fois par cellule de grille),
+    sauvegardées par lots en arrière-plan, et plusieurs parcelles partagent chaque
+    requête IA. Les résultats sont renvoyés en NDJSON, une ligne par parcelle,
+    au fur et à mesure qu'ils sont prêts.
+    """
+    _require_api_keys()
+    if not items:
+        raise HTTPException(
+            status_code=422,
+            detail={"message": "Liste de parcelles vide.", "help": "Envoyez au moins une parcelle"}
+        )
+    if len(items) > BATCH_MAX_LOCATIONS:
+        raise HTTPException(
+            status_code=413,
+            detail={
+                "message": f"Trop de parcelles ({len(items)}), maximum {BATCH_MAX_LOCATIONS}.",
+                "help": "Découpez la demande en plusieurs lots"
+            }
+        )
+    # Le lot entier occupe un créneau de recommandation, comme /get-recommendation ;
+    # la première ligne est produite ici pour qu'un refus (503) précède le flux
+    lines = _admitted_batch(_client_id(request), items)
+    try:
+        first = await lines.__anext__()
+    except StopAsyncIteration:
+        first = None
+    return StreamingResponse(_prepend(first, lines), media_type="application/x-ndjson")
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Métriques au format texte Prometheus."""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/recommendations/latest")
+async def latest_recommendation(lat: Optional[float] = None, lon: Optional[float] = None):
+    """Dernière recommandation sauvegardée pour une parcelle (position par défaut si non fournie)."""
+    lat, lon = _resolve_location(lat, lon)
+    stored = await asyncio.to_thread(persistence.read_recommendation, lat, lon, writer.directory)
+    if stored is None:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "message": "Aucune recommandation sauvegardée pour cette parcelle.",
+                "help": "Appelez d'abord /get-recommendation avec la même position"
+            }
+        )
+    return stored
+
+
+@app.get("/recommendations/materialized")
+async def materialized_recommendations():
+    """Recommandations matérialisées des parcelles enregistrées (poussées aussi sur /ws)."""
+    return {
+        "stats": materialized.stats(),
+        "recommendations": [
+            {key: value for key, value in entry.items() if key != "checked_at"}
+            for entry in materialized.entries()
+        ],
+    }
+
+
+@app.get("/persistence/stats")
+async def persistence_stats():
+    """File d'écriture en arrière-plan : enregistrements en attente, écritures groupées, abandons."""
+    return writer.stats()
+
+
+def _require_analytics():
+    if forecast_analytics.store is None:
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "message": "Analyses de l'historique indisponibles.",
+                "help": "Utilisez un stockage SQLite (FORECAST_STORE_PATH en .db)"
+            }
+        )
+
+
+@app.get("/analytics/locations")
+async def analytics_locations():
+    """Parcelles présentes dans l'historique des prévisions (nombre de récupérations, première et dernière)."""
+    _require_analytics()
+    locations = await asyncio.to_thread(forecast_analytics.locations)
+    return {"locations": locations, "stats": forecast_analytics.stats()}
+
+
+@app.get("/analytics/drift")
+async def analytics_drift(lat: Optional[float] = None, lon: Optional[float] = None, days: int = 30):
+    """Écart entre récupérations successives pour un même créneau, par échéance (jours) et par jour."""
+    _require_analytics()
+    lat, lon = _resolve_location(lat, lon)
+    return await asyncio.to_thread(forecast_analytics.drift, lat, lon, days)
+
+
+@app.get("/analytics/rain-trend")
+async def analytics_rain_trend(lat: Optional[float] = None, lon: Optional[float] = None, days: int = 30):
+    """Probabilité de pluie prévue par jour et sa tendance (points par jour)."""
+    _require_analytics()
+    lat, lon = _resolve_location(lat, lon)
+    return await asyncio.to_thread(forecast_analytics.rain_trend, lat, lon, days)
+
+
+@app.get("/analytics/accuracy")
+async def analytics_accuracy(lat: Optional[float] = None, lon: Optional[float] = None, days: int = 30):
+    """Prévision comparée aux mesures des capteurs (biais, erreur absolue moyenne, RMSE, score de Brier)."""
+    _require_analytics()
+    lat, lon = _resolve_location(lat, lon)
+    return await asyncio.to_thread(forecast_analytics.accuracy, lat, lon, days)
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Compteurs des caches (prévisions et recommandations IA) et état du disjoncteur météo."""
+    return {
+        "forecast": forecast_cache.stats(),
+        "recommendation": analyze_weather.recommendation_cache.stats(),
+        "weather_upstream": get_weather.circuit_breaker.stats(),
+    }
+
+
+@app.get("/admission/stats")
+async def admission_stats():
+    """Créneaux, files d'attente et requêtes refusées des endpoints coûteux."""
+    return {
+        "recommendation": recommendation_admission.stats(),
+        "chat": chat_admission.stats(),
+        "coalescing": recommendation_requests.stats(),
+    }
+
+
+@app.get("/replay/stats")
+async def replay_stats():
+    """Mode des appels amont (live, record, replay), corpus enregistré et profils de requêtes."""
+    return {"corpus": replay.get_corpus().stats(), "profiler": request_profiler.stats()}
+
+
+@app.get("/ws/stats")
+async def websocket_stats():
+    """Clients WebSocket connectés, messages en file d'attente et messages abandonnés."""
+    return {**manager.stats(), "state_rev": state.rev, "state_backend": state_backend.stats()}
+
+
+@app.get("/locations")
+async def list_locations():
+    """Parcelles enregistrées avec leur planning de rafraîchissement."""
+    return {
+        "scheduler": scheduler.stats(),
+        "materialized": materialized.stats(),
+        "locations": scheduler.schedule(),
+    }
+
+
+@app.post("/locations")
+async def register_location(location: LocationIn):
+    """Enregistre une parcelle dont la prévision sera rafraîchie en arrière-plan."""
+    if not (-90 <= location.lat <= 90 and -180 <= location.lon <= 180):
+        raise HTTPException(
+            status_code=422,
+            detail={"message": "Coordonnées invalides.", "help": "lat ∈ [-90, 90], lon ∈ [-180, 180]"}
+        )
+    entry = scheduler.register(location.lat, location.lon, location.name)
+    return {"location": entry["id"], "name": entry["name"]}
+
+
+@app.delete("/locations/{location_id}")
+async def unregister_location(location_id: str):
+    """Retire une parcelle du rafraîchissement en arrière-plan."""
+    if not scheduler.unregister(location_id):
+        raise HTTPException(
+            status_code=404,
+            detail={"message": f"Parcelle inconnue: {location_id}", "help": "Voir GET /locations"}
+        )
+    materialized.discard(location_id)
+    return {"removed": location_id}
+
+
 @app.get("/state")
-async def get_state():
-    """Return the current device/sensor state."""
-    return JSONResponse(content=_safe_state_copy())
+async def get_state(since: Optional[int] = None):
+    """
+    Return the current device/sensor state (revision in the X-State-Rev header).
+    With `since`, return only the keys changed after that revision, or the full
+    state if the revision is too old.
+    """
+    if since is None:
+        rev, snapshot = state.snapshot()
+        return JSONResponse(content=snapshot, headers={"X-State-Rev": str(rev)})
+    message = _state_sync_message(since)
+    message.pop("type")
+    return JSONResponse(content=message, headers={"X-State-Rev": str(message["rev"])})
 
 
 @app.post("/state")
 async def post_state(payload: Dict[str, Any]):
-    """Update parts of the shared state. Broadcasts to connected WebSocket clients."""
-    updated = {}
-    for k, v in payload.items():
-        if k in state:
-            state[k] = v
-            updated[k] = v
-    # Re-run lightweight analyze logic if humidity/pump/realtime changed
+    """Update parts of the shared state. Broadcasts the changed keys to connected WebSocket clients."""
     try:
-        # simple local analyze: update pumpAdvice/protectionAdvice
-        if 'humidity' in updated or 'realtime' in updated or 'wind' in updated or 'temperature' in updated:
-            # very small logic to set pumpAdvice
-            if state.get('realtime'):
-                state['pumpAdvice'] = 'المطر يهطل. توقف.'
-            else:
-                state['pumpAdvice'] = 'اسقي إذا كانت التربة جافة.' if state.get('humidity',0) < 40 else 'رطوبة كافية.'
-    except Exception:
-        pass
+        updated, rev = await _apply_state_update(payload)
+    except Exception as e:
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "message": f"Impossible d'enregistrer l'état partagé: {e}",
+                "help": "Vérifiez que le backend d'état (STATE_BACKEND, REDIS_URL) est joignable"
+            }
+        )
+    return JSONResponse(content={"updated": updated, "rev": rev})
+
+
+@app.post("/sensors/readings")
+async def ingest_sensor_readings(request: Request, sensor: Optional[str] = None):
+    """
+    Ingestion par lot des mesures des capteurs de terrain.
+
+    - `application/x-ndjson` (défaut) : une mesure par ligne, voir sensors.SensorStore.ingest_ndjson
+    - `application/octet-stream` : enregistrements binaires sensors.BINARY_RECORD du capteur `sensor`
+
+    Les dernières valeurs du lot (température, humidité, vent, pluie) mettent à jour l'état partagé.
+    """
+    body = await request.body()
+    content_type = request.headers.get("content-type", "")
+    try:
+        if content_type.startswith("application/octet-stream"):
+            if not sensor:
+                raise ValueError("le paramètre 'sensor' est requis pour le format binaire")
+            accepted, latest = sensors.store.ingest_binary(sensor, body)
+        else:
+            accepted, latest = sensors.store.ingest_ndjson(body.decode("utf-8"))
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "message": f"Lot de mesures invalide: {e}",
+                "help": "Envoyez du NDJSON ou des enregistrements binaires de 13 octets (ts f64, métrique u8, valeur f32)"
+            }
+        )
+    batch = forecast_analytics.collect_observations(sensors.store, _resolve_location(None, None))
+    if batch:
+        try:
+            await asyncio.to_thread(forecast_analytics.record_observations, batch)
+        except Exception as e:
+            print(f"Warning: mesures non comparées aux prévisions: {e}")
+    rev = None
+    changes = sensors.state_changes(latest)
+    if changes:
+        try:
+            _, rev = await _apply_state_update(changes)
+        except Exception as e:
+            print(f"Warning: mesures enregistrées mais état non mis à jour: {e}")
+    return {"accepted": accepted, "state_rev": rev}
+
 
-    # Broadcast updated state
-    asyncio.create_task(manager.broadcast({"type": "state", "state": _safe_state_copy()}))
-    return JSONResponse(content={"updated": updated})
+@app.get("/sensors")
+async def list_sensor_series():
+    """Séries de mesures disponibles (capteur, métrique, nombre de points, dernière valeur)."""
+    return {"series": sensors.store.list_series(), "stats": sensors.store.stats()}
+
+
+@app.get("/sensors/{sensor}/{metric}")
+async def query_sensor_series(sensor: str, metric: str, start: Optional[float] = None,
+                              end: Optional[float] = None, bucket: int = 60):
+    """Mesures agrégées (min/max/moyenne par intervalle de `bucket` secondes) entre `start` et `end` (epoch)."""
+    end = time.time() if end is None else end
+    start = end - 3600 if start is None else start
+    if bucket <= 0 or (end - start) / bucket > sensors.MAX_BUCKETS:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "message": "Intervalle d'agrégation invalide.",
+                "help": f"Utilisez bucket > 0 et au plus {sensors.MAX_BUCKETS} intervalles par requête"
+            }
+        )
+    buckets = sensors.store.query(sensor, metric, start, end, bucket)
+    if buckets is None:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "message": f"Aucune mesure pour {sensor}/{metric}.",
+                "help": "Consultez GET /sensors pour la liste des séries"
+            }
+        )
+    return {"sensor": sensor, "metric": metric, "bucket": bucket, "buckets": buckets}
 
 
 @app.websocket('/ws')
@@ -274,7 +1334,7 @@ async def websocket_endpoint(websocket: WebSocket):
     await manager.connect(websocket)
     # send initial state
     try:
-        await websocket.send_text(json.dumps({"type": "state", "state": _safe_state_copy()}, ensure_ascii=False))
+        manager.send_state(websocket, _state_message())
         while True:
             text = await websocket.receive_text()
             try:
@@ -285,19 +1345,40 @@ async def websocket_endpoint(websocket: WebSocket):
             # Handle incoming message types
             if data.get('type') == 'chat':
                 user_text = data.get('text', '')
-                reply = await _generate_chat_response(user_text)
-                # send reply back to sender
-                await websocket.send_text(json.dumps({"type": "chat", "text": reply}, ensure_ascii=False))
+                chat_id = data.get('id')
+                # stream the reply back to the sender: chat_delta frames then chat_done
+                parts = []
+                started = time.perf_counter()
+                try:
+                    async with chat_admission.slot(_client_id(websocket)):
+                        stream = _stream_chat_response(user_text)
+                        try:
+                            async for delta in stream:
+                                parts.append(delta)
+                                manager.send_personal(websocket, {"type": "chat_delta", "id": chat_id, "text": delta})
+                        finally:
+                            # closes the upstream LLM stream if the client went away mid-reply
+                            await stream.aclose()
+                except Overloaded as e:
+                    # too many chats in progress: tell the client when to try again
+                    manager.send_personal(websocket, {
+                        "type": "chat_done", "id": chat_id, "text": CHAT_BUSY_REPLY, "retry_after": e.retry_after,
+                    })
+                    continue
+                metrics.request_seconds.observe(time.perf_counter() - started, endpoint="chat")
+                manager.send_personal(websocket, {"type": "chat_done", "id": chat_id, "text": "".join(parts)})
             elif data.get('type') == 'set_state':
-                payload = data.get('payload', {})
-                for k, v in payload.items():
-                    if k in state:
-                        state[k] = v
-                # broadcast new state to all
-                await manager.broadcast({"type": "state", "state": _safe_state_copy()})
+                await _apply_state_update(data.get('payload', {}))
+            elif data.get('type') == 'resync':
+                # client missed revisions (gap or reconnect): send what changed since its revision
+                try:
+                    since = int(data.get('since', -1))
+                except (TypeError, ValueError):
+                    since = -1
+                manager.send_state(websocket, _state_sync_message(since))
             else:
                 # Unknown type: echo
-                await websocket.send_text(json.dumps({"type": "echo", "text": data.get('text', '')}, ensure_ascii=False))
+                manager.send_personal(websocket, {"type": "echo", "text": data.get('text', '')})
 
     except WebSocketDisconnect:
         manager.disconnect(websocket)
@@ -307,23 +1388,45 @@ async def websocket_endpoint(websocket: WebSocket):
         traceback.print_exc()
 
 
-if __name__ == "__main__":
+def cli(argv=None):
+    """Lancement : `python main.py` (production, sans rechargement) ou `python main.py --reload` (développement)."""
+    import argparse
     import uvicorn
-    
-    # Configuration depuis .env ou valeurs par défaut
-    HOST = os.getenv("HOST", "127.0.0.1")
-    PORT = int(os.getenv("PORT", "8000"))
-    
+
+    parser = argparse.ArgumentParser(description="Assistant Agricole Backend")
+    parser.add_argument("--host", default=os.getenv("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WORKERS", "1")),
+                        help="processus serveur (état partagé entre eux : STATE_BACKEND=redis)")
+    parser.add_argument("--reload", action="store_true",
+                        help="recharge le serveur à chaque modification (développement, un seul processus)")
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "info"))
+    args = parser.parse_args(argv)
+
+    if args.reload and args.workers > 1:
+        parser.error("--reload et --workers > 1 sont incompatibles")
+    if args.workers > 1 and backends.STATE_BACKEND == "memory":
+        print("Warning: état en mémoire avec plusieurs workers, chaque processus aura son propre état "
+              "(utilisez STATE_BACKEND=redis).")
+
     print(f"\n{'='*50}")
     print("Assistant Agricole Backend")
     print(f"{'='*50}")
-    print(f"Documentation API : http://{HOST}:{PORT}/docs")
-    print(f"Santé du serveur: http://{HOST}:{PORT}/health")
+    print(f"Documentation API : http://{args.host}:{args.port}/docs")
+    print(f"Santé du serveur: http://{args.host}:{args.port}/health")
+    print(f"Workers: {args.workers}{' (rechargement automatique)' if args.reload else ''}")
     print(f"{'='*50}\n")
-    
+
+    # Un seul processus : servir cette instance plutôt que de réimporter le module via "main:app"
     uvicorn.run(
-        "main:app",
-        host=HOST,
-        port=PORT,
-        reload=True
+        app if args.workers == 1 and not args.reload else "main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        reload=args.reload,
+        log_level=args.log_level,
     )
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,145 @@
+import asyncio
+import os
+import time
+from collections import Counter
+from datetime import datetime
+
+from forecast_store import location_key
+
+# --- Configuration ---
+# A materialized recommendation not confirmed by a forecast refresh for this long
+# (seconds) is no longer served; the request falls back to a live computation
+MAX_AGE = float(os.getenv("MATERIALIZED_MAX_AGE", "3600"))
+
+
+class MaterializedRecommendations:
+    """
+    Latest recommendation of each registered location, kept up to date by
+    the background forecast refreshes instead of computed when asked.
+
+    `update(lat, lon, df)` is called with every refreshed forecast and only
+    recomputes the recommendation when `fingerprint(df)` changed since the
+    stored one. `compute(lat, lon, df)` is an async callable returning the
+    recommendation fields (dict with at least "recommendation") or None;
+    each new entry is passed to `publish(entry)` (push to clients, save).
+    Reads are a dict lookup.
+    """
+
+    def __init__(self, compute, fingerprint, publish=None, max_age=MAX_AGE):
+        self._compute = compute
+        self._fingerprint = fingerprint
+        self._publish = publish
+        self.max_age = max_age
+        self._entries = {}   # location_key -> entry (dict)
+        self._inflight = {}  # location_key -> (fingerprint, asyncio.Task)
+        self._running = Counter()  # location_key -> recomputations running, discarded ones included
+        self._generations = {}  # location_key -> times discarded while recomputing (those are dropped)
+        self.hits = 0
+        self.misses = 0
+        self.recomputes = 0
+        self.unchanged = 0
+        self.errors = 0
+
+    def get(self, lat, lon):
+        """Entry of a location if it was confirmed less than max_age seconds ago, else None."""
+        entry = self._entries.get(location_key(lat, lon))
+        if entry is None or time.time() - entry["checked_at"] > self.max_age:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def entries(self):
+        return list(self._entries.values())
+
+    def load(self, record):
+        """Restores an entry saved before a restart (a record with a "fingerprint")."""
+        if not record or not record.get("fingerprint") or not record.get("recommendation"):
+            return
+        key = location_key(record["lat"], record["lon"])
+        if key in self._entries:
+            return
+        try:
+            checked_at = datetime.fromisoformat(record["timestamp"]).timestamp()
+        except (KeyError, TypeError, ValueError):
+            checked_at = 0
+        self._entries[key] = {**record, "location": key, "checked_at": checked_at}
+
+    def discard(self, key):
+        """Forgets a location; a recomputation still running for it is not stored nor published."""
+        self._entries.pop(key, None)
+        self._inflight.pop(key, None)
+        if self._running[key]:
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+    async def update(self, lat, lon, df):
+        """Recomputes a location's recommendation if its forecast changed; returns the current entry."""
+        key = location_key(lat, lon)
+        fingerprint = self._fingerprint(df)
+        entry = self._entries.get(key)
+        if entry is not None and entry["fingerprint"] == fingerprint:
+            entry["checked_at"] = time.time()
+            self.unchanged += 1
+            return entry
+        inflight = self._inflight.get(key)
+        if inflight is None or inflight[0] != fingerprint:
+            generation = self._generations.get(key, 0)
+            task = asyncio.create_task(self._recompute(key, lat, lon, df, fingerprint, generation))
+            self._running[key] += 1
+            task.add_done_callback(lambda _: self._finished(key))
+            inflight = (fingerprint, task)
+            self._inflight[key] = inflight
+        return await asyncio.shield(inflight[1])
+
+    def _finished(self, key):
+        """Counts a recomputation as done; a location's discards are forgotten once none runs."""
+        self._running[key] -= 1
+        if self._running[key] <= 0:
+            del self._running[key]
+            self._generations.pop(key, None)
+
+    async def _recompute(self, key, lat, lon, df, fingerprint, generation):
+        try:
+            fields = await self._compute(lat, lon, df)
+        except Exception as e:
+            self.errors += 1
+            print(f"Warning: materialized recommendation failed for {key}: {e}")
+            return self._entries.get(key)
+        finally:
+            if self._inflight.get(key, (None, None))[1] is asyncio.current_task():
+                self._inflight.pop(key, None)
+        if self._generations.get(key, 0) != generation:
+            # Discarded while computing: storing it would bring the location back
+            return None
+        if not fields or not fields.get("recommendation"):
+            self.errors += 1
+            return self._entries.get(key)
+        entry = {
+            "location": key,
+            "lat": float(lat),
+            "lon": float(lon),
+            **fields,
+            "fingerprint": fingerprint,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "checked_at": time.time(),
+        }
+        self._entries[key] = entry
+        self.recomputes += 1
+        if self._publish is not None:
+            try:
+                await self._publish(entry)
+            except Exception as e:
+                print(f"Warning: materialized recommendation not published for {key}: {e}")
+        return entry
+
+    def stats(self):
+        return {
+            "locations": len(self._entries),
+            "in_flight": len(self._inflight),
+            "max_age_seconds": self.max_age,
+            "hits": self.hits,
+            "misses": self.misses,
+            "recomputes": self.recomputes,
+            "unchanged": self.unchanged,
+            "errors": self.errors,
+        }
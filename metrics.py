@@ -0,0 +1,190 @@
+import bisect
+import threading
+import time
+
+# Latency buckets (seconds), from a fast cache hit to a slow LLM completion
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    body = ",".join(f'{name}="{str(value)}"' for name, value in pairs)
+    return "{" + body + "}"
+
+
+def _render_samples(name, labelnames, samples):
+    lines = []
+    for key, value in sorted(samples.items()):
+        key = key if isinstance(key, tuple) else (key,)
+        lines.append(f"{name}{_format_labels(labelnames, key)} {value}")
+    return lines
+
+
+class Counter:
+    """
+    Monotonic counter with optional labels. With `callback`, the values are
+    read at scrape time instead (a number, or {label values: number}), so
+    counters already kept elsewhere cost nothing on the hot path.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=(), callback=None):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        if self.callback is not None:
+            values = self.callback()
+            return values if isinstance(values, dict) else {(): values}
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            lines += _render_samples(self.name, self.labelnames, self._samples())
+        except Exception as e:
+            lines.append(f"# error reading {self.name}: {e}")
+        return "\n".join(lines)
+
+
+class Gauge(Counter):
+    """Value that can go up and down (`set`, `inc`, `dec`), or a scrape-time `callback`."""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Histogram:
+    """
+    Prometheus-style histogram with optional labels.
+
+    `observe()` costs one bisect and a few integer increments under a lock,
+    cheap enough to stay enabled in production.
+    """
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, **labels):
+        """Context manager observing the duration of its block."""
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ("le", bound))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, ("le", "+Inf"))
+            lines.append(f"{self.name}_bucket{labels} {values[-1]}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {values[-2]}")
+            lines.append(f"{self.name}_count{labels} {values[-1]}")
+        return "\n".join(lines)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Text exposition format served on /metrics."""
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+registry = Registry()
+
+llm_time_to_first_token = registry.register(Histogram(
+    "llm_time_to_first_token_seconds",
+    "Time from sending a streaming LLM request to receiving its first token.",
+    labelnames=("endpoint",),
+))
+
+pipeline_stage_seconds = registry.register(Histogram(
+    "pipeline_stage_seconds",
+    "Duration of each recommendation pipeline stage "
+    "(fetch, save, dataframe, prompt, decision, llm, write).",
+    labelnames=("stage",),
+))
+
+request_seconds = registry.register(Histogram(
+    "request_seconds",
+    "End-to-end duration of recommendation and chat requests.",
+    labelnames=("endpoint",),
+))
+
+upstream_errors = registry.register(Counter(
+    "upstream_errors_total",
+    "Failed calls to upstream services (after retries for the final error).",
+    labelnames=("upstream", "reason"),
+))
+
+websocket_broadcast_seconds = registry.register(Histogram(
+    "websocket_broadcast_seconds",
+    "Time to serialize a broadcast once and queue it for every WebSocket client.",
+    labelnames=("kind",),
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+))
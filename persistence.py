@@ -0,0 +1,220 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+
+import metrics
+from forecast_store import FETCHED_AT_FORMAT, location_key
+
+# --- Configuration ---
+# Directory holding the latest recommendation of each location (one JSON file per location)
+RECOMMENDATIONS_DIR = os.getenv("RECOMMENDATIONS_DIR", "recommendations")
+
+# Legacy mirror: text of the last recommendation written, whatever its location (the
+# file the analyze_weather CLI writes). Per-location reads use RECOMMENDATIONS_DIR;
+# an empty value stops writing it
+LATEST_RECOMMENDATION_PATH = os.getenv("LATEST_RECOMMENDATION_PATH", "recommendation.txt") or None
+
+# Records waiting to be written; when full, callers wait up to PERSIST_PUT_TIMEOUT seconds
+QUEUE_SIZE = int(os.getenv("PERSIST_QUEUE_SIZE", "1000"))
+PUT_TIMEOUT = float(os.getenv("PERSIST_PUT_TIMEOUT", "2"))
+
+# Pending records are grouped for up to this many seconds (or BATCH_SIZE records) per write
+FLUSH_INTERVAL = float(os.getenv("PERSIST_FLUSH_INTERVAL", "0.5"))
+BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE", "200"))
+
+
+def atomic_write(path, text):
+    """Writes `text` to a temporary file next to `path`, then renames it over `path`."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def recommendation_path(lat, lon, directory=RECOMMENDATIONS_DIR):
+    return os.path.join(directory, location_key(lat, lon).replace(",", "_") + ".json")
+
+
+def read_recommendation(lat, lon, directory=RECOMMENDATIONS_DIR):
+    """Latest stored recommendation for a location (dict), or None."""
+    try:
+        with open(recommendation_path(lat, lon, directory), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class PersistenceWriter:
+    """
+    Background writer for fetched forecasts and recommendations.
+
+    Requests only enqueue records; one task groups everything pending into a
+    bulk write every `flush_interval` seconds (or `batch_size` records):
+    one `save_forecasts(df)` call for all forecasts, and one atomic file per
+    location for recommendations (only the newest one per location is kept),
+    plus the legacy `latest_path` mirror of the last one when it is set.
+    Writes run in a thread, so disk latency never reaches the event loop.
+    When the queue is full, callers wait up to `put_timeout` seconds
+    (backpressure), then the record is dropped and counted.
+    """
+
+    def __init__(self, save_forecasts, directory=RECOMMENDATIONS_DIR, latest_path=LATEST_RECOMMENDATION_PATH,
+                 maxsize=QUEUE_SIZE, put_timeout=PUT_TIMEOUT, flush_interval=FLUSH_INTERVAL,
+                 batch_size=BATCH_SIZE):
+        self.save_forecasts = save_forecasts
+        self.directory = directory
+        self.latest_path = latest_path
+        self.maxsize = maxsize
+        self.put_timeout = put_timeout
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._queue = None
+        self._task = None
+        self.forecast_rows = 0
+        self.recommendations = 0
+        self.flushes = 0
+        self.waits = 0
+        self.dropped = 0
+        self.errors = 0
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if not self.running:
+            self._queue = asyncio.Queue(maxsize=self.maxsize)
+            self._task = asyncio.create_task(self._run())
+
+    async def _put(self, item):
+        if not self.running:
+            self.start()
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            self.waits += 1
+        try:
+            await asyncio.wait_for(self._queue.put(item), timeout=self.put_timeout)
+            return True
+        except asyncio.TimeoutError:
+            self.dropped += 1
+            print(f"Warning: persistence queue full, {item[0]} record dropped")
+            return False
+
+    async def submit_forecast(self, df):
+        """
+        Queues a fetched forecast DataFrame (read-only, shared) for the next bulk write.
+
+        Rows are stamped with `fetched_at` now (to the microsecond), not when the
+        batch is written, so two fetches of a location in one batch stay two
+        distinct fetches.
+        """
+        if "fetched_at" not in df.columns:
+            df = df.assign(fetched_at=datetime.now().strftime(FETCHED_AT_FORMAT))
+        return await self._put(("forecast", df))
+
+    async def submit_recommendation(self, lat, lon, recommendation, **fields):
+        """Queues the latest recommendation of a location; `fields` are stored alongside it."""
+        record = {
+            "lat": lat,
+            "lon": lon,
+            "recommendation": recommendation,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            **fields,
+        }
+        return await self._put(("recommendation", record))
+
+    async def _run(self):
+        # None in the queue (sent by close) means: write what is pending and stop
+        while True:
+            item = await self._queue.get()
+            stop = item is None
+            batch = [] if stop else [item]
+            deadline = time.monotonic() + self.flush_interval
+            while not stop and len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stop = True
+                else:
+                    batch.append(item)
+            if batch:
+                await self._flush(batch)
+            if stop:
+                return
+
+    async def _flush(self, batch):
+        forecasts = [item for kind, item in batch if kind == "forecast"]
+        latest = {}
+        for kind, record in batch:
+            if kind == "recommendation":
+                key = location_key(record["lat"], record["lon"])
+                latest.pop(key, None)  # keeps the newest record last
+                latest[key] = record
+        try:
+            await asyncio.to_thread(self._write, forecasts, list(latest.values()))
+        except Exception as e:
+            self.errors += 1
+            print(f"Warning: persistence write failed: {e}")
+        self.flushes += 1
+
+    def _write(self, forecasts, recommendations):
+        import pandas as pd
+
+        if forecasts:
+            with metrics.pipeline_stage_seconds.time(stage="save"):
+                df = forecasts[0] if len(forecasts) == 1 else pd.concat(forecasts, ignore_index=True)
+                self.save_forecasts(df)
+            self.forecast_rows += len(df)
+        if recommendations:
+            with metrics.pipeline_stage_seconds.time(stage="write"):
+                for record in recommendations:
+                    path = recommendation_path(record["lat"], record["lon"], self.directory)
+                    atomic_write(path, json.dumps(record, ensure_ascii=False))
+                if self.latest_path:
+                    atomic_write(self.latest_path, recommendations[-1]["recommendation"])
+            self.recommendations += len(recommendations)
+
+    async def close(self, timeout=10):
+        """Writes everything still queued, then stops the writer task."""
+        if not self.running:
+            self._task = None
+            return
+        try:
+            await asyncio.wait_for(self._queue.put(None), timeout=timeout)
+            await asyncio.wait_for(self._task, timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"Warning: persistence flush on shutdown timed out, {self._queue.qsize()} records lost")
+        self._task = None
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "maxsize": self.maxsize,
+            "flush_interval_seconds": self.flush_interval,
+            "flushes": self.flushes,
+            "forecast_rows": self.forecast_rows,
+            "recommendations": self.recommendations,
+            "backpressure_waits": self.waits,
+            "dropped": self.dropped,
+            "errors": self.errors,
+        }
@@ -0,0 +1,116 @@
+import os
+import random
+import re
+from contextlib import contextmanager
+from datetime import datetime
+
+# --- Configuration ---
+# "off" (default), "cprofile", "pyinstrument", or "auto" (pyinstrument when installed)
+PROFILER = os.getenv("PROFILER", "off").lower()
+
+# Where the per-request profiles are written
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+# Share of requests profiled; requests sent with an "X-Profile: 1" header always are
+PROFILE_SAMPLE = float(os.getenv("PROFILE_SAMPLE", "0"))
+
+ENGINES = ("off", "cprofile", "pyinstrument", "auto")
+
+if PROFILER not in ENGINES:
+    print(f"Warning: unknown PROFILER '{PROFILER}', profiling is off.")
+    PROFILER = "off"
+
+
+class RequestProfiler:
+    """
+    Per-request profiles dumped to PROFILE_DIR: a .prof file for cProfile
+    (open with `python -m pstats` or snakeviz) or an .html page for
+    pyinstrument.
+
+    Only one request is profiled at a time; others run unprofiled. Both
+    profilers see the whole event loop thread, so with cProfile the
+    concurrent requests show up in the profile as well (pyinstrument's async
+    mode attributes awaited time to the profiled request). Work sent to
+    threads (weather fetch, disk writes) only appears as the await.
+    """
+
+    def __init__(self, engine=PROFILER, directory=PROFILE_DIR, sample=PROFILE_SAMPLE):
+        if engine in ("auto", "pyinstrument"):
+            try:
+                import pyinstrument  # noqa: F401
+                engine = "pyinstrument"
+            except ImportError:
+                if engine == "pyinstrument":
+                    print("Warning: pyinstrument is not installed, profiling with cProfile.")
+                engine = "cprofile"
+        self.engine = engine
+        self.directory = directory
+        self.sample = sample
+        self._active = False
+        self.profiled = 0
+        self.skipped = 0
+
+    @property
+    def enabled(self):
+        return self.engine in ("cprofile", "pyinstrument")
+
+    def wants(self, headers):
+        """True if a request with these headers should be profiled."""
+        if not self.enabled:
+            return False
+        return headers.get("x-profile") == "1" or (self.sample > 0 and random.random() < self.sample)
+
+    @contextmanager
+    def profile(self, name):
+        """
+        Profiles the block and yields a dict whose "path" is set to the dump
+        file on exit (None if another request was already being profiled).
+        """
+        result = {"path": None}
+        if self._active:
+            self.skipped += 1
+            yield result
+            return
+        self._active = True
+        try:
+            if self.engine == "pyinstrument":
+                from pyinstrument import Profiler
+
+                profiler = Profiler(async_mode="enabled")
+                profiler.start()
+                try:
+                    yield result
+                finally:
+                    profiler.stop()
+                    result["path"] = self._path(name, "html")
+                    with open(result["path"], "w", encoding="utf-8") as f:
+                        f.write(profiler.output_html())
+            else:
+                import cProfile
+
+                profiler = cProfile.Profile()
+                profiler.enable()
+                try:
+                    yield result
+                finally:
+                    profiler.disable()
+                    result["path"] = self._path(name, "prof")
+                    profiler.dump_stats(result["path"])
+            self.profiled += 1
+        finally:
+            self._active = False
+
+    def _path(self, name, extension):
+        os.makedirs(self.directory, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", name).strip("_") or "root"
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        return os.path.join(self.directory, f"{stamp}-{self.profiled:05d}-{slug}.{extension}")
+
+    def stats(self):
+        return {
+            "engine": self.engine,
+            "directory": self.directory,
+            "sample": self.sample,
+            "profiled": self.profiled,
+            "skipped": self.skipped,
+        }
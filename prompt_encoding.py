@@ -0,0 +1,177 @@
+import math
+import os
+import re
+from collections import Counter
+from datetime import datetime, timedelta
+
+# --- Configuration ---
+# "compact" (3-hour slots, fixed-width), "daily" (one line per day), "table"
+# (previous df.to_string() layout) or "auto" (most detailed encoding under the budget)
+PROMPT_ENCODING = os.getenv("PROMPT_ENCODING", "auto").lower()
+
+# Estimated tokens allowed for the forecast part of a prompt in "auto" mode
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "250"))
+
+# Forecast horizon sent to the model
+PROMPT_HOURS = 48
+
+# Encodings tried by "auto", most detailed first
+AUTO_ORDER = ("compact", "daily")
+
+_TABLE_COLUMNS = ['forecast_time', 'temp_c', 'humidity_percent', 'weather_condition', 'precipitation_prob_percent']
+
+try:
+    # Exact counts for the OpenAI models when available (pip install tiktoken)
+    import tiktoken
+    _tokenizer = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _tokenizer = None
+
+# Heuristic tokenizer pieces: up to 3 digits, a word, a punctuation sign or a run of spaces
+_PIECES = re.compile(r"\d{1,3}|[^\W\d_]+|[^\w\s]|\s{2,}")
+
+
+def estimate_tokens(text):
+    """Token count of `text`: exact with tiktoken, otherwise a close heuristic."""
+    if not text:
+        return 0
+    if _tokenizer is not None:
+        return len(_tokenizer.encode(text))
+    return sum(1 + len(piece) // 7 if piece[0].isalpha() else 1 for piece in _PIECES.findall(text))
+
+
+def prompt_window(df, hours=PROMPT_HOURS, now=None):
+    """
+    Forecast rows in the next `hours` hours, sorted by time. Falls back to
+    the first `hours` / 3 slots when none are in the future (stale forecast).
+    """
+    import pandas as pd
+
+    if df is None or df.empty:
+        return df
+    now = now or datetime.now()
+    times = pd.to_datetime(df['forecast_time'])
+    mask = (times > now) & (times <= now + timedelta(hours=hours))
+    if mask.all() and times.is_monotonic_increasing:
+        return df
+    window = df[mask] if mask.any() else df.iloc[:hours // 3]
+    if not window['forecast_time'].is_monotonic_increasing:
+        window = window.sort_values('forecast_time')
+    return window
+
+
+def _conditions(values):
+    """Weather condition per row, blank when unchanged from the previous row."""
+    previous = None
+    out = []
+    for value in values:
+        out.append("" if value == previous else value)
+        previous = value
+    return out
+
+
+def _integer(value, width):
+    """`value` rounded and right-aligned on `width` characters, "-" when missing or not finite."""
+    if value is None or not math.isfinite(value):
+        return f"{'-':>{width}}"
+    return f"{round(value):{width}d}"
+
+
+def _finite(values):
+    return [value for value in values if value is not None and math.isfinite(value)]
+
+
+def encode_table(df):
+    """The previous layout: every column padded by df.to_string()."""
+    return df[_TABLE_COLUMNS].to_string(index=False)
+
+
+def encode_compact(df):
+    """
+    One fixed-width line per 3-hour slot with integer values; the date is
+    only written when it changes and the sky only when it changes.
+    """
+    import pandas as pd
+
+    times = pd.to_datetime(df['forecast_time'])
+    lines = ["date  h  T°C HR% pluie% ciel"]
+    last_day = None
+    for time, temp, humidity, rain, sky in zip(
+        times, df['temp_c'], df['humidity_percent'], df['precipitation_prob_percent'],
+        _conditions(df['weather_condition']),
+    ):
+        day = time.strftime("%d/%m")
+        lines.append(
+            f"{day if day != last_day else '':5} {time.hour:02d} {_integer(temp, 3)} {_integer(humidity, 3)} "
+            f"{_integer(rain, 6)} {sky}".rstrip()
+        )
+        last_day = day
+    return "\n".join(lines)
+
+
+def encode_daily(df):
+    """One line per day: min/max temperature, mean humidity, max rain probability, main sky."""
+    import pandas as pd
+
+    days = {}
+    for time, temp, humidity, rain, sky in zip(
+        pd.to_datetime(df['forecast_time']), df['temp_c'], df['humidity_percent'],
+        df['precipitation_prob_percent'], df['weather_condition'],
+    ):
+        day = days.setdefault(time.strftime("%d/%m"), ([], [], [], Counter()))
+        day[0].append(temp)
+        day[1].append(humidity)
+        day[2].append(rain)
+        day[3][sky] += 1
+    lines = ["date  Tmin Tmax HR% pluie%max ciel"]
+    for day, (temps, humidities, rains, skies) in days.items():
+        # Missing (NaN) readings are left out; a day without any shows "-"
+        temps, humidities, rains = _finite(temps), _finite(humidities), _finite(rains)
+        lines.append(
+            f"{day:5} {_integer(min(temps, default=None), 4)} {_integer(max(temps, default=None), 4)} "
+            f"{_integer(sum(humidities) / len(humidities) if humidities else None, 3)} "
+            f"{_integer(max(rains, default=None), 9)} {skies.most_common(1)[0][0]}"
+        )
+    return "\n".join(lines)
+
+
+ENCODERS = {
+    "table": encode_table,
+    "compact": encode_compact,
+    "daily": encode_daily,
+}
+
+if PROMPT_ENCODING != "auto" and PROMPT_ENCODING not in ENCODERS:
+    print(f"Warning: unknown PROMPT_ENCODING '{PROMPT_ENCODING}', using 'auto'.")
+    PROMPT_ENCODING = "auto"
+
+
+def encode(df, encoding=None, budget=None):
+    """
+    Encodes a forecast for a prompt. Returns (text, encoding, estimated tokens).
+
+    With "auto", the most detailed encoding of AUTO_ORDER whose estimate fits
+    `budget` is used (the last one if none fits).
+    """
+    encoding = encoding or PROMPT_ENCODING
+    budget = PROMPT_TOKEN_BUDGET if budget is None else budget
+    if df is None or df.empty:
+        return "", encoding, 0
+    if encoding != "auto":
+        text = ENCODERS[encoding](df)
+        return text, encoding, estimate_tokens(text)
+    for name in AUTO_ORDER:
+        text = ENCODERS[name](df)
+        tokens = estimate_tokens(text)
+        if tokens <= budget:
+            break
+    return text, name, tokens
+
+
+def compare_encodings(df):
+    """Estimated tokens and characters of every encoding, e.g. for logs or benchmarks."""
+    out = {}
+    for name, encoder in ENCODERS.items():
+        text = encoder(df)
+        out[name] = {"tokens": estimate_tokens(text), "chars": len(text)}
+    return out
@@ -0,0 +1,204 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from forecast_store import location_key
+
+# --- Configuration ---
+# "live" (default): call OpenWeatherMap and the LLM provider
+# "record": call them and append every successful response to the corpus
+# "replay": serve responses from the corpus, without network access or API keys
+MODE = os.getenv("UPSTREAM_MODE", "live").lower()
+
+# Recorded responses, one gzip-compressed JSON line per response
+CORPUS_PATH = os.getenv("REPLAY_CORPUS", "replay_corpus.jsonl.gz")
+
+# Simulated upstream latency in replay mode (seconds per forecast / per completion)
+WEATHER_LATENCY = float(os.getenv("REPLAY_WEATHER_LATENCY", "0"))
+LLM_LATENCY = float(os.getenv("REPLAY_LLM_LATENCY", "0"))
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Forecast steps are 3 hours apart: replayed forecasts are moved by whole steps
+STEP = timedelta(hours=3)
+
+
+def completion_key(messages, response_format=None):
+    """Short hash identifying an LLM request."""
+    payload = json.dumps([messages, (response_format or {}).get("type")], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class Corpus:
+    """
+    Raw upstream responses recorded to a gzip JSON lines file.
+
+    Each line is {"kind", "key", "recorded_at", "body"}: "weather" lines hold
+    the OpenWeatherMap response text keyed by location, "completion" and
+    "json_completion" lines the LLM answer keyed by completion_key(). Each
+    record is appended as its own gzip member, so a corpus can be recorded
+    over several runs.
+
+    In replay, a request without an exact match gets the nearest recorded
+    location (weather) or a recorded answer of the same kind picked from its
+    key (LLM), so any workload can be driven from a small corpus. Forecast
+    times are moved forward so the replayed forecast always starts now.
+    """
+
+    def __init__(self, path=CORPUS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._records = {}   # kind -> {key: record}
+        self._shifted = {}   # location key -> (shift in steps, response bytes)
+        self.loaded = False
+        self.recorded = 0
+        self.exact = 0
+        self.fallback = 0
+
+    def load(self):
+        """Reads the corpus file (a truncated last record is ignored)."""
+        records = {}
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    record = json.loads(line)
+                    records.setdefault(record["kind"], {})[record["key"]] = record
+        except FileNotFoundError:
+            pass
+        except (EOFError, OSError, ValueError) as e:
+            print(f"Warning: replay corpus {self.path} truncated: {e}")
+        with self._lock:
+            self._records = records
+            self._shifted = {}
+            self.loaded = True
+        return sum(len(by_key) for by_key in records.values())
+
+    def _ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    # --- Recording ---
+
+    def record(self, kind, key, body):
+        line = json.dumps({
+            "kind": kind,
+            "key": key,
+            "recorded_at": datetime.now().strftime(TIME_FORMAT),
+            "body": body,
+        }, ensure_ascii=False)
+        with self._lock:
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(line + "\n")
+            self.recorded += 1
+
+    def record_weather(self, lat, lon, content):
+        self.record("weather", location_key(lat, lon), content.decode("utf-8"))
+
+    def record_completion(self, messages, response_format, text):
+        kind = "json_completion" if (response_format or {}).get("type") == "json_object" else "completion"
+        self.record(kind, completion_key(messages, response_format), text)
+
+    # --- Replay ---
+
+    def _lookup(self, kind, key, fallback):
+        self._ensure_loaded()
+        by_key = self._records.get(kind)
+        if not by_key:
+            raise LookupError(f"no '{kind}' response in replay corpus {self.path}")
+        record = by_key.get(key)
+        with self._lock:
+            if record is not None:
+                self.exact += 1
+            else:
+                self.fallback += 1
+        return record if record is not None else fallback(by_key)
+
+    def weather(self, lat, lon):
+        """Bytes of a recorded forecast response for the location, moved to start now."""
+        def nearest(by_key):
+            def distance(item):
+                rec_lat, rec_lon = (float(v) for v in item[0].split(","))
+                return (rec_lat - float(lat)) ** 2 + (rec_lon - float(lon)) ** 2
+            return min(by_key.items(), key=distance)[1]
+
+        record = self._lookup("weather", location_key(lat, lon), nearest)
+        recorded_at = datetime.strptime(record["recorded_at"], TIME_FORMAT)
+        steps = max(0, (datetime.now() - recorded_at) // STEP)
+        with self._lock:
+            cached = self._shifted.get(record["key"])
+        if cached is None or cached[0] != steps:
+            # Shifted outside the lock: at worst two threads build the same response
+            cached = (steps, _shift_forecast(record["body"], steps * STEP))
+            with self._lock:
+                self._shifted[record["key"]] = cached
+        return cached[1]
+
+    def completion(self, messages, response_format=None):
+        """Recorded LLM answer for the request (or for a request of the same kind)."""
+        key = completion_key(messages, response_format)
+        kind = "json_completion" if (response_format or {}).get("type") == "json_object" else "completion"
+
+        def pick(by_key):
+            keys = sorted(by_key)
+            return by_key[keys[int(key, 16) % len(keys)]]
+
+        return self._lookup(kind, key, pick)["body"]
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "mode": MODE,
+            "records": {kind: len(by_key) for kind, by_key in self._records.items()},
+            "recorded": self.recorded,
+            "exact": self.exact,
+            "fallback": self.fallback,
+        }
+
+
+def _shift_forecast(text, delta):
+    """OpenWeatherMap response text with every forecast time moved by `delta`."""
+    if not delta:
+        return text.encode("utf-8")
+    data = json.loads(text)
+    for entry in data.get("list", []):
+        entry["dt_txt"] = (datetime.strptime(entry["dt_txt"], TIME_FORMAT) + delta).strftime(TIME_FORMAT)
+        if "dt" in entry:
+            entry["dt"] += int(delta.total_seconds())
+    return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
+_corpus = None
+_corpus_lock = threading.Lock()
+
+
+def get_corpus():
+    """Shared corpus of CORPUS_PATH (created on first use)."""
+    global _corpus
+    with _corpus_lock:
+        if _corpus is None:
+            _corpus = Corpus(CORPUS_PATH)
+        return _corpus
+
+
+def replay_weather(lat, lon):
+    """Blocking replay of a forecast request: the recorded response bytes after WEATHER_LATENCY."""
+    if WEATHER_LATENCY:
+        time.sleep(WEATHER_LATENCY)
+    return get_corpus().weather(lat, lon)
+
+
+# --- Main Execution ---
+# python replay.py [corpus_path]   -> summary of a recorded corpus
+if __name__ == "__main__":
+    import sys
+
+    corpus = Corpus(sys.argv[1] if len(sys.argv) > 1 else CORPUS_PATH)
+    total = corpus.load()
+    size = os.path.getsize(corpus.path) if os.path.isfile(corpus.path) else 0
+    print(f"{total} responses in {corpus.path} ({size / 1024:.1f} KiB)")
+    for kind, count in corpus.stats()["records"].items():
+        print(f"  {kind}: {count}")
@@ -0,0 +1,162 @@
+import asyncio
+import random
+import time
+from datetime import datetime
+
+import forecast_store
+
+
+class ForecastScheduler:
+    """
+    Background refresher for a set of registered farm locations.
+
+    Each location is refreshed every `interval` seconds (± `jitter` fraction,
+    so locations do not all hit the upstream at once), with at most
+    `concurrency` refreshes in flight and upstream calls paced by `budget`
+    (a resilience.TokenBucket). `refresh` is an async callable
+    `refresh(lat, lon)` that fetches and stores the forecast.
+    """
+
+    def __init__(self, refresh, interval=1500.0, jitter=0.1, concurrency=4, budget=None):
+        self._refresh = refresh
+        self.interval = interval
+        self.jitter = jitter
+        self.concurrency = concurrency
+        self.budget = budget
+        self._locations = {}  # location_id -> schedule entry (dict)
+        self._running = {}    # location_id -> asyncio.Task
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._wake = asyncio.Event()
+        self._task = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def _next_delay(self):
+        return self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    # --- Registration ---
+
+    def register(self, lat, lon, name=None):
+        """Adds a location (or returns the existing entry for it) and schedules it soon."""
+        location_id = forecast_store.location_key(lat, lon)
+        entry = self._locations.get(location_id)
+        if entry is None:
+            entry = {
+                "id": location_id,
+                "lat": float(lat),
+                "lon": float(lon),
+                "name": name,
+                # Spread the first refreshes so a batch of registrations is not one burst
+                "next_run": time.time() + random.uniform(0, self.jitter * self.interval / 10),
+                "last_run": None,
+                "last_success": None,
+                "last_error": None,
+                "runs": 0,
+                "failures": 0,
+            }
+            self._locations[location_id] = entry
+            self._wake.set()
+        elif name:
+            entry["name"] = name
+        return entry
+
+    def unregister(self, location_id):
+        task = self._running.pop(location_id, None)
+        if task is not None:
+            task.cancel()
+        return self._locations.pop(location_id, None) is not None
+
+    def locations(self):
+        return list(self._locations.values())
+
+    def schedule(self):
+        """Registered locations with their next/last run times, soonest first."""
+        def fmt(ts):
+            return datetime.fromtimestamp(ts).isoformat(timespec="seconds") if ts else None
+
+        return [
+            {
+                **entry,
+                "next_run": fmt(entry["next_run"]),
+                "last_run": fmt(entry["last_run"]),
+                "last_success": fmt(entry["last_success"]),
+                "in_flight": entry["id"] in self._running,
+            }
+            for entry in sorted(self._locations.values(), key=lambda e: e["next_run"])
+        ]
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "interval_seconds": self.interval,
+            "jitter": self.jitter,
+            "concurrency": self.concurrency,
+            "rate_per_minute": round(self.budget.rate * 60, 2) if self.budget else None,
+            "locations": len(self._locations),
+            "in_flight": len(self._running),
+        }
+
+    # --- Lifecycle ---
+
+    def start(self):
+        if not self.running:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._running.values()):
+            task.cancel()
+        if self._running:
+            await asyncio.gather(*self._running.values(), return_exceptions=True)
+        self._running.clear()
+
+    async def _run(self):
+        while True:
+            now = time.time()
+            for entry in list(self._locations.values()):
+                if entry["next_run"] <= now and entry["id"] not in self._running:
+                    task = asyncio.create_task(self._refresh_location(entry))
+                    self._running[entry["id"]] = task
+            pending = [e["next_run"] for e in self._locations.values() if e["id"] not in self._running]
+            delay = max(0.05, min(pending) - now) if pending else self.interval
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _refresh_location(self, entry):
+        try:
+            async with self._semaphore:
+                if self.budget is not None:
+                    await self.budget.acquire_async()
+                entry["last_run"] = time.time()
+                entry["runs"] += 1
+                delay = self._next_delay()
+                try:
+                    result = await self._refresh(entry["lat"], entry["lon"])
+                    if result is None:
+                        raise RuntimeError("no data returned")
+                    entry["last_success"] = time.time()
+                    entry["last_error"] = None
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    entry["failures"] += 1
+                    entry["last_error"] = str(e) or type(e).__name__
+                    print(f"Warning: scheduled refresh failed for {entry['id']}: {entry['last_error']}")
+                    # Retry sooner than a full interval, the cached forecast is getting old
+                    delay /= 4
+            entry["next_run"] = time.time() + delay
+        finally:
+            if self._running.get(entry["id"]) is asyncio.current_task():
+                self._running.pop(entry["id"], None)
+            self._wake.set()
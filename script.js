@@ -115,12 +115,25 @@ const analyze=()=>{
 
 // WebSocket Connection
 let ws = null;
+// Bot reply currently being streamed (chat_delta frames)
+let streamingReply = null;
+// Last state revision applied (-1: none yet, the server sends a full state)
+let stateRev = -1;
+// Location of the advice shown on the dashboard (as returned by /get-recommendation)
+let adviceLocation = null;
+const applyState = st => {
+    Object.keys(st).forEach(k => { if (k in s) s[k] = st[k]; });
+    Object.keys(st).forEach(updateUI);
+    analyze();
+};
 const connectWebSocket = () => {
     try {
         ws = new WebSocket('ws://localhost:8000/ws');
         ws.onopen = () => {
             $('ws-dot').style.backgroundColor = '#22c55e';
             $('ws-text').innerText = 'متصل';
+            // after a reconnect, only ask for what changed since the last revision seen
+            if (stateRev >= 0) ws.send(JSON.stringify({ type: 'resync', since: stateRev }));
         };
         ws.onclose = () => {
             $('ws-dot').style.backgroundColor = '#d1d5db';
@@ -131,12 +144,30 @@ const connectWebSocket = () => {
             const message = JSON.parse(event.data);
             if (message.type === 'chat') {
                 addChatMessage(message.text, false);
+            } else if (message.type === 'chat_delta') {
+                if (!streamingReply) streamingReply = addChatMessage('', false);
+                streamingReply.textContent += message.text;
+                $('chat-messages').scrollTop = $('chat-messages').scrollHeight;
+            } else if (message.type === 'chat_done') {
+                if (streamingReply) streamingReply.textContent = message.text;
+                else addChatMessage(message.text, false);
+                streamingReply = null;
             } else if (message.type === 'state') {
-                // Merge new state from server and update UI
-                const st = message.state || {};
-                Object.keys(st).forEach(k => { if (k in s) s[k] = st[k]; });
-                Object.keys(s).forEach(updateUI);
-                analyze();
+                // Full state from server (initial snapshot or resync)
+                stateRev = message.rev;
+                applyState(message.state || {});
+            } else if (message.type === 'state_delta') {
+                if (message.rev <= stateRev) return;
+                if (message.base > stateRev) {
+                    // missed revisions: ask the server to fill the gap
+                    ws.send(JSON.stringify({ type: 'resync', since: stateRev }));
+                    return;
+                }
+                stateRev = message.rev;
+                applyState(message.changes || {});
+            } else if (message.type === 'recommendation') {
+                // pushed by the server when the forecast of a registered location changes
+                if (message.location === adviceLocation) showRecommendation(message.recommendation);
             }
         };
     } catch (error) {
@@ -155,6 +186,13 @@ const addChatMessage = (text, isUser = false) => {
     `;
     messagesDiv.appendChild(messageDiv);
     messagesDiv.scrollTop = messagesDiv.scrollHeight;
+    return messageDiv.firstElementChild.firstElementChild;
+};
+
+const showRecommendation = (text) => {
+    if (!text || text === $('val-advice').innerText) return;
+    $('val-advice').innerText = text;
+    voiceAssistant.speak(text);
 };
 
 // Event Listeners
@@ -163,8 +201,8 @@ const updateWeather = async () => {
         const response = await fetch('/get-recommendation');
         const data = await response.json();
         if (data.recommendation) {
-            $('val-advice').innerText = data.recommendation;
-            voiceAssistant.speak(data.recommendation);
+            adviceLocation = data.location;
+            showRecommendation(data.recommendation);
         }
     } catch (error) {
         console.error('Error fetching weather:', error);
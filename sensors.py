@@ -0,0 +1,298 @@
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+# --- Configuration ---
+# Readings older than this are dropped from memory
+RETENTION_HOURS = float(os.getenv("SENSOR_RETENTION_HOURS", "72"))
+
+# Upper bound on points kept per (sensor, metric) series
+MAX_POINTS = int(os.getenv("SENSOR_MAX_POINTS", "200000"))
+
+# Largest number of buckets a single range query may return
+MAX_BUCKETS = int(os.getenv("SENSOR_MAX_BUCKETS", "5000"))
+
+# Metric codes of the binary format (index = code)
+METRIC_CODES = ("temperature", "humidity", "wind", "rainProb", "rain", "soil_moisture")
+
+# Binary record: float64 unix timestamp, uint8 metric code, float32 value (little-endian, 13 bytes)
+BINARY_RECORD = np.dtype([("ts", "<f8"), ("metric", "u1"), ("value", "<f4")])
+
+# Metrics that update the shared state (metric -> state key)
+STATE_KEYS = {
+    "temperature": "temperature",
+    "humidity": "humidity",
+    "wind": "wind",
+    "rainProb": "rainProb",
+    "rain": "realtime",
+}
+
+
+class Series:
+    """
+    Append-only time series backed by two growable NumPy arrays
+    (float64 timestamps, float32 values), kept sorted by timestamp.
+    """
+
+    def __init__(self, capacity=1024, max_points=MAX_POINTS):
+        self.max_points = max_points
+        self._ts = np.empty(capacity, dtype=np.float64)
+        self._values = np.empty(capacity, dtype=np.float32)
+        self.size = 0
+
+    @property
+    def ts(self):
+        return self._ts[:self.size]
+
+    @property
+    def values(self):
+        return self._values[:self.size]
+
+    def append(self, ts, values):
+        n = len(ts)
+        if n == 0:
+            return
+        if n > self.max_points:
+            ts, values, n = ts[-self.max_points:], values[-self.max_points:], self.max_points
+        needed = self.size + n
+        if needed > len(self._ts):
+            if needed > self.max_points:
+                # Full: drop the oldest points (at least a quarter, so this stays amortized)
+                self.drop_first(max(needed - self.max_points, self.max_points // 4))
+                needed = self.size + n
+            if needed > len(self._ts):
+                capacity = min(self.max_points, max(needed, 2 * len(self._ts)))
+                self._ts = np.resize(self._ts, capacity)
+                self._values = np.resize(self._values, capacity)
+        out_of_order = self.size and ts[0] < self._ts[self.size - 1]
+        self._ts[self.size:needed] = ts
+        self._values[self.size:needed] = values
+        self.size = needed
+        if out_of_order or (n > 1 and np.any(np.diff(ts) < 0)):
+            order = np.argsort(self._ts[:self.size], kind="stable")
+            self._ts[:self.size] = self._ts[:self.size][order]
+            self._values[:self.size] = self._values[:self.size][order]
+
+    def drop_first(self, count):
+        count = min(count, self.size)
+        if count <= 0:
+            return
+        remaining = self.size - count
+        self._ts[:remaining] = self._ts[count:self.size]
+        self._values[:remaining] = self._values[count:self.size]
+        self.size = remaining
+
+    def drop_before(self, cutoff):
+        self.drop_first(int(np.searchsorted(self.ts, cutoff, side="left")))
+
+    def last(self):
+        if self.size == 0:
+            return None
+        return float(self._ts[self.size - 1]), float(self._values[self.size - 1])
+
+    def downsample(self, start, end, bucket):
+        """min/max/avg/count per `bucket` seconds over [start, end), buckets aligned on the epoch."""
+        ts = self.ts
+        lo, hi = np.searchsorted(ts, start, side="left"), np.searchsorted(ts, end, side="left")
+        if lo >= hi:
+            return []
+        ts, values = ts[lo:hi], self.values[lo:hi].astype(np.float64)
+        origin = start - start % bucket
+        index = ((ts - origin) // bucket).astype(np.int64)
+        # Sorted timestamps: each bucket is a contiguous run, reduced in one pass
+        starts = np.flatnonzero(np.r_[True, index[1:] != index[:-1]])
+        counts = np.diff(np.r_[starts, len(index)])
+        sums = np.add.reduceat(values, starts)
+        mins = np.minimum.reduceat(values, starts)
+        maxs = np.maximum.reduceat(values, starts)
+        return [
+            {
+                "t": origin + int(b) * bucket,
+                "min": round(float(mn), 3),
+                "max": round(float(mx), 3),
+                "avg": round(float(s / c), 3),
+                "count": int(c),
+            }
+            for b, mn, mx, s, c in zip(index[starts], mins, maxs, sums, counts)
+        ]
+
+
+class SensorStore:
+    """
+    In-memory time-series store for field sensor readings, one Series per
+    (sensor, metric). Batches are grouped per series and appended with
+    vectorized copies, so ingestion cost is dominated by parsing.
+    """
+
+    def __init__(self, retention_hours=RETENTION_HOURS, max_points=MAX_POINTS, clock=time.time):
+        self.retention = retention_hours * 3600
+        self.max_points = max_points
+        self._clock = clock
+        self._series = {}  # (sensor, metric) -> Series
+        self.readings = 0
+        self.rejected = 0
+        self._last_trim = clock()
+
+    def _get(self, sensor, metric):
+        series = self._series.get((sensor, metric))
+        if series is None:
+            series = self._series[(sensor, metric)] = Series(max_points=self.max_points)
+        return series
+
+    def add(self, sensor, metric, ts, values):
+        """Appends arrays of timestamps and values to one series."""
+        ts = np.asarray(ts, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float32)
+        keep = np.isfinite(ts) & np.isfinite(values)
+        if not keep.all():
+            self.rejected += int((~keep).sum())
+            ts, values = ts[keep], values[keep]
+        self._get(sensor, metric).append(ts, values)
+        self.readings += len(ts)
+
+    def ingest_records(self, records):
+        """
+        Ingests (sensor, metric, ts, value) tuples, rejecting non-finite ones.
+        Returns (accepted, latest value of each metric in the batch).
+        """
+        grouped = {}
+        latest = {}
+        accepted = 0
+        for sensor, metric, ts, value in records:
+            if not (math.isfinite(ts) and math.isfinite(value)):
+                self.rejected += 1
+                continue
+            accepted += 1
+            entry = grouped.get((sensor, metric))
+            if entry is None:
+                entry = grouped[(sensor, metric)] = ([], [])
+            entry[0].append(ts)
+            entry[1].append(value)
+            if metric not in latest or ts >= latest[metric][0]:
+                latest[metric] = (ts, value)
+        for (sensor, metric), (ts, values) in grouped.items():
+            self.add(sensor, metric, ts, values)
+        self._maybe_trim()
+        return accepted, {metric: value for metric, (_, value) in latest.items()}
+
+    def ingest_ndjson(self, body):
+        """
+        Parses NDJSON lines, either one reading per line
+        `{"sensor": "f1", "metric": "humidity", "value": 38.5, "ts": 1717000000}`
+        or several metrics at once
+        `{"sensor": "f1", "ts": 1717000000, "humidity": 38.5, "temperature": 24.1}`.
+        `ts` defaults to the arrival time. Returns (accepted, latest values).
+        """
+        now = self._clock()
+        records = []
+        for line in body.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+                sensor = str(item.get("sensor", "default"))
+                ts = float(item.get("ts", now))
+                if "metric" in item:
+                    records.append((sensor, str(item["metric"]), ts, float(item["value"])))
+                    continue
+                for metric, value in item.items():
+                    if metric not in ("sensor", "ts"):
+                        records.append((sensor, metric, ts, float(value)))
+            except (ValueError, TypeError, KeyError, AttributeError):
+                self.rejected += 1
+        return self.ingest_records(records)
+
+    def ingest_binary(self, sensor, body):
+        """
+        Parses packed BINARY_RECORD entries for one sensor. Returns
+        (accepted, latest values). Raises ValueError on a truncated body.
+        """
+        if len(body) % BINARY_RECORD.itemsize:
+            raise ValueError(f"body length is not a multiple of {BINARY_RECORD.itemsize} bytes")
+        data = np.frombuffer(body, dtype=BINARY_RECORD)
+        latest = {}
+        accepted = 0
+        for code in np.unique(data["metric"]):
+            if code >= len(METRIC_CODES):
+                self.rejected += int((data["metric"] == code).sum())
+                continue
+            rows = data[data["metric"] == code]
+            finite = np.isfinite(rows["ts"]) & np.isfinite(rows["value"])
+            if not finite.all():
+                self.rejected += int((~finite).sum())
+                rows = rows[finite]
+                if not len(rows):
+                    continue
+            metric = METRIC_CODES[code]
+            self.add(sensor, metric, rows["ts"], rows["value"])
+            accepted += len(rows)
+            last = int(np.argmax(rows["ts"]))
+            latest[metric] = float(rows["value"][last])
+        self._maybe_trim()
+        return accepted, latest
+
+    def _maybe_trim(self):
+        now = self._clock()
+        if now - self._last_trim < 60:
+            return
+        self._last_trim = now
+        cutoff = now - self.retention
+        for series in self._series.values():
+            series.drop_before(cutoff)
+
+    def query(self, sensor, metric, start=None, end=None, bucket=60):
+        """Downsampled buckets for one series, or None if it does not exist."""
+        series = self._series.get((sensor, metric))
+        if series is None:
+            return None
+        end = self._clock() if end is None else end
+        start = end - 3600 if start is None else start
+        return series.downsample(start, end, bucket)
+
+    def since(self, sensor, metric, after):
+        """Copies of the (timestamps, values) of one series newer than `after`."""
+        series = self._series.get((sensor, metric))
+        if series is None:
+            return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.float32)
+        start = np.searchsorted(series.ts, after, side="right")
+        return series.ts[start:].copy(), series.values[start:].copy()
+
+    def list_series(self):
+        result = []
+        for (sensor, metric), series in sorted(self._series.items()):
+            last = series.last()
+            result.append({
+                "sensor": sensor,
+                "metric": metric,
+                "points": series.size,
+                "last_ts": last[0] if last else None,
+                "last_value": round(last[1], 3) if last else None,
+            })
+        return result
+
+    def stats(self):
+        return {
+            "series": len(self._series),
+            "points": sum(s.size for s in self._series.values()),
+            "readings": self.readings,
+            "rejected": self.rejected,
+        }
+
+
+def state_changes(latest):
+    """Maps the latest metric values of a batch to shared-state keys."""
+    changes = {}
+    for metric, value in latest.items():
+        key = STATE_KEYS.get(metric)
+        if key == "realtime":
+            changes[key] = bool(value)
+        elif key is not None:
+            changes[key] = round(float(value), 1)
+    return changes
+
+
+store = SensorStore()
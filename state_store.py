@@ -0,0 +1,78 @@
+import os
+from collections import deque
+
+# --- Configuration ---
+# Revisions kept in memory so reconnecting clients can catch up with a delta
+STATE_HISTORY_SIZE = int(os.getenv("STATE_HISTORY_SIZE", "1000"))
+
+
+class VersionedState:
+    """
+    Shared device/sensor state with a monotonically increasing revision.
+
+    Every `update()` that actually changes something bumps the revision once
+    and records the changed keys, so `since(rev)` can return just the keys
+    that differ from what a client saw at `rev`. Only keys present in the
+    initial state are accepted.
+    """
+
+    def __init__(self, initial, history_size=STATE_HISTORY_SIZE):
+        self._data = dict(initial)
+        self.rev = 0
+        self._history = deque(maxlen=history_size)  # (rev, changed keys)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def snapshot(self):
+        """Returns (rev, copy of the whole state)."""
+        return self.rev, dict(self._data)
+
+    def update(self, changes):
+        """
+        Applies the known keys of `changes`. Returns (rev, changed) where
+        `changed` only holds keys whose value differs; rev is unchanged if
+        nothing did.
+        """
+        changed = {k: v for k, v in changes.items() if k in self._data and self._data[k] != v}
+        if changed:
+            self._data.update(changed)
+            self.rev += 1
+            self._history.append((self.rev, tuple(changed)))
+        return self.rev, changed
+
+    def apply(self, rev, changes):
+        """Records changes made elsewhere (shared backend) at revision `rev`."""
+        self._data.update({k: v for k, v in changes.items() if k in self._data})
+        self.rev = rev
+        self._history.append((rev, tuple(changes)))
+
+    def reset(self, rev, data):
+        """Replaces the whole state; older revisions can no longer be served as deltas."""
+        self._data.update({k: v for k, v in data.items() if k in self._data})
+        self.rev = rev
+        self._history.clear()
+
+    def since(self, rev):
+        """
+        Returns (current rev, {key: current value}) for keys changed after
+        `rev`, or (current rev, None) if `rev` is older than the history kept
+        (or from another server run) and the client needs a full snapshot.
+        """
+        if rev == self.rev:
+            return self.rev, {}
+        oldest = self._history[0][0] - 1 if self._history else self.rev
+        if rev < oldest or rev > self.rev:
+            return self.rev, None
+        keys = set()
+        for entry_rev, changed in reversed(self._history):
+            if entry_rev <= rev:
+                break
+            keys.update(changed)
+        return self.rev, {k: self._data[k] for k in keys}
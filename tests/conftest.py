@@ -0,0 +1,30 @@
+import asyncio
+import inspect
+import os
+import sys
+
+import pytest
+
+# Modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def main(tmp_path_factory):
+    """The app module, with the stores it opens at import in a temporary directory."""
+    workdir = tmp_path_factory.mktemp("app")
+    os.environ["FORECAST_STORE_PATH"] = str(workdir / "weather_forecast.db")
+    os.environ["RECOMMENDATIONS_DIR"] = str(workdir / "recommendations")
+    import main
+
+    return main
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    """Runs `async def` tests, each in a new event loop."""
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+    arguments = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+    asyncio.run(pyfuncitem.obj(**arguments))
+    return True
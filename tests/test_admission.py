@@ -0,0 +1,187 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from admission import AdmissionController, Coalescer, Overloaded
+
+
+async def test_release_hands_the_slot_to_the_oldest_waiter():
+    admission = AdmissionController("t", limit=1, queue_size=2, per_client=0, deadline=5)
+    order = []
+    await admission.acquire()
+
+    async def waiter(name):
+        await admission.acquire()
+        order.append(name)
+
+    first = asyncio.create_task(waiter("first"))
+    second = asyncio.create_task(waiter("second"))
+    await asyncio.sleep(0)
+    assert admission.stats()["waiting"] == 2
+
+    admission.release()
+    await asyncio.sleep(0)
+    assert order == ["first"]
+    # The slot moved to the waiter: still one request running, none freed
+    assert admission.active == 1
+
+    admission.release()
+    await asyncio.gather(first, second)
+    assert order == ["first", "second"]
+    admission.release()
+    assert admission.active == 0
+    assert admission.stats()["waiting"] == 0
+
+
+async def test_full_queue_is_shed_immediately():
+    admission = AdmissionController("t", limit=1, queue_size=1, per_client=0, deadline=5)
+    await admission.acquire()
+    queued = asyncio.create_task(admission.acquire())
+    await asyncio.sleep(0)
+    with pytest.raises(Overloaded) as shed:
+        await admission.acquire()
+    assert shed.value.reason == "queue"
+    assert shed.value.retry_after >= 1
+    admission.release()
+    await queued
+    admission.release()
+
+
+async def test_waiter_past_its_deadline_is_shed_and_leaves_the_queue():
+    admission = AdmissionController("t", limit=1, queue_size=4, per_client=0, deadline=0.05)
+    await admission.acquire()
+    with pytest.raises(Overloaded) as shed:
+        await admission.acquire()
+    assert shed.value.reason == "deadline"
+    assert admission.stats()["waiting"] == 0
+    assert admission.shed["deadline"] == 1
+    # The expired waiter does not swallow the next release
+    admission.release()
+    assert admission.active == 0
+    await asyncio.wait_for(admission.acquire(), 1)
+    assert admission.active == 1
+
+
+async def test_cancelled_waiter_that_was_handed_the_slot_passes_it_on():
+    admission = AdmissionController("t", limit=1, queue_size=2, per_client=0, deadline=5)
+    await admission.acquire()
+    cancelled = asyncio.create_task(admission.acquire())
+    following = asyncio.create_task(admission.acquire())
+    await asyncio.sleep(0)
+    # Hand-off and cancellation land before the first waiter resumes
+    admission.release()
+    cancelled.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await cancelled
+    await asyncio.wait_for(following, 1)
+    assert admission.active == 1
+    admission.release()
+    assert admission.active == 0
+
+
+async def test_per_client_limit_counts_queued_requests():
+    admission = AdmissionController("t", limit=1, queue_size=4, per_client=2, deadline=5)
+    await admission.acquire("a")
+    queued = asyncio.create_task(admission.acquire("a"))
+    await asyncio.sleep(0)
+    with pytest.raises(Overloaded) as shed:
+        await admission.acquire("a")
+    assert shed.value.reason == "client"
+    # Other clients still queue normally
+    other = asyncio.create_task(admission.acquire("b"))
+    await asyncio.sleep(0)
+    admission.release("a")
+    await queued
+    admission.release("a")
+    await other
+    admission.release("b")
+    assert admission.stats()["clients"] == 0
+
+
+async def test_coalesced_callers_share_one_computation():
+    coalescer = Coalescer()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    results = await asyncio.gather(*(coalescer.run("k", compute) for _ in range(5)))
+    assert results == ["result"] * 5
+    assert len(calls) == 1
+    assert coalescer.stats() == {"in_flight": 0, "calls": 5, "coalesced": 4}
+
+
+async def test_coalesced_callers_survive_the_leader_being_cancelled():
+    coalescer = Coalescer()
+    release = asyncio.Event()
+
+    async def compute():
+        await release.wait()
+        return "result"
+
+    leader = asyncio.create_task(coalescer.run("k", compute))
+    await asyncio.sleep(0)
+    follower = asyncio.create_task(coalescer.run("k", compute))
+    await asyncio.sleep(0)
+    leader.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+    release.set()
+    assert await asyncio.wait_for(follower, 1) == "result"
+    assert coalescer.stats()["in_flight"] == 0
+
+
+async def test_coalesced_callers_share_the_failure():
+    coalescer = Coalescer()
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream down")
+
+    results = await asyncio.gather(*(coalescer.run("k", compute) for _ in range(3)),
+                                   return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+    # A later call starts a new computation
+    with pytest.raises(ValueError):
+        await coalescer.run("k", compute)
+    assert coalescer.stats()["coalesced"] == 2
+
+
+@pytest.fixture
+def batch(main, monkeypatch):
+    """main's batch endpoint behind a one-slot, no-queue controller, with a stub stream."""
+    admission = AdmissionController("recommendation", limit=1, queue_size=0, per_client=0, deadline=5)
+    seen = []
+
+    async def stream(items):
+        for index, _ in enumerate(items):
+            seen.append(admission.active)
+            yield f"{index}\n"
+
+    monkeypatch.setattr(main, "recommendation_admission", admission)
+    monkeypatch.setattr(main, "_require_api_keys", lambda: None)
+    monkeypatch.setattr(main, "_batch_stream", stream)
+    request = SimpleNamespace(client=SimpleNamespace(host="10.0.0.1"))
+    items = [main.BatchLocationIn(lat=36.8, lon=10.2), main.BatchLocationIn(lat=35.8, lon=10.6)]
+    return SimpleNamespace(admission=admission, seen=seen, run=lambda: main.batch_recommendations(request, items))
+
+
+async def test_batch_holds_a_recommendation_slot_while_it_streams(batch):
+    response = await batch.run()
+    lines = [line async for line in response.body_iterator]
+    assert lines == ["0\n", "1\n"]
+    assert batch.seen == [1, 1]
+    assert batch.admission.active == 0
+    assert batch.admission.admitted == 1
+
+
+async def test_batch_is_shed_before_streaming_when_the_controller_is_full(batch):
+    await batch.admission.acquire()
+    with pytest.raises(Overloaded) as shed:
+        await batch.run()
+    assert shed.value.reason == "queue"
+    assert batch.seen == []
+    batch.admission.release()
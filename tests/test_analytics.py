@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+
+import sensors
+from analytics import _utc_epoch
+from forecast_store import FETCHED_AT_FORMAT, FORECAST_COLUMNS, TIME_FORMAT
+
+
+@pytest.fixture
+def idle_analytics(main, monkeypatch, tmp_path):
+    """main's forecast analytics over an empty store in tmp_path, before the startup catch-up."""
+    forecast_analytics = main.forecast_analytics
+    monkeypatch.setattr(forecast_analytics, "path", str(tmp_path / "forecasts.db"))
+    monkeypatch.setattr(forecast_analytics, "store", None)
+    monkeypatch.setattr(forecast_analytics, "ready", False)
+    monkeypatch.setattr(forecast_analytics, "error", None)
+    monkeypatch.setattr(forecast_analytics, "_marks", {})
+    forecast_analytics.start()
+    yield forecast_analytics
+    forecast_analytics.store.close()
+
+
+@pytest.fixture
+def analytics(idle_analytics):
+    idle_analytics.catch_up()
+    return idle_analytics
+
+
+def fetch(lat, lon, times, temp, pop):
+    """One fetched forecast of (lat, lon), as _fetch_and_store saves it."""
+    rows = []
+    for time in times:
+        row = dict.fromkeys(FORECAST_COLUMNS)
+        row.update(location_name="Ferme", latitude=lat, longitude=lon, forecast_time=time,
+                   temp_c=temp, humidity_percent=60.0, precipitation_prob_percent=pop)
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def slots(days=2):
+    start = (datetime.now() + timedelta(days=1)).replace(minute=0, second=0, microsecond=0)
+    return [(start + timedelta(hours=3 * i)).strftime(TIME_FORMAT) for i in range(8 * days)]
+
+
+async def test_default_location_reads_the_forecasts_of_its_grid_cell(main, analytics):
+    lat, lon = main.forecast_cache.cell(*main._resolve_location(None, None))
+    times = slots()
+    now = datetime.now()
+    analytics.store.append(fetch(lat, lon, times, 20.0, 30.0), (now - timedelta(hours=1)).strftime(TIME_FORMAT))
+    analytics.store.append(fetch(lat, lon, times, 22.0, 70.0), now.strftime(TIME_FORMAT))
+
+    drift = await main.analytics_drift()
+    assert drift["location"] == f"{lat:.2f},{lon:.2f}"
+    assert drift["by_lead_day"][0]["temp_bias_c"] == 2.0
+    trend = await main.analytics_rain_trend()
+    assert len(trend["series"]) >= 2
+    assert trend["series"][0]["max_percent"] == 70.0
+
+
+async def test_fetches_in_the_same_second_are_two_fetches(main, analytics):
+    lat, lon = main.forecast_cache.cell(*main._resolve_location(None, None))
+    times = slots()
+    now = datetime.now().replace(microsecond=0)
+    analytics.store.append(fetch(lat, lon, times, 20.0, 30.0), (now - timedelta(hours=1)).strftime(TIME_FORMAT))
+    analytics.store.append(fetch(lat, lon, times, 21.0, 30.0), now.replace(microsecond=1).strftime(FETCHED_AT_FORMAT))
+    analytics.store.append(fetch(lat, lon, times, 23.0, 30.0), now.replace(microsecond=2).strftime(FETCHED_AT_FORMAT))
+
+    drift = await main.analytics_drift()
+    # 20 -> 21 -> 23: two changes per slot, +1 then +2
+    assert drift["by_lead_day"][0]["temp_bias_c"] == 1.5
+    assert drift["daily"][-1]["pairs"] == 2 * len(times)
+
+
+async def test_sensor_readings_are_compared_with_the_forecast_of_their_cell(main, analytics):
+    lat, lon = main.forecast_cache.cell(*main._resolve_location(None, None))
+    times = slots(days=1)
+    analytics.store.append(fetch(lat, lon, times, 20.0, 30.0), datetime.now().strftime(TIME_FORMAT))
+
+    store = sensors.SensorStore()
+    store.ingest_records([("f1", "temperature", _utc_epoch(time), 21.0) for time in times])
+    batch = analytics.collect_observations(store, main._resolve_location(None, None))
+    assert analytics.record_observations(batch) == len(times)
+
+    accuracy = await main.analytics_accuracy()
+    assert accuracy["metrics"]["temperature"]["readings"] == len(times)
+    assert accuracy["metrics"]["temperature"]["bias"] == -1.0
+
+
+async def test_failed_catch_up_is_reported_and_resumed(main, idle_analytics, monkeypatch):
+    lat, lon = main.forecast_cache.cell(*main._resolve_location(None, None))
+    idle_analytics.store.append(fetch(lat, lon, slots(days=1), 20.0, 30.0), datetime.now().strftime(TIME_FORMAT))
+
+    def broken(*args):
+        raise ValueError("disk I/O error")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(idle_analytics, "_apply_fetch", broken)
+        assert idle_analytics.catch_up() == 0
+    health = (await main.health_check())["analytics"]
+    assert health["ready"] is False
+    assert "disk I/O error" in health["error"]
+
+    # Nothing of the failed chunk was kept: the next catch-up adds the fetch
+    assert idle_analytics.catch_up() == 1
+    assert (await main.health_check())["analytics"] == {"enabled": True, "ready": True, "error": None}
+    assert (await main.analytics_rain_trend())["series"]
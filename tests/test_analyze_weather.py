@@ -0,0 +1,29 @@
+import math
+
+import pandas as pd
+
+import analyze_weather
+
+
+def forecast(temps):
+    return pd.DataFrame({
+        "forecast_time": pd.date_range("2030-01-01 00:00", periods=len(temps), freq="3h"),
+        "temp_c": temps,
+        "humidity_percent": 61.0,
+        "weather_condition": "Clear",
+        "precipitation_prob_percent": 12.0,
+    })
+
+
+def test_fingerprint_ignores_insignificant_changes():
+    assert analyze_weather.forecast_fingerprint(forecast([20.2, 21.0])) == \
+        analyze_weather.forecast_fingerprint(forecast([19.8, 21.3]))
+    assert analyze_weather.forecast_fingerprint(forecast([20.2, 21.0])) != \
+        analyze_weather.forecast_fingerprint(forecast([20.2, 23.0]))
+
+
+def test_fingerprint_of_a_forecast_with_missing_values():
+    with_nan = analyze_weather.forecast_fingerprint(forecast([20.0, math.nan]))
+    assert with_nan == analyze_weather.forecast_fingerprint(forecast([20.0, math.nan]))
+    assert with_nan != analyze_weather.forecast_fingerprint(forecast([20.0, 0.0]))
+    assert len(analyze_weather.forecast_fingerprint(forecast([math.inf, 21.0]))) == 16
@@ -0,0 +1,83 @@
+import fakeredis
+import pytest
+
+import backends
+from state_store import VersionedState
+
+INITIAL = {"humidity": 65, "pumpOn": False}
+
+
+def redis_backend(**options):
+    backend = backends.RedisStateBackend(INITIAL, url="redis://localhost:6379/0", prefix="test:state", **options)
+    backend._redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    backend._update = backend._redis.register_script(backends._UPDATE_SCRIPT)
+    return backend
+
+
+@pytest.fixture(params=["memory", "redis"])
+def make_backend(request):
+    return (lambda: backends.MemoryStateBackend(INITIAL)) if request.param == "memory" else redis_backend
+
+
+async def test_update_at_the_expected_revision_is_applied(make_backend):
+    backend = make_backend()
+    events = []
+    await backend.start(lambda rev, changes, full=False: events.append((rev, changes, full)))
+    rev, _ = await backend.snapshot()
+    new_rev, changed = await backend.update({"humidity": 40}, expected_rev=rev)
+    assert new_rev == rev + 1
+    assert changed == {"humidity": 40}
+    assert (await backend.snapshot()) == (new_rev, {**INITIAL, "humidity": 40})
+    await backend.close()
+
+
+async def test_stale_revision_is_rejected_without_writing(make_backend):
+    backend = make_backend()
+    await backend.start(lambda rev, changes, full=False: None)
+    rev, _ = await backend.snapshot()
+    await backend.update({"humidity": 40}, expected_rev=rev)
+    with pytest.raises(backends.StateConflict) as conflict:
+        await backend.update({"pumpOn": True}, expected_rev=rev)
+    assert conflict.value.rev == rev + 1
+    assert (await backend.snapshot()) == (rev + 1, {**INITIAL, "humidity": 40})
+    # Without an expected revision the write always goes through
+    await backend.update({"pumpOn": True})
+    assert (await backend.snapshot())[1]["pumpOn"] is True
+    await backend.close()
+
+
+async def test_apply_state_update_retries_after_a_conflict(main, monkeypatch):
+    backend = redis_backend()
+    await backend.start(lambda rev, changes, full=False: None)
+    rev, data = await backend.snapshot()
+    # This worker's copy of the state is one revision behind the backend
+    monkeypatch.setattr(main, "state", VersionedState(INITIAL))
+    monkeypatch.setattr(main, "state_backend", backend)
+    await backend.update({"pumpOn": True})
+
+    accepted, new_rev = await main._apply_state_update({"humidity": 30})
+    assert accepted == {"humidity": 30}
+    assert backend.conflicts == 1
+    new_state = (await backend.snapshot())
+    assert new_state[0] == new_rev == rev + 2
+    # The retry kept the other worker's write
+    assert new_state[1]["humidity"] == 30 and new_state[1]["pumpOn"] is True
+    await backend.close()
+
+
+class BrokenPubSub:
+    async def subscribe(self, channel):
+        raise ConnectionError("subscriptions are disabled")
+
+    async def aclose(self):
+        pass
+
+
+async def test_start_gives_up_when_the_subscription_keeps_failing(monkeypatch, capsys):
+    backend = redis_backend(start_timeout=0.2)
+    monkeypatch.setattr(backend._redis, "pubsub", BrokenPubSub)
+    with pytest.raises(ConnectionError, match="test:state:events"):
+        await backend.start(lambda rev, changes, full=False: None)
+    assert backend._listener is None
+    assert "state subscription lost" in capsys.readouterr().out
+    await backend.close()
@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from cache import ForecastCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Upstream:
+    """Counts fetches; each one waits for `gate` and returns the next value or raises."""
+
+    def __init__(self):
+        self.calls = 0
+        self.gate = asyncio.Event()
+        self.gate.set()
+        self.fail = False
+
+    async def fetch(self, lat, lon):
+        self.calls += 1
+        await self.gate.wait()
+        if self.fail:
+            raise ConnectionError("upstream down")
+        return f"forecast {self.calls}"
+
+
+async def test_concurrent_misses_share_one_fetch():
+    upstream = Upstream()
+    upstream.gate.clear()
+    cache = ForecastCache(upstream.fetch, ttl=60)
+    # Same grid cell, slightly different coordinates
+    waiting = [asyncio.create_task(cache.get(36.80 + i * 0.001, 10.18)) for i in range(5)]
+    await asyncio.sleep(0)
+    upstream.gate.set()
+    assert await asyncio.gather(*waiting) == ["forecast 1"] * 5
+    assert upstream.calls == 1
+    assert cache.stats()["coalesced"] == 4
+    assert await cache.get(36.80, 10.18) == "forecast 1"
+    assert upstream.calls == 1
+
+
+async def test_cancelled_caller_does_not_cancel_the_shared_fetch():
+    upstream = Upstream()
+    upstream.gate.clear()
+    cache = ForecastCache(upstream.fetch, ttl=60)
+    first = asyncio.create_task(cache.get(36.8, 10.2))
+    second = asyncio.create_task(cache.get(36.8, 10.2))
+    await asyncio.sleep(0)
+    first.cancel()
+    upstream.gate.set()
+    assert await second == "forecast 1"
+    with pytest.raises(asyncio.CancelledError):
+        await first
+    assert upstream.calls == 1
+
+
+async def test_refresh_joins_a_fetch_in_flight():
+    upstream = Upstream()
+    upstream.gate.clear()
+    cache = ForecastCache(upstream.fetch, ttl=60)
+    get = asyncio.create_task(cache.get(36.8, 10.2))
+    await asyncio.sleep(0)
+    refresh = asyncio.create_task(cache.refresh(36.8, 10.2))
+    await asyncio.sleep(0)
+    upstream.gate.set()
+    assert await asyncio.gather(get, refresh) == ["forecast 1", "forecast 1"]
+    assert upstream.calls == 1
+
+
+async def test_expired_entry_is_served_when_the_upstream_fails():
+    clock = Clock()
+    upstream = Upstream()
+    cache = ForecastCache(upstream.fetch, ttl=60, max_fallback_age=600, clock=clock)
+    assert await cache.get(36.8, 10.2) == "forecast 1"
+
+    clock.now += 120
+    upstream.fail = True
+    assert await cache.get(36.8, 10.2) == "forecast 1"
+    assert cache.stats()["fallbacks"] == 1
+
+    # Too old to fall back on: the error reaches the caller
+    clock.now += 600
+    with pytest.raises(ConnectionError):
+        await cache.get(36.8, 10.2)
+
+
+async def test_stale_entry_is_served_while_one_background_refresh_runs():
+    clock = Clock()
+    upstream = Upstream()
+    cache = ForecastCache(upstream.fetch, ttl=60, stale_while_revalidate=True, clock=clock)
+    assert await cache.get(36.8, 10.2) == "forecast 1"
+
+    clock.now += 90
+    upstream.gate.clear()
+    assert await cache.get(36.8, 10.2) == "forecast 1"
+    assert await cache.get(36.8, 10.2) == "forecast 1"
+    await asyncio.sleep(0)
+    assert upstream.calls == 2  # one refresh for both stale reads
+    upstream.gate.set()
+    await asyncio.sleep(0.01)
+    assert await cache.get(36.8, 10.2) == "forecast 2"
+    assert cache.stats()["stale"] == 2
@@ -0,0 +1,108 @@
+import asyncio
+import json
+
+from connections import ConnectionManager
+
+
+class FakeWebSocket:
+    """Records the messages sent; each send waits for `gate` when one is given."""
+
+    def __init__(self, gate=None):
+        self.gate = gate
+        self.received = []
+
+    async def send_text(self, data):
+        if self.gate is not None:
+            await self.gate.wait()
+        self.received.append(json.loads(data))
+
+
+def delta(rev, **changes):
+    return {"type": "state_delta", "base": rev - 1, "rev": rev, "changes": changes}
+
+
+async def settle():
+    """Lets the sender tasks run until they are idle or blocked."""
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+
+async def test_slow_client_only_gets_the_latest_state_and_does_not_block_others():
+    manager = ConnectionManager()
+    gate = asyncio.Event()
+    slow, fast = FakeWebSocket(gate), FakeWebSocket()
+    manager.register(slow)
+    manager.register(fast)
+
+    updates = [delta(1, humidity=61), delta(2, pumpOn=True), delta(3, humidity=63), delta(4, humidity=64)]
+    for message in updates:
+        manager.broadcast_state(lambda message=message: message)
+        await settle()
+    # The fast client got every delta while the slow one is still stuck on the first
+    assert fast.received == updates
+    assert slow.received == []
+
+    gate.set()
+    await settle()
+    # The deltas queued behind the first one were merged into a single message
+    assert slow.received == [
+        delta(1, humidity=61),
+        {"type": "state_delta", "base": 1, "rev": 4, "changes": {"pumpOn": True, "humidity": 64}},
+    ]
+    assert manager.stats()["dropped"] == 2
+    await manager.close()
+
+
+async def test_delta_is_folded_into_a_pending_full_state():
+    manager = ConnectionManager()
+    gate = asyncio.Event()
+    slow = FakeWebSocket(gate)
+    manager.register(slow)
+    manager.broadcast_nowait({"type": "notice"})
+    await settle()
+    manager.send_state(slow, {"type": "state", "rev": 1, "state": {"humidity": 61, "pumpOn": False}})
+    manager.send_state(slow, delta(2, pumpOn=True))
+    gate.set()
+    await settle()
+    assert slow.received == [
+        {"type": "notice"},
+        {"type": "state", "rev": 2, "state": {"humidity": 61, "pumpOn": True}},
+    ]
+    await manager.close()
+
+
+async def test_full_queue_drops_the_oldest_message():
+    manager = ConnectionManager(maxsize=2, policy="drop_oldest")
+    gate = asyncio.Event()
+    slow = FakeWebSocket(gate)
+    manager.register(slow)
+    for i in range(5):
+        manager.broadcast_nowait({"type": "notice", "n": i})
+        await settle()
+    gate.set()
+    await settle()
+    # The first message was already being sent; of the others only the two newest were kept
+    assert [message["n"] for message in slow.received] == [0, 3, 4]
+    await manager.close()
+
+
+async def test_client_too_slow_is_disconnected_without_delaying_the_others():
+    manager = ConnectionManager(maxsize=1, policy="disconnect", send_timeout=0.05)
+    slow, fast = FakeWebSocket(asyncio.Event()), FakeWebSocket()
+    manager.register(slow)
+    manager.register(fast)
+    for i in range(3):
+        manager.broadcast_nowait({"type": "notice", "n": i})
+        await settle()
+    assert slow not in manager.clients
+    assert manager.stats()["disconnected_slow"] == 1
+    assert [message["n"] for message in fast.received] == [0, 1, 2]
+
+    # A send stuck past the timeout also drops the client
+    stuck = FakeWebSocket(asyncio.Event())
+    manager.register(stuck)
+    manager.broadcast_nowait({"type": "notice", "n": 3})
+    await asyncio.sleep(0.1)
+    assert stuck not in manager.clients
+    assert fast.received[-1] == {"type": "notice", "n": 3}
+    await manager.close()
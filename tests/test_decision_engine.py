@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import decision_engine
+
+
+def arrays(temp=20.0, tmin=15.0, tmax=25.0, humidity=50.0, wind=2.0, pop=0.0, fields=1):
+    """(F, T) forecast arrays with the same value in every slot."""
+    shape = (fields, decision_engine.WINDOW_STEPS)
+    return [np.full(shape, value) for value in (temp, tmin, tmax, humidity, wind, pop)]
+
+
+def forecast(start, lat=36.8, pop=0.0, temp=30.0):
+    times = pd.date_range(start, periods=decision_engine.WINDOW_STEPS, freq="3h")
+    return pd.DataFrame({
+        "forecast_time": times,
+        "latitude": lat,
+        "temp_c": temp,
+        "temp_min_c": temp - 6,
+        "temp_max_c": temp + 6,
+        "humidity_percent": 40.0,
+        "wind_speed_mps": 3.0,
+        "precipitation_prob_percent": pop,
+    })
+
+
+def test_extraterrestrial_radiation_matches_fao56():
+    # FAO-56 example 8: 20°S on 3 September
+    assert decision_engine.extraterrestrial_radiation(-20, 246) == pytest.approx(32.2, abs=0.1)
+
+
+def test_et0_is_hargreaves_in_neutral_weather():
+    # Ra = 32.2 MJ/m²/day, mean 20°C, 10°C range, 2 m/s wind and 50% humidity leave it unadjusted
+    result = decision_engine.decide_arrays(
+        *arrays(), np.array([-20.0]), np.array([246]), np.array([[1.0]]), np.array([[2.0]]),
+    )
+    expected = 0.0023 * 0.408 * 32.2 * (20 + 17.8) * np.sqrt(10)
+    assert result["et0"][0] == pytest.approx(expected, rel=0.01)
+    assert result["need"][0, 0] == pytest.approx(expected, rel=0.01)
+
+
+def test_water_when_the_need_reaches_the_threshold():
+    lat, day, kc = np.array([-20.0]), np.array([246]), np.array([[1.0, 1.0]])
+    et0 = decision_engine.decide_arrays(*arrays(), lat, day, kc, np.array([[1.0, 1.0]]))["et0"][0]
+    result = decision_engine.decide_arrays(*arrays(), lat, day, kc, np.array([[et0 - 0.1, et0 + 0.1]]))
+    assert result["water"][0].tolist() == [True, False]
+
+
+def test_crop_coefficient_follows_the_season_and_hemisphere():
+    summer, winter, southern = decision_engine.decide([
+        forecast("2030-07-15"), forecast("2030-01-15"), forecast("2030-07-15", lat=-33.9),
+    ], [["tomates"]] * 3)
+    assert (summer["season"], winter["season"], southern["season"]) == ("été", "hiver", "hiver")
+    # No rain: the need is Kc x ET0
+    assert summer["needs_mm"]["tomates"] == pytest.approx(1.15 * summer["et0_mm"], abs=0.02)
+    assert winter["needs_mm"]["tomates"] == pytest.approx(0.60 * winter["et0_mm"], abs=0.02)
+
+
+def test_dry_summer_day_waters_every_crop():
+    decision = decision_engine.decide([forecast("2030-07-15", temp=20.0)])[0]
+    assert decision["rain_prob"] == 0
+    assert decision["water"] == ["oignons", "tomates", "menthe"]
+    assert decision["skip"] == []
+    assert decision_engine.describe(decision).startswith("Il est recommandé d'arroser")
+
+
+def test_certain_rain_skips_watering():
+    dry, rainy = decision_engine.decide([forecast("2030-07-15", temp=20.0), forecast("2030-07-15", temp=20.0, pop=100.0)])
+    assert rainy["rain_prob"] == 100
+    assert rainy["water"] == []
+    # The expected rain is taken off the need
+    rain_mm = decision_engine.RAIN_EVENT_MM
+    assert rainy["needs_mm"] == {crop: pytest.approx(need - rain_mm, abs=0.01) for crop, need in dry["needs_mm"].items()}
+    assert "la pluie étant probable" in decision_engine.describe(rainy)
+
+
+def test_unknown_crop_has_no_confidence():
+    decision = decision_engine.decide([forecast("2030-07-15")], [["tomates", "fraises"]])[0]
+    assert decision["skip"] == ["fraises"]
+    assert "fraises" not in decision["needs_mm"]
+    assert decision["confidence"] == 0.0
@@ -0,0 +1,96 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from forecast_store import FORECAST_COLUMNS, TIME_FORMAT, ForecastStore, location_key
+
+NOW = datetime(2030, 1, 10, 12)
+
+
+def fetch(lat, lon, temp, fetched_at=None, slots=4):
+    rows = []
+    for i in range(slots):
+        row = dict.fromkeys(FORECAST_COLUMNS)
+        row.update(location_name="Ferme", latitude=lat, longitude=lon, temp_c=temp + i,
+                   forecast_time=(NOW + timedelta(hours=3 * (i + 1))).strftime(TIME_FORMAT))
+        if fetched_at is not None:
+            row["fetched_at"] = fetched_at.strftime(TIME_FORMAT)
+        rows.append(row)
+    return rows
+
+
+def test_latest_is_the_newest_fetch_of_the_location(tmp_path):
+    store = ForecastStore(str(tmp_path / "forecasts.db"))
+    store.append(fetch(36.8, 10.2, 20.0), fetched_at="2030-01-10 09:00:00")
+    store.append(fetch(35.8, 10.6, 30.0), fetched_at="2030-01-10 10:00:00")
+    store.append(fetch(36.8, 10.2, 22.0), fetched_at="2030-01-10 11:00:00")
+
+    latest = store.latest(36.8, 10.2, now=NOW)
+    assert latest["temp_c"].tolist() == [22.0, 23.0, 24.0, 25.0]
+    assert set(latest["fetched_at"]) == {pd.Timestamp("2030-01-10 11:00:00")}
+    assert store.latest(35.8, 10.6, now=NOW)["temp_c"].iloc[0] == 30.0
+    # Without a location: the newest fetch of any location
+    assert store.latest(now=NOW)["latitude"].iloc[0] == 36.8
+    # Only the slots within `hours`
+    assert len(store.latest(36.8, 10.2, hours=6, now=NOW)) == 2
+    assert store.latest(30.0, 10.0, now=NOW) is None
+    store.close()
+
+
+def test_retention_keeps_the_latest_fetch_of_each_location(tmp_path):
+    store = ForecastStore(str(tmp_path / "forecasts.db"), compact_every=0)
+    recent = datetime.now() - timedelta(days=1)
+    old = datetime.now() - timedelta(days=40)
+    store.append(fetch(36.8, 10.2, 10.0, fetched_at=old - timedelta(days=1)))
+    store.append(fetch(36.8, 10.2, 20.0, fetched_at=old))
+    store.append(fetch(36.8, 10.2, 30.0, fetched_at=recent))
+    # Only old fetches for this one: its latest stays
+    store.append(fetch(35.8, 10.6, 40.0, fetched_at=old))
+
+    assert store.apply_retention(retention_days=30) == 8
+    assert store.count() == 8
+    assert store.latest(36.8, 10.2, now=NOW)["temp_c"].iloc[0] == 30.0
+    assert store.latest(35.8, 10.6, now=NOW)["temp_c"].iloc[0] == 40.0
+    assert store.apply_retention(retention_days=30) == 0
+    store.close()
+
+
+def test_legacy_csv_log_is_imported_once(tmp_path):
+    csv_path = tmp_path / "weather_forecast_log.csv"
+    pd.DataFrame(fetch(36.8, 10.2, 20.0, fetched_at=NOW - timedelta(hours=2))).to_csv(csv_path, index=False)
+    store = ForecastStore(str(tmp_path / "forecasts.db"))
+
+    assert store.migrate_csv(str(csv_path)) == 4
+    assert store.migrate_csv(str(csv_path)) == 0
+    assert store.count() == 4
+    # The CSV's fetch time is kept
+    latest = store.latest(36.8, 10.2, now=NOW)
+    assert set(latest["fetched_at"]) == {pd.Timestamp(NOW - timedelta(hours=2))}
+    store.close()
+
+
+def test_database_without_indexes_or_meta_table_is_upgraded(tmp_path):
+    path = str(tmp_path / "forecasts.db")
+    conn = sqlite3.connect(path)
+    columns = ", ".join(f"{column} {'TEXT' if column in ('location_name', 'forecast_time', 'weather_condition') else 'REAL'}"
+                        for column in FORECAST_COLUMNS)
+    conn.execute(f"CREATE TABLE forecasts (location_key TEXT NOT NULL, {columns}, fetched_at TEXT NOT NULL)")
+    conn.execute(
+        f"INSERT INTO forecasts (location_key, {', '.join(FORECAST_COLUMNS)}, fetched_at) "
+        f"VALUES (?, {', '.join(['?'] * len(FORECAST_COLUMNS))}, ?)",
+        (location_key(36.8, 10.2), "Ferme", 36.8, 10.2, (NOW + timedelta(hours=3)).strftime(TIME_FORMAT),
+         18.0, None, None, None, 70.0, "Rain", None, 80.0, None, "2030-01-10 08:00:00"),
+    )
+    conn.commit()
+    conn.close()
+
+    store = ForecastStore(path)
+    with sqlite3.connect(path) as conn:
+        names = {name for (name,) in conn.execute("SELECT name FROM sqlite_master")}
+    assert {"meta", "idx_forecasts_location_fetched", "idx_forecasts_fetched"} <= names
+    assert store.latest(36.8, 10.2, now=NOW)["temp_c"].tolist() == [18.0]
+    store.append(fetch(36.8, 10.2, 25.0), fetched_at="2030-01-10 11:00:00")
+    assert store.count() == 5
+    assert store.latest(36.8, 10.2, now=NOW)["temp_c"].iloc[0] == 25.0
+    store.close()
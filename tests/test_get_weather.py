@@ -0,0 +1,53 @@
+import pytest
+import requests
+
+import get_weather
+from resilience import CircuitBreaker, TokenBucket
+
+
+class FailingSession:
+    def __init__(self, error):
+        self.error = error
+        self.calls = 0
+
+    def get(self, *args, **kwargs):
+        self.calls += 1
+        raise self.error
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    # Opens after one failure and lets a trial through again right away
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    monkeypatch.setattr(get_weather, "circuit_breaker", breaker)
+    monkeypatch.setattr(get_weather, "rate_limiter", TokenBucket(rate=1000, capacity=1000))
+    monkeypatch.setattr(get_weather.replay, "MODE", "live")
+    return breaker
+
+
+@pytest.mark.parametrize("error", [
+    requests.exceptions.ChunkedEncodingError("connection broken"),
+    requests.exceptions.TooManyRedirects("redirect loop"),
+    requests.exceptions.InvalidURL("bad url"),
+    requests.exceptions.ContentDecodingError("bad gzip"),
+])
+def test_other_request_errors_end_the_half_open_trial(monkeypatch, breaker, error):
+    session = FailingSession(error)
+    monkeypatch.setattr(get_weather, "get_session", lambda: session)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    with pytest.raises(type(error)):
+        get_weather.request_forecast({"lat": 1, "lon": 2}, timeout=1)
+    assert session.calls == 1
+    # The failed trial re-opened the breaker instead of holding the trial forever
+    assert breaker.allow()
+
+
+def test_unexpected_error_releases_the_half_open_trial(monkeypatch, breaker):
+    monkeypatch.setattr(get_weather, "get_session", lambda: FailingSession(RuntimeError("bug")))
+    breaker.record_failure()
+
+    with pytest.raises(RuntimeError):
+        get_weather.request_forecast({"lat": 1, "lon": 2}, timeout=1)
+    assert breaker.allow()
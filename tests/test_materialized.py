@@ -0,0 +1,60 @@
+import asyncio
+
+from forecast_store import location_key
+from materialized import MaterializedRecommendations
+
+
+class Recommender:
+    """compute() waits for `gate`; every published entry is kept."""
+
+    def __init__(self):
+        self.gate = asyncio.Event()
+        self.published = []
+
+    async def compute(self, lat, lon, df):
+        await self.gate.wait()
+        return {"recommendation": f"irriguer ({df})"}
+
+    async def publish(self, entry):
+        self.published.append(entry)
+
+
+async def test_recompute_running_when_the_location_is_discarded_is_dropped():
+    recommender = Recommender()
+    view = MaterializedRecommendations(recommender.compute, str, recommender.publish)
+    update = asyncio.create_task(view.update(36.8, 10.2, "forecast 1"))
+    await asyncio.sleep(0)
+    view.discard(location_key(36.8, 10.2))
+    recommender.gate.set()
+    assert await update is None
+    assert view.entries() == []
+    assert recommender.published == []
+    assert view.stats()["in_flight"] == 0
+
+
+async def test_location_registered_again_after_a_discard_is_recomputed():
+    recommender = Recommender()
+    recommender.gate.set()
+    view = MaterializedRecommendations(recommender.compute, str, recommender.publish)
+    await view.update(36.8, 10.2, "forecast 1")
+    view.discard(location_key(36.8, 10.2))
+    assert view.get(36.8, 10.2) is None
+    entry = await view.update(36.8, 10.2, "forecast 1")
+    assert entry["recommendation"] == "irriguer (forecast 1)"
+    assert view.get(36.8, 10.2) is entry
+    assert len(recommender.published) == 2
+
+
+async def test_discards_are_not_remembered_once_no_recompute_runs():
+    recommender = Recommender()
+    view = MaterializedRecommendations(recommender.compute, str, recommender.publish)
+    for i in range(5):
+        update = asyncio.create_task(view.update(36.8, 10.2 + i, "forecast 1"))
+        await asyncio.sleep(0)
+        view.discard(location_key(36.8, 10.2 + i))
+        view.discard(location_key(40.0, 10.2 + i))  # never registered
+    recommender.gate.set()
+    assert await update is None
+    await asyncio.sleep(0)
+    assert view._generations == {}
+    assert view._running == {}
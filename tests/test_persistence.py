@@ -0,0 +1,55 @@
+from datetime import datetime
+
+import pandas as pd
+
+import persistence
+from forecast_store import FORECAST_COLUMNS, ForecastStore
+
+
+def forecast(temp):
+    row = dict.fromkeys(FORECAST_COLUMNS)
+    row.update(latitude=36.8, longitude=10.2, forecast_time="2030-01-01 12:00:00", temp_c=temp)
+    return pd.DataFrame([row])
+
+
+class Clock:
+    """Stands in for persistence.datetime, one microsecond later on every call."""
+
+    calls = 0
+
+    @classmethod
+    def now(cls):
+        cls.calls += 1
+        return datetime(2030, 1, 1, 9, 0, 1, cls.calls)
+
+
+async def test_fetches_in_the_same_second_keep_their_own_time(monkeypatch, tmp_path):
+    monkeypatch.setattr(persistence, "datetime", Clock)
+    store = ForecastStore(str(tmp_path / "forecasts.db"))
+    writer = persistence.PersistenceWriter(store.append, directory=str(tmp_path), latest_path=None,
+                                           flush_interval=60)
+    first, second = forecast(20.0), forecast(21.0)
+    await writer.submit_forecast(first)
+    await writer.submit_forecast(second)
+    await writer.close()
+    assert writer.flushes == 1
+    # the shared DataFrames are left as they were
+    assert "fetched_at" not in first.columns
+
+    # Two fetches of one slot: the latest fetch holds the second one only
+    assert store.count() == 2
+    latest = store.latest(36.8, 10.2, now=datetime(2030, 1, 1, 9))
+    store.close()
+    assert latest["temp_c"].tolist() == [21.0]
+    assert latest["fetched_at"].tolist() == [pd.Timestamp("2030-01-01 09:00:01.000002")]
+
+
+async def test_last_recommendation_is_mirrored_to_the_legacy_file(tmp_path):
+    legacy = tmp_path / "recommendation.txt"
+    writer = persistence.PersistenceWriter(lambda df: None, directory=str(tmp_path / "recommendations"),
+                                           latest_path=str(legacy), flush_interval=60)
+    await writer.submit_recommendation(36.8, 10.2, "Arroser ce soir.", source="llm")
+    await writer.submit_recommendation(35.8, 10.6, "Pas d'arrosage.", source="engine")
+    await writer.close()
+    assert legacy.read_text(encoding="utf-8") == "Pas d'arrosage."
+    assert persistence.read_recommendation(36.8, 10.2, str(tmp_path / "recommendations"))["source"] == "llm"
@@ -0,0 +1,29 @@
+import importlib
+import pstats
+
+import profiler
+
+
+def test_unknown_profiler_is_reported_and_turned_off(monkeypatch, capsys):
+    monkeypatch.setenv("PROFILER", "cprofiler")
+    try:
+        module = importlib.reload(profiler)
+        assert module.PROFILER == "off"
+        assert "PROFILER" in capsys.readouterr().out
+        assert not module.RequestProfiler().enabled
+    finally:
+        monkeypatch.delenv("PROFILER")
+        importlib.reload(profiler)
+
+
+def test_profile_is_written_once_at_a_time(tmp_path):
+    request_profiler = profiler.RequestProfiler(engine="cprofile", directory=str(tmp_path))
+    assert request_profiler.wants({"x-profile": "1"})
+    with request_profiler.profile("GET /get-recommendation") as outer:
+        with request_profiler.profile("GET /state") as inner:
+            sum(range(1000))
+    assert inner["path"] is None
+    assert outer["path"].endswith("GET_get_recommendation.prof")
+    pstats.Stats(outer["path"])
+    assert request_profiler.stats()["profiled"] == 1
+    assert request_profiler.stats()["skipped"] == 1
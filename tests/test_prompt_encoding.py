@@ -0,0 +1,72 @@
+import importlib
+import math
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import analyze_weather
+import prompt_encoding
+from forecast_store import FORECAST_COLUMNS, ForecastStore
+
+
+def forecast(temps, humidity=60.0, rain=10.0):
+    times = pd.date_range("2030-01-01 00:00", periods=len(temps), freq="3h")
+    return pd.DataFrame({
+        "forecast_time": times.strftime("%Y-%m-%d %H:%M:%S"),
+        "temp_c": temps,
+        "humidity_percent": humidity,
+        "precipitation_prob_percent": rain,
+        "weather_condition": "Clear",
+    })
+
+
+def test_compact_shows_missing_values_as_dashes():
+    df = forecast([21.4, math.nan, math.inf])
+    df.loc[0, "humidity_percent"] = math.nan
+    lines = prompt_encoding.encode_compact(df).splitlines()
+    assert lines[1] == "01/01 00  21   -     10 Clear"
+    assert lines[2] == "      03   -  60     10"
+    assert lines[3] == "      06   -  60     10"
+
+
+def test_daily_leaves_missing_values_out():
+    df = forecast([18.0, math.nan, 24.6], rain=math.nan)
+    assert prompt_encoding.encode_daily(df).splitlines()[1] == "01/01   18   25  60         - Clear"
+
+
+def test_unknown_encoding_falls_back_to_auto(monkeypatch, capsys):
+    monkeypatch.setenv("PROMPT_ENCODING", "csv")
+    try:
+        module = importlib.reload(prompt_encoding)
+        assert module.PROMPT_ENCODING == "auto"
+        assert "PROMPT_ENCODING" in capsys.readouterr().out
+        _, encoding, _ = module.encode(forecast([20.0, 21.0]))
+        assert encoding in module.AUTO_ORDER
+    finally:
+        monkeypatch.delenv("PROMPT_ENCODING")
+        importlib.reload(prompt_encoding)
+
+
+def test_stored_forecast_with_null_readings_reaches_the_prompt(tmp_path):
+    # NULL temperature and humidity in the store come back as NaN
+    start = datetime.now().replace(minute=0, second=0, microsecond=0)
+    rows = []
+    for hours, temp in ((3, 21.0), (6, None), (9, 24.0)):
+        row = dict.fromkeys(FORECAST_COLUMNS)
+        row.update(latitude=36.8, longitude=10.2, forecast_time=start + timedelta(hours=hours), temp_c=temp,
+                   humidity_percent=None if temp is None else 55.0, precipitation_prob_percent=0.0,
+                   weather_condition="Clear")
+        rows.append(row)
+    path = str(tmp_path / "forecasts.db")
+    store = ForecastStore(path)
+    store.append(rows)
+    store.close()
+
+    snapshot = analyze_weather.ForecastSnapshot(path)
+    snapshot.load()
+    df, data_string, fingerprint = snapshot.get(now=start)
+    assert len(df) == 3
+    # the missing slot is sent as "-" (the sky is only written on the first slot)
+    assert [line.split()[-3:] for line in data_string.splitlines()[2:]] == [["-", "-", "0"], ["24", "55", "0"]]
+    key = analyze_weather.recommendation_cache_key("recommendation", df, fingerprint=fingerprint)
+    assert key == analyze_weather.recommendation_cache_key("recommendation", df)
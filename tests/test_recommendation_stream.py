@@ -0,0 +1,63 @@
+import asyncio
+import json
+
+import pytest
+
+
+@pytest.fixture
+def saved(main, monkeypatch):
+    """The recommendations the SSE stream hands to the writer, as (args, fields)."""
+    calls = []
+
+    async def submit_recommendation(*args, **fields):
+        calls.append((args, fields))
+
+    monkeypatch.setattr(main.writer, "submit_recommendation", submit_recommendation)
+    return calls
+
+
+def events(lines):
+    """(event, data) pairs of SSE lines."""
+    parsed = []
+    for line in lines:
+        event, data = line.strip().split("\n")
+        parsed.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return parsed
+
+
+async def test_engine_answer_is_saved_with_its_source(main, saved, monkeypatch):
+    monkeypatch.setattr(main, "_engine_answer", lambda decision: "Pas d'arrosage aujourd'hui.")
+    lines = [line async for line in main._recommendation_events([], "key", {}, (36.8, 10.2))]
+    assert [event for event, _ in events(lines)] == ["delta", "done"]
+    assert saved == [((36.8, 10.2, "Pas d'arrosage aujourd'hui."), {"source": "engine"})]
+
+
+async def test_cached_llm_answer_is_saved_with_its_source(main, saved, monkeypatch):
+    monkeypatch.setattr(main, "_engine_answer", lambda decision: None)
+    monkeypatch.setattr(main.analyze_weather.recommendation_cache, "get", lambda key: "Arroser ce soir.")
+    lines = [line async for line in main._recommendation_events([], "key", None, (36.8, 10.2))]
+    assert events(lines)[-1][1]["recommendation"] == "Arroser ce soir."
+    assert saved == [((36.8, 10.2, "Arroser ce soir."), {"source": "llm"})]
+
+
+async def test_llm_stage_times_the_model_not_the_client(main, saved, monkeypatch):
+    observed = []
+
+    async def stream_completion(messages, **options):
+        for delta in ("Arroser ", "ce soir."):
+            await asyncio.sleep(0.01)
+            yield delta
+
+    monkeypatch.setattr(main, "_engine_answer", lambda decision: None)
+    monkeypatch.setattr(main.analyze_weather.recommendation_cache, "get", lambda key: None)
+    monkeypatch.setattr(main.analyze_weather, "stream_completion", stream_completion)
+    monkeypatch.setattr(main.metrics.pipeline_stage_seconds, "observe",
+                        lambda value, **labels: observed.append((labels["stage"], value)))
+    lines = []
+    async for line in main._recommendation_events([], "key", None, (36.8, 10.2)):
+        lines.append(line)
+        await asyncio.sleep(0.2)  # slow client
+    assert events(lines)[-1][1]["recommendation"] == "Arroser ce soir."
+    [(stage, seconds)] = observed
+    assert stage == "llm"
+    assert 0.02 <= seconds < 0.2
@@ -0,0 +1,116 @@
+import gzip
+import json
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+import requests
+
+import get_weather
+import llm
+import replay
+from resilience import CircuitBreaker, TokenBucket
+
+MESSAGES = [{"role": "user", "content": "Faut-il arroser ?"}]
+
+
+def owm_response(start, temps):
+    return {
+        "city": {"name": "Tunis"},
+        "list": [
+            {
+                "dt_txt": (start + timedelta(hours=3 * i)).strftime(replay.TIME_FORMAT),
+                "main": {"temp": temp, "feels_like": temp, "temp_min": temp, "temp_max": temp, "humidity": 60},
+                "weather": [{"description": "ciel dégagé"}],
+                "wind": {"speed": 3.0},
+                "clouds": {"all": 0},
+                "pop": 0.2,
+            }
+            for i, temp in enumerate(temps)
+        ],
+    }
+
+
+class RecordedSession:
+    """Answers every forecast request with the same body."""
+
+    def __init__(self, body):
+        self.body = body
+
+    def get(self, *args, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps(self.body).encode("utf-8")
+        return response
+
+
+@pytest.fixture
+def corpus(monkeypatch, tmp_path):
+    corpus = replay.Corpus(str(tmp_path / "corpus.jsonl.gz"))
+    monkeypatch.setattr(replay, "_corpus", corpus)
+    monkeypatch.setattr(get_weather, "circuit_breaker", CircuitBreaker())
+    monkeypatch.setattr(get_weather, "rate_limiter", TokenBucket(rate=1000, capacity=1000))
+    return corpus
+
+
+async def test_recorded_responses_are_replayed(monkeypatch, corpus):
+    start = datetime.now().replace(minute=0, second=0, microsecond=0) + timedelta(hours=3)
+    monkeypatch.setattr(replay, "MODE", "record")
+    monkeypatch.setattr(get_weather, "get_session", lambda: RecordedSession(owm_response(start, [20.0, 21.5])))
+    recorded = get_weather.fetch_weather_api(36.8, 10.2, "key")
+    provider = llm.RecordingProvider(llm.FakeProvider(latency=0), corpus)
+    answer = await provider.complete(MESSAGES, 100, 0.2)
+    assert corpus.recorded == 2
+
+    # Replay from the file, without network access
+    monkeypatch.setattr(replay, "MODE", "replay")
+    monkeypatch.setattr(get_weather, "get_session", None)
+    monkeypatch.setattr(replay, "_corpus", replay.Corpus(corpus.path))
+    replayed = get_weather.fetch_weather_api(36.8, 10.2, "replay")
+    assert replayed.equals(recorded)
+    assert await llm.ReplayProvider(replay.get_corpus(), latency=0).complete(MESSAGES, 100, 0.2) == answer
+    assert replay.get_corpus().stats()["exact"] == 2
+
+
+def test_unknown_requests_get_the_nearest_or_a_similar_recording(corpus):
+    corpus.record_weather(36.8, 10.2, b'{"list": []}')
+    corpus.record_weather(33.9, 8.1, b'{"list": [], "city": {"name": "Tozeur"}}')
+    corpus.record_completion(MESSAGES, None, "Arrosez ce soir.")
+
+    replayed = replay.Corpus(corpus.path)
+    assert replayed.load() == 3
+    assert json.loads(replayed.weather(34.0, 8.0))["city"]["name"] == "Tozeur"
+    assert replayed.completion([{"role": "user", "content": "Et demain ?"}]) == "Arrosez ce soir."
+    with pytest.raises(LookupError):
+        replayed.completion(MESSAGES, {"type": "json_object"})
+    assert (replayed.exact, replayed.fallback) == (0, 2)
+
+
+def test_old_recording_is_moved_to_start_now(corpus):
+    recorded_at = datetime.now() - timedelta(hours=7)
+    body = owm_response(recorded_at.replace(minute=0, second=0, microsecond=0), [20.0, 21.0])
+    with gzip.open(corpus.path, "at", encoding="utf-8") as f:
+        f.write(json.dumps({"kind": "weather", "key": "36.80,10.20",
+                            "recorded_at": recorded_at.strftime(replay.TIME_FORMAT), "body": json.dumps(body)}) + "\n")
+
+    shifted = json.loads(corpus.weather(36.8, 10.2))
+    # Two whole 3-hour steps
+    moved = datetime.strptime(body["list"][0]["dt_txt"], replay.TIME_FORMAT) + timedelta(hours=6)
+    assert shifted["list"][0]["dt_txt"] == moved.strftime(replay.TIME_FORMAT)
+
+
+def test_lookups_from_many_threads_are_all_counted(corpus):
+    corpus.record_weather(36.8, 10.2, b'{"list": []}')
+    corpus.load()
+
+    def lookups():
+        for _ in range(500):
+            corpus.weather(36.8, 10.2)
+            corpus.weather(35.0, 10.0)
+
+    threads = [threading.Thread(target=lookups) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert (corpus.exact, corpus.fallback) == (4000, 4000)
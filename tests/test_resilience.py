@@ -0,0 +1,31 @@
+import pytest
+
+from resilience import TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_refills_at_its_rate():
+    clock = Clock()
+    bucket = TokenBucket(1.0, capacity=1, clock=clock)
+    assert bucket.acquire(timeout=0)
+    assert not bucket.acquire(timeout=0.5)
+    clock.now = 1.0
+    assert bucket.acquire(timeout=0)
+
+
+@pytest.mark.parametrize("calls", [0, -5])
+def test_per_minute_rejects_a_budget_without_calls(calls):
+    with pytest.raises(ValueError):
+        TokenBucket.per_minute(calls)
+
+
+def test_zero_rate_is_rejected():
+    with pytest.raises(ValueError):
+        TokenBucket(0)
@@ -0,0 +1,43 @@
+import math
+
+import numpy as np
+
+import sensors
+
+
+def test_ndjson_non_finite_values_are_rejected():
+    store = sensors.SensorStore()
+    body = "\n".join([
+        '{"sensor": "f1", "ts": 100, "humidity": NaN, "temperature": 24.5}',
+        '{"sensor": "f1", "ts": 101, "wind": Infinity}',
+        '{"sensor": "f1", "ts": 102, "metric": "rainProb", "value": -Infinity}',
+    ])
+    accepted, latest = store.ingest_ndjson(body)
+    assert accepted == 1
+    assert latest == {"temperature": 24.5}
+    assert store.rejected == 3
+    changes = sensors.state_changes(latest)
+    assert all(not isinstance(v, float) or math.isfinite(v) for v in changes.values())
+
+
+def test_ndjson_latest_ignores_a_newer_non_finite_reading():
+    store = sensors.SensorStore()
+    accepted, latest = store.ingest_ndjson(
+        '{"sensor": "f1", "ts": 100, "humidity": 40}\n{"sensor": "f1", "ts": 200, "humidity": NaN}'
+    )
+    assert accepted == 1
+    assert latest == {"humidity": 40.0}
+
+
+def test_binary_non_finite_values_are_rejected():
+    store = sensors.SensorStore()
+    humidity = sensors.METRIC_CODES.index("humidity")
+    wind = sensors.METRIC_CODES.index("wind")
+    data = np.array(
+        [(100.0, humidity, 40.0), (200.0, humidity, np.nan), (100.0, wind, np.inf)],
+        dtype=sensors.BINARY_RECORD,
+    )
+    accepted, latest = store.ingest_binary("f1", data.tobytes())
+    assert accepted == 1
+    assert latest == {"humidity": 40.0}
+    assert store.rejected == 2
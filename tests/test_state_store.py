@@ -0,0 +1,59 @@
+import json
+
+from state_store import VersionedState
+
+INITIAL = {"humidity": 65, "pumpOn": False, "wind": 10}
+
+
+def test_delta_from_an_older_revision_holds_the_keys_changed_since():
+    state = VersionedState(INITIAL)
+    state.update({"humidity": 60})
+    state.update({"pumpOn": True})
+    state.update({"humidity": 55, "wind": 10})  # wind unchanged
+    assert state.since(1) == (3, {"pumpOn": True, "humidity": 55})
+    assert state.since(2) == (3, {"humidity": 55})
+    assert state.since(0) == (3, {"humidity": 55, "pumpOn": True})
+
+
+def test_update_without_a_change_keeps_the_revision():
+    state = VersionedState(INITIAL)
+    assert state.update({"humidity": 65, "unknown": 1}) == (0, {})
+    assert state.rev == 0
+
+
+def test_since_the_current_revision_is_empty():
+    state = VersionedState(INITIAL)
+    state.update({"humidity": 60})
+    assert state.since(1) == (1, {})
+
+
+def test_since_a_revision_older_than_the_history_needs_a_full_snapshot():
+    state = VersionedState(INITIAL, history_size=2)
+    for humidity in (60, 61, 62):
+        state.update({"humidity": humidity})
+    assert state.since(0) == (3, None)
+    assert state.since(1) == (3, {"humidity": 62})
+    # A revision from another server run (ahead of this one)
+    assert state.since(7) == (3, None)
+
+
+def test_reset_drops_the_deltas_of_the_replaced_state():
+    state = VersionedState(INITIAL)
+    state.update({"humidity": 60})
+    state.reset(10, {"humidity": 50, "pumpOn": True})
+    assert state.snapshot() == (10, {"humidity": 50, "pumpOn": True, "wind": 10})
+    assert state.since(10) == (10, {})
+    assert state.since(1) == (10, None)
+
+
+async def test_get_state_falls_back_to_the_full_state(main, monkeypatch):
+    state = VersionedState(INITIAL, history_size=1)
+    monkeypatch.setattr(main, "state", state)
+    state.update({"humidity": 60})
+    state.update({"humidity": 55})
+
+    delta = json.loads((await main.get_state(since=1)).body)
+    assert delta == {"base": 1, "rev": 2, "changes": {"humidity": 55}}
+    full = await main.get_state(since=0)
+    assert full.headers["X-State-Rev"] == "2"
+    assert json.loads(full.body)["state"] == {**INITIAL, "humidity": 55}